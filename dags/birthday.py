@@ -1,53 +1,88 @@
 from __future__ import annotations
 
-# [START tutorial]
-# [START import_module]
+import sys
 from datetime import datetime, timedelta
+from pathlib import Path
 
-from airflow import DAG
-from airflow.operators.bash import BashOperator
-from airflow.operators.python import PythonOperator
-
-from src import partycleaner
-
-# [END import_module]
-
-
-# [START instantiate_dag]
-with DAG(
-        "birthday",
-        # [START default_args]
-        default_args={
-            "depends_on_past": False,
-            "email": ["airflow@example.com"],
-            "email_on_failure": False,
-            "email_on_retry": False,
-            "retries": 1,
-            "retry_delay": timedelta(minutes=5),
-        },
-        # [END default_args]
-        description="A simple tutorial DAG",
-        schedule=timedelta(days=1),
-        start_date=datetime(2021, 1, 1),
-        catchup=False,
-        tags=["example"],
-) as dag:
-    # [END instantiate_dag]
-
-    # [START birthday_tasks]
-    t1 = PythonOperator(dag=dag,
-                        task_id='clean_party',
-                        provide_context=False,
-                        python_callable=main,
-                        op_args=['arguments_passed_to_callable'],
-                        op_kwargs={'keyword_argument': 'which will be passed to function'})
-
-    t2 = BashOperator(
-        task_id="make_party",
-        depends_on_past=False,
-        bash_command="python -m partymaker.py",
+from airflow.decorators import dag, task
+
+# Модули бота импортируются плоско (import config, import data),
+# поэтому папка src добавляется в sys.path. Сами модули импортируются
+# только внутри задач, чтобы разбор DAG шедулером оставался быстрым
+SRC_DIR = str(Path(__file__).resolve().parents[1] / "src")
+
+# Все задачи, которые ходят в телеграм, работают через этот пул.
+# Его размер задает, сколько задач одновременно используют аккаунт бота
+TELEGRAM_POOL = "telegram"
+
+
+def _planning():
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+
+    import planning
+
+    return planning
+
+
+@dag(
+    "birthday",
+    default_args={
+        "depends_on_past": False,
+        "email_on_failure": False,
+        "email_on_retry": False,
+        "retries": 2,
+        "retry_delay": timedelta(minutes=5),
+    },
+    description="Создание и удаление чатов дней рождения",
+    schedule=timedelta(days=1),
+    start_date=datetime(2024, 1, 1),
+    catchup=False,
+    max_active_runs=1,
+    tags=["birthday_dog"],
+)
+def birthday():
+    @task(retries=3)
+    def plan_cleanup() -> list[int]:
+        return _planning().plan_cleanup()
+
+    @task(retries=3)
+    def plan_creations() -> list[int]:
+        return _planning().plan_creations()
+
+    @task(pool=TELEGRAM_POOL)
+    def notify_chats() -> None:
+        _planning().notify_chats()
+
+    # Уведомления и очистка независимы: ошибка одной задачи не блокирует остальные
+    @task(pool=TELEGRAM_POOL, max_active_tis_per_dag=2, retries=3, trigger_rule="all_done")
+    def clean_chat(chat_id: int) -> list:
+        return _planning().clean_chat(chat_id)
+
+    # Создание чата долгое и не должно повторяться целиком из-за мелкой ошибки.
+    # Повтор продолжает уже созданный чат, а не создает второй (planning.create_party)
+    @task(
+        pool=TELEGRAM_POOL,
+        max_active_tis_per_dag=1,
+        retries=1,
+        execution_timeout=timedelta(hours=6),
+        trigger_rule="all_done",
     )
-    # [END birthday_tasks]
+    def create_party(bdayer_id: int) -> list:
+        return _planning().create_party(bdayer_id)
+
+    @task(pool=TELEGRAM_POOL, trigger_rule="all_done")
+    def send_report(cleaned: list, created: list) -> None:
+        events = [event for result in (*cleaned, *created) if result for event in result]
+        _planning().send_report(events)
+
+    notified = notify_chats()
+    cleaned = clean_chat.expand(chat_id=plan_cleanup())
+    created = create_party.expand(bdayer_id=plan_creations())
+
+    notified >> cleaned
+    cleaned >> created
+    send_report(cleaned, created)
+
 
-    t1 >> t2
-# [END birthday]
+birthday()
@@ -1,16 +1,12 @@
 from logging.config import fileConfig
 
 from alembic import context
-from dotenv import load_dotenv
 from sqlalchemy import engine_from_config
 from sqlalchemy import pool
 
-from config import dsn
+from config import get_settings
 from models import Base
 
-if not load_dotenv():
-    raise Exception(".env file not found! Please create it in src folder!")
-
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
@@ -27,7 +23,7 @@ if config.config_file_name is not None:
 target_metadata = Base.metadata
 
 # DB connection
-config.set_main_option("sqlalchemy.url", dsn)
+config.set_main_option("sqlalchemy.url", get_settings().dsn)
 
 
 def run_migrations_offline() -> None:
@@ -0,0 +1,51 @@
+"""telegram session tables
+
+Revision ID: 7c1e9a2b5d40
+Revises: 4292a8985146
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c1e9a2b5d40'
+down_revision: Union[str, None] = '4292a8985146'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('tg_sessions',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('dc_id', sa.Integer(), nullable=False),
+    sa.Column('server_address', sa.String(length=64), nullable=True),
+    sa.Column('port', sa.Integer(), nullable=True),
+    sa.Column('auth_key', sa.LargeBinary(length=256), nullable=True),
+    sa.Column('takeout_id', sa.BigInteger(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.create_table('tg_entities',
+    sa.Column('session_name', sa.String(length=64), nullable=False),
+    sa.Column('id', sa.BigInteger(), autoincrement=False, nullable=False),
+    sa.Column('hash', sa.BigInteger(), nullable=False),
+    sa.Column('username', sa.String(length=32), nullable=True),
+    sa.Column('phone', sa.String(length=32), nullable=True),
+    sa.Column('name', sa.String(length=255), nullable=True),
+    sa.Column('date', sa.BigInteger(), nullable=True),
+    sa.ForeignKeyConstraint(['session_name'], ['tg_sessions.name'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('session_name', 'id')
+    )
+    op.create_index(op.f('ix_tg_entities_phone'), 'tg_entities', ['phone'], unique=False)
+    op.create_index(op.f('ix_tg_entities_username'), 'tg_entities', ['username'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_tg_entities_username'), table_name='tg_entities')
+    op.drop_index(op.f('ix_tg_entities_phone'), table_name='tg_entities')
+    op.drop_table('tg_entities')
+    op.drop_table('tg_sessions')
@@ -0,0 +1,43 @@
+"""runs table
+
+Revision ID: a41f6c0d93e2
+Revises: 7c1e9a2b5d40
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41f6c0d93e2'
+down_revision: Union[str, None] = '7c1e9a2b5d40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('runs',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('command', sa.String(length=32), nullable=False),
+    sa.Column('started_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('duration', sa.Float(), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('stages', sa.JSON(), nullable=False),
+    sa.Column('api_calls', sa.JSON(), nullable=False),
+    sa.Column('api_calls_total', sa.Integer(), nullable=False),
+    sa.Column('sleep_seconds', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_runs_command'), 'runs', ['command'], unique=False)
+    op.create_index(op.f('ix_runs_started_at'), 'runs', ['started_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_runs_started_at'), table_name='runs')
+    op.drop_index(op.f('ix_runs_command'), table_name='runs')
+    op.drop_table('runs')
@@ -0,0 +1,43 @@
+"""chat invites party date
+
+Revision ID: a8e2c5f0d7b3
+Revises: f2b8d4a0c6e3
+Create Date: 2026-10-20 01:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8e2c5f0d7b3'
+down_revision: Union[str, None] = 'f2b8d4a0c6e3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('chat_invites', sa.Column('party_date', sa.Date(), nullable=True))
+    # Существующие строки относятся к текущему чату в канале
+    op.execute(
+        'UPDATE chat_invites JOIN chats ON chats.chat_id = chat_invites.chat_id '
+        'SET chat_invites.party_date = DATE(chats.created_at)'
+    )
+    op.alter_column('chat_invites', 'party_date', existing_type=sa.Date(), nullable=False)
+    op.execute('ALTER TABLE chat_invites DROP PRIMARY KEY, ADD PRIMARY KEY (chat_id, party_date, tg_id)')
+    op.create_index('ix_chat_invites_chat_id_party_date_status_priority', 'chat_invites', ['chat_id', 'party_date', 'status', 'priority'], unique=False)
+    op.drop_index('ix_chat_invites_chat_id_status_priority', table_name='chat_invites')
+
+
+def downgrade() -> None:
+    op.create_index('ix_chat_invites_chat_id_status_priority', 'chat_invites', ['chat_id', 'status', 'priority'], unique=False)
+    op.drop_index('ix_chat_invites_chat_id_party_date_status_priority', table_name='chat_invites')
+    # Остается только очередь текущего чата в каждом канале
+    op.execute(
+        'DELETE chat_invites FROM chat_invites JOIN chats ON chats.chat_id = chat_invites.chat_id '
+        'WHERE chat_invites.party_date <> DATE(chats.created_at)'
+    )
+    op.execute('ALTER TABLE chat_invites DROP PRIMARY KEY, ADD PRIMARY KEY (chat_id, tg_id)')
+    op.drop_column('chat_invites', 'party_date')
@@ -0,0 +1,37 @@
+"""users birth_doy
+
+Revision ID: b2e6f0a8c7d5
+Revises: a9c4e2f7b1d3
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2e6f0a8c7d5'
+down_revision: Union[str, None] = 'a9c4e2f7b1d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Хранимый вычисляемый столбец: значения для существующих пользователей заполняются при добавлении столбца
+    op.add_column('users', sa.Column(
+        'birth_doy',
+        sa.Integer(),
+        sa.Computed(
+            'dayofyear(makedate(2000, 1) + interval (birth_month - 1) month + interval (birth_day - 1) day)',
+            persisted=True,
+        ),
+        nullable=True,
+    ))
+    op.create_index('ix_users_tenant_id_birth_doy', 'users', ['tenant_id', 'birth_doy'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_tenant_id_birth_doy', table_name='users')
+    op.drop_column('users', 'birth_doy')
@@ -0,0 +1,26 @@
+"""outbox available at
+
+Revision ID: b5d1f7e3a9c2
+Revises: a8e2c5f0d7b3
+Create Date: 2026-10-20 02:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5d1f7e3a9c2'
+down_revision: Union[str, None] = 'a8e2c5f0d7b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('outbox', sa.Column('available_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('outbox', 'available_at')
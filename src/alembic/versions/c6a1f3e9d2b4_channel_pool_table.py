@@ -0,0 +1,34 @@
+"""channel pool table
+
+Revision ID: c6a1f3e9d2b4
+Revises: b2e6f0a8c7d5
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c6a1f3e9d2b4'
+down_revision: Union[str, None] = 'b2e6f0a8c7d5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('channel_pool',
+    sa.Column('channel_id', sa.BigInteger(), autoincrement=False, nullable=False),
+    sa.Column('tenant_id', sa.Integer(), server_default='1', nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('released_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('taken_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('channel_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('channel_pool')
@@ -0,0 +1,122 @@
+"""chats surrogate id
+
+Revision ID: c9f3a7d1e5b8
+Revises: b5d1f7e3a9c2
+Create Date: 2026-10-20 03:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9f3a7d1e5b8'
+down_revision: Union[str, None] = 'b5d1f7e3a9c2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+CHAT_TABLES = ('bank_accounts', 'chat_stats', 'chat_invites', 'chat_archives')
+
+
+def drop_chat_foreign_keys() -> None:
+    # Внешние ключи на chats создавались без имени, поэтому имена берутся из БД
+    inspector = sa.inspect(op.get_bind())
+    for table in CHAT_TABLES:
+        for fk in inspector.get_foreign_keys(table):
+            if fk['referred_table'] == 'chats':
+                op.drop_constraint(fk['name'], table, type_='foreignkey')
+
+
+def upgrade() -> None:
+    drop_chat_foreign_keys()
+
+    # Каждый чат в канале из пула - отдельная запись
+    op.create_index('ix_chats_chat_id', 'chats', ['chat_id'], unique=False)
+    op.execute('ALTER TABLE chats DROP PRIMARY KEY, ADD COLUMN id INT NOT NULL AUTO_INCREMENT PRIMARY KEY FIRST')
+
+    op.execute('UPDATE bank_accounts JOIN chats ON chats.chat_id = bank_accounts.used_in SET bank_accounts.used_in = chats.id')
+    op.alter_column('bank_accounts', 'used_in', existing_type=sa.BigInteger(), type_=sa.Integer(), existing_nullable=True)
+    op.create_foreign_key(None, 'bank_accounts', 'chats', ['used_in'], ['id'], ondelete='SET NULL')
+
+    # Строки прошлых чатов в канале, запись которых была перезаписана, отнести не к чему - они удаляются
+    op.add_column('chat_stats', sa.Column('party_id', sa.Integer(), nullable=True))
+    op.execute(
+        'UPDATE chat_stats JOIN chats ON chats.chat_id = chat_stats.chat_id '
+        'SET chat_stats.party_id = chats.id WHERE chat_stats.day >= DATE(chats.created_at)'
+    )
+    op.execute('DELETE FROM chat_stats WHERE party_id IS NULL')
+    op.alter_column('chat_stats', 'party_id', existing_type=sa.Integer(), nullable=False)
+    op.execute('ALTER TABLE chat_stats DROP PRIMARY KEY, ADD PRIMARY KEY (party_id, day)')
+    op.drop_column('chat_stats', 'chat_id')
+    op.create_foreign_key(None, 'chat_stats', 'chats', ['party_id'], ['id'], ondelete='CASCADE')
+
+    op.add_column('chat_invites', sa.Column('party_id', sa.Integer(), nullable=True))
+    op.execute(
+        'UPDATE chat_invites JOIN chats ON chats.chat_id = chat_invites.chat_id '
+        'AND chat_invites.party_date = DATE(chats.created_at) SET chat_invites.party_id = chats.id'
+    )
+    op.execute('DELETE FROM chat_invites WHERE party_id IS NULL')
+    op.alter_column('chat_invites', 'party_id', existing_type=sa.Integer(), nullable=False)
+    op.drop_index('ix_chat_invites_chat_id_party_date_status_priority', table_name='chat_invites')
+    op.execute('ALTER TABLE chat_invites DROP PRIMARY KEY, ADD PRIMARY KEY (party_id, tg_id)')
+    op.drop_column('chat_invites', 'party_date')
+    op.drop_column('chat_invites', 'chat_id')
+    op.create_index('ix_chat_invites_party_id_status_priority', 'chat_invites', ['party_id', 'status', 'priority'], unique=False)
+    op.create_foreign_key(None, 'chat_invites', 'chats', ['party_id'], ['id'], ondelete='CASCADE')
+
+    op.add_column('chat_archives', sa.Column('party_id', sa.Integer(), nullable=True))
+    op.execute(
+        'UPDATE chat_archives JOIN chats ON chats.chat_id = chat_archives.chat_id '
+        'SET chat_archives.party_id = chats.id WHERE chat_archives.started_at >= chats.created_at'
+    )
+    op.execute('DELETE FROM chat_archives WHERE party_id IS NULL')
+    op.alter_column('chat_archives', 'party_id', existing_type=sa.Integer(), nullable=False)
+    op.drop_column('chat_archives', 'chat_id')
+    op.create_foreign_key(None, 'chat_archives', 'chats', ['party_id'], ['id'])
+
+
+def downgrade() -> None:
+    drop_chat_foreign_keys()
+
+    # Остается только текущий чат в каждом канале
+    op.execute('DELETE chats FROM chats JOIN chats AS newer ON newer.chat_id = chats.chat_id AND newer.id > chats.id')
+    for table in ('chat_stats', 'chat_invites', 'chat_archives'):
+        op.execute(f'DELETE FROM {table} WHERE party_id NOT IN (SELECT id FROM chats)')
+
+    op.add_column('chat_archives', sa.Column('chat_id', sa.BigInteger(), nullable=True))
+    op.execute('UPDATE chat_archives JOIN chats ON chats.id = chat_archives.party_id SET chat_archives.chat_id = chats.chat_id')
+    op.alter_column('chat_archives', 'chat_id', existing_type=sa.BigInteger(), nullable=False)
+    op.drop_column('chat_archives', 'party_id')
+
+    op.add_column('chat_invites', sa.Column('chat_id', sa.BigInteger(), nullable=True))
+    op.add_column('chat_invites', sa.Column('party_date', sa.Date(), nullable=True))
+    op.execute(
+        'UPDATE chat_invites JOIN chats ON chats.id = chat_invites.party_id '
+        'SET chat_invites.chat_id = chats.chat_id, chat_invites.party_date = DATE(chats.created_at)'
+    )
+    op.alter_column('chat_invites', 'chat_id', existing_type=sa.BigInteger(), nullable=False)
+    op.alter_column('chat_invites', 'party_date', existing_type=sa.Date(), nullable=False)
+    op.drop_index('ix_chat_invites_party_id_status_priority', table_name='chat_invites')
+    op.execute('ALTER TABLE chat_invites DROP PRIMARY KEY, ADD PRIMARY KEY (chat_id, party_date, tg_id)')
+    op.drop_column('chat_invites', 'party_id')
+    op.create_index('ix_chat_invites_chat_id_party_date_status_priority', 'chat_invites', ['chat_id', 'party_date', 'status', 'priority'], unique=False)
+
+    op.add_column('chat_stats', sa.Column('chat_id', sa.BigInteger(), nullable=True))
+    op.execute('UPDATE chat_stats JOIN chats ON chats.id = chat_stats.party_id SET chat_stats.chat_id = chats.chat_id')
+    op.alter_column('chat_stats', 'chat_id', existing_type=sa.BigInteger(), nullable=False)
+    op.execute('ALTER TABLE chat_stats DROP PRIMARY KEY, ADD PRIMARY KEY (chat_id, day)')
+    op.drop_column('chat_stats', 'party_id')
+
+    op.execute('UPDATE bank_accounts SET used_in = NULL WHERE used_in NOT IN (SELECT id FROM chats)')
+    op.alter_column('bank_accounts', 'used_in', existing_type=sa.Integer(), type_=sa.BigInteger(), existing_nullable=True)
+    op.execute('UPDATE bank_accounts JOIN chats ON chats.id = bank_accounts.used_in SET bank_accounts.used_in = chats.chat_id')
+
+    op.execute('ALTER TABLE chats DROP COLUMN id, ADD PRIMARY KEY (chat_id)')
+    op.drop_index('ix_chats_chat_id', table_name='chats')
+
+    op.create_foreign_key(None, 'bank_accounts', 'chats', ['used_in'], ['chat_id'], ondelete='SET NULL')
+    op.create_foreign_key(None, 'chat_stats', 'chats', ['chat_id'], ['chat_id'], ondelete='CASCADE')
+    op.create_foreign_key(None, 'chat_invites', 'chats', ['chat_id'], ['chat_id'], ondelete='CASCADE')
+    op.create_foreign_key(None, 'chat_archives', 'chats', ['chat_id'], ['chat_id'])
@@ -0,0 +1,42 @@
+"""chat invites table and user tags
+
+Revision ID: d4f8b2a6e0c9
+Revises: c6a1f3e9d2b4
+Create Date: 2026-10-19 22:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4f8b2a6e0c9'
+down_revision: Union[str, None] = 'c6a1f3e9d2b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('tags', sa.JSON(), nullable=True))
+    op.create_table('chat_invites',
+    sa.Column('chat_id', sa.BigInteger(), nullable=False),
+    sa.Column('tg_id', sa.BigInteger(), nullable=False),
+    sa.Column('priority', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('error', sa.String(length=64), nullable=True),
+    sa.Column('attempted_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['chat_id'], ['chats.chat_id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['tg_id'], ['users.tg_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('chat_id', 'tg_id')
+    )
+    op.create_index('ix_chat_invites_chat_id_status_priority', 'chat_invites', ['chat_id', 'status', 'priority'], unique=False)
+    op.create_index('ix_chat_invites_attempted_at', 'chat_invites', ['attempted_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_chat_invites_attempted_at', table_name='chat_invites')
+    op.drop_index('ix_chat_invites_chat_id_status_priority', table_name='chat_invites')
+    op.drop_table('chat_invites')
+    op.drop_column('users', 'tags')
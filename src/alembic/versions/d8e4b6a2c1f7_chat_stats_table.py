@@ -0,0 +1,34 @@
+"""chat stats table
+
+Revision ID: d8e4b6a2c1f7
+Revises: c3f9a1d7e5b2
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd8e4b6a2c1f7'
+down_revision: Union[str, None] = 'c3f9a1d7e5b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('chat_stats',
+    sa.Column('chat_id', sa.BigInteger(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('participants', sa.Integer(), nullable=False),
+    sa.Column('users_added', sa.Integer(), nullable=False),
+    sa.Column('users_invited', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['chat_id'], ['chats.chat_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('chat_id', 'day')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('chat_stats')
@@ -0,0 +1,34 @@
+"""invitability table
+
+Revision ID: e1a7c3b9d4f0
+Revises: d8e4b6a2c1f7
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1a7c3b9d4f0'
+down_revision: Union[str, None] = 'd8e4b6a2c1f7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('invitability',
+    sa.Column('tg_id', sa.BigInteger(), nullable=False),
+    sa.Column('reachable', sa.Boolean(), nullable=False),
+    sa.Column('reason', sa.String(length=64), nullable=True),
+    sa.Column('checked_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['tg_id'], ['users.tg_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('tg_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('invitability')
@@ -0,0 +1,47 @@
+"""events table
+
+Revision ID: e7c3a9f1b5d8
+Revises: d4f8b2a6e0c9
+Create Date: 2026-10-19 23:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7c3a9f1b5d8'
+down_revision: Union[str, None] = 'd4f8b2a6e0c9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('events',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('tenant_id', sa.Integer(), server_default='1', nullable=False),
+    sa.Column('kind', sa.String(length=32), nullable=False),
+    sa.Column('tg_id', sa.BigInteger(), nullable=True),
+    sa.Column('chat_id', sa.BigInteger(), nullable=True),
+    sa.Column('due_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('dedup_key', sa.String(length=128), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('locked_until', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('dedup_key')
+    )
+    op.create_index('ix_events_tenant_id_status_due_at', 'events', ['tenant_id', 'status', 'due_at'], unique=False)
+    op.create_index('ix_events_tg_id_kind_status', 'events', ['tg_id', 'kind', 'status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_events_tg_id_kind_status', table_name='events')
+    op.drop_index('ix_events_tenant_id_status_due_at', table_name='events')
+    op.drop_table('events')
@@ -0,0 +1,31 @@
+"""rate buckets table
+
+Revision ID: f2b8d4a0c6e3
+Revises: e7c3a9f1b5d8
+Create Date: 2026-10-20 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2b8d4a0c6e3'
+down_revision: Union[str, None] = 'e7c3a9f1b5d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('rate_buckets',
+    sa.Column('bucket', sa.String(length=128), nullable=False),
+    sa.Column('tokens', sa.Float(precision=53), nullable=False),
+    sa.Column('refilled_at', sa.Float(precision=53), nullable=False),
+    sa.PrimaryKeyConstraint('bucket')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('rate_buckets')
@@ -0,0 +1,47 @@
+"""tenants
+
+Revision ID: f5b2d9e8a3c6
+Revises: e1a7c3b9d4f0
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f5b2d9e8a3c6'
+down_revision: Union[str, None] = 'e1a7c3b9d4f0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    tenants = op.create_table('tenants',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('main_chat_id', sa.BigInteger(), nullable=True),
+    sa.Column('admin_ids', sa.JSON(), nullable=True),
+    sa.Column('card_number', sa.String(length=32), nullable=True),
+    sa.Column('session_name', sa.String(length=64), nullable=True),
+    sa.Column('days_before', sa.Integer(), nullable=True),
+    sa.Column('days_after', sa.Integer(), nullable=True),
+    sa.Column('is_active', sa.Boolean(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    # Существующие данные принадлежат арендатору по умолчанию, его настройки берутся из .env
+    op.bulk_insert(tenants, [{'id': 1, 'name': 'default', 'is_active': True}])
+
+    for table in ('users', 'chats', 'bank_accounts', 'outbox', 'tasks'):
+        op.add_column(table, sa.Column('tenant_id', sa.Integer(), server_default='1', nullable=False))
+        op.create_foreign_key(f'{table}_tenant_id_fk', table, 'tenants', ['tenant_id'], ['id'])
+
+
+def downgrade() -> None:
+    for table in ('users', 'chats', 'bank_accounts', 'outbox', 'tasks'):
+        op.drop_constraint(f'{table}_tenant_id_fk', table, type_='foreignkey')
+        op.drop_column(table, 'tenant_id')
+    op.drop_table('tenants')
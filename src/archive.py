@@ -0,0 +1,159 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterable, NamedTuple, Optional, Set
+
+from telethon.sync import TelegramClient
+from telethon.tl.custom import Message
+from telethon.tl.types import PeerChannel
+
+import config
+import data
+import metrics
+from logger import logging
+
+
+class ArchiveResult(NamedTuple):
+    """
+    Итог выгрузки одного чата
+    """
+
+    messages: int
+    media_files: int
+    size_bytes: int
+
+
+class ChatArchiver:
+    """
+    Выгружает историю чатов в сжатый JSONL (одно сообщение на строку) перед удалением.
+    Сообщения пишутся в файл по мере получения, поэтому память не зависит от размера истории.
+    Несколько чатов выгружаются одновременно, но не больше config.ARCHIVE_CONCURRENCY
+    """
+
+    def __init__(self, client: TelegramClient):
+        self.client = client
+        self.directory: str = config.ARCHIVE_DIR
+        self.media: str = config.ARCHIVE_MEDIA
+        self.media_max_bytes: int = config.ARCHIVE_MEDIA_MAX_BYTES
+        self.concurrency: int = config.ARCHIVE_CONCURRENCY
+        self.timeout: int = config.ARCHIVE_TIMEOUT
+
+        # id файла в телеграме -> имя сохраненного файла, чтобы не скачивать пересланные копии повторно
+        self._media_files: Dict[int, str] = {}
+
+    @metrics.stage("archive_chats")
+    def archive_all(self, chat_ids: Iterable[int]) -> Set[int]:
+        """
+        Выгружает чаты, для которых еще нет готового архива
+
+        :param chat_ids: id чатов
+        :return: id чатов, у которых есть готовый архив (их можно удалять)
+        """
+        chat_ids = list(chat_ids)
+        archived = data.get_archived_chat_ids(chat_ids)
+        to_export = [chat_id for chat_id in chat_ids if chat_id not in archived]
+        if to_export:
+            archived |= self.client.loop.run_until_complete(self.export_all(to_export))
+        return archived
+
+    async def export_all(self, chat_ids: Iterable[int]) -> Set[int]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def export(chat_id: int) -> Optional[int]:
+            async with semaphore:
+                path = os.path.join(
+                    self.directory, f"{chat_id}-{datetime.now():%Y%m%d-%H%M%S}.jsonl.gz"
+                )
+                archive_id = data.start_archive(chat_id, path)
+                try:
+                    result = await asyncio.wait_for(self.export_chat(chat_id, path), self.timeout)
+                except Exception as e:
+                    logging.info("Не удалось выгрузить архив чата %s. Ошибка: %r", chat_id, e)
+                    data.finish_archive(archive_id, "failed", error=repr(e))
+                    return None
+
+                data.finish_archive(archive_id, "done", *result)
+                logging.info("Архив чата %s сохранен в %s: %s", chat_id, path, result)
+                return chat_id
+
+        results = await asyncio.gather(*(export(chat_id) for chat_id in chat_ids))
+        return {chat_id for chat_id in results if chat_id is not None}
+
+    async def export_chat(self, chat_id: int, path: str) -> ArchiveResult:
+        """
+        Выгружает историю одного чата. Файл появляется под итоговым именем только после успешной выгрузки
+
+        :param chat_id: id чата
+        :param path: путь к архиву
+        :return: итог выгрузки
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        partial = path + ".part"
+        messages = media_files = 0
+
+        with gzip.open(partial, "wt", encoding="utf-8") as f:
+            async for message in self.client.iter_messages(PeerChannel(chat_id), reverse=True):
+                record = self.message_record(message)
+                if message.media is not None and self.media == "dedup":
+                    saved = await self.save_media(message)
+                    if saved is not None:
+                        record["media_file"] = saved
+                        media_files += 1
+
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                messages += 1
+
+        os.replace(partial, path)
+        return ArchiveResult(messages, media_files, os.path.getsize(path))
+
+    @staticmethod
+    def message_record(message: Message) -> dict:
+        """
+        Строка архива для сообщения
+
+        :param message: сообщение
+        :return: словарь для JSON
+        """
+        return {
+            "id": message.id,
+            "date": message.date.isoformat() if message.date else None,
+            "sender_id": message.sender_id,
+            "text": message.message,
+            "reply_to": message.reply_to_msg_id,
+            "action": type(message.action).__name__ if message.action else None,
+            "media": type(message.media).__name__ if message.media else None,
+        }
+
+    async def save_media(self, message: Message) -> Optional[str]:
+        """
+        Сохраняет медиафайл в <ARCHIVE_DIR>/media под именем из sha256 содержимого.
+        Одинаковые файлы хранятся один раз
+
+        :param message: сообщение с медиа
+        :return: путь к файлу относительно ARCHIVE_DIR или None, если файл пропущен
+        """
+        file = message.file
+        if file is None or (file.size or 0) > self.media_max_bytes:
+            return None
+
+        media = message.photo or message.document
+        if media is not None and media.id in self._media_files:
+            return self._media_files[media.id]
+
+        content = await self.client.download_media(message, file=bytes)
+        if content is None:
+            return None
+
+        name = os.path.join("media", hashlib.sha256(content).hexdigest() + (file.ext or ""))
+        target = os.path.join(self.directory, name)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f:
+                f.write(content)
+
+        if media is not None:
+            self._media_files[media.id] = name
+        return name
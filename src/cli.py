@@ -0,0 +1,180 @@
+import argparse
+import sys
+from datetime import date, datetime
+from typing import List, Optional
+
+import config
+
+# Единая точка входа: python src/cli.py <команда>.
+# Модули бота импортируются внутри команд, а не здесь: справка и разбор аргументов не загружают
+# telethon, SQLAlchemy и pandas, а команды без телеграма (init-db, forecast, runs) не загружают telethon.
+# config использует только стандартную библиотеку и читает настройки лениво
+
+
+def _main(args: argparse.Namespace) -> None:
+    import main
+
+    main.daily_run()
+
+
+def _make(args: argparse.Namespace) -> None:
+    import partymaker
+
+    partymaker.make_today_party()
+
+
+def _clean(args: argparse.Namespace) -> None:
+    import partycleaner
+
+    partycleaner.clean_parties()
+
+
+def _reconcile(args: argparse.Namespace) -> None:
+    import new_old_users
+
+    new_old_users.reconcile()
+
+
+def _stats(args: argparse.Namespace) -> None:
+    import stats
+
+    stats.collect()
+
+
+def _outbox(args: argparse.Namespace) -> None:
+    import outbox
+
+    outbox.drain()
+
+
+def _daemon(args: argparse.Namespace) -> None:
+    import daemon
+
+    daemon.run_daemon()
+
+
+def _init_db(args: argparse.Namespace) -> None:
+    import data
+
+    data.create_db_and_tables()
+
+
+def _import_session(args: argparse.Namespace) -> None:
+    import session_store
+
+    session_store.import_sqlite_session(args.path, args.name)
+
+
+def _forecast(args: argparse.Namespace) -> None:
+    import forecast
+
+    forecast.report(args.start, args.days, args.before, args.after)
+
+
+def _runs(args: argparse.Namespace) -> None:
+    import runs
+
+    runs.report(args.command, args.last, args.threshold)
+
+
+def _events(args: argparse.Namespace) -> None:
+    import scheduler
+
+    if args.action == "schedule":
+        scheduler.schedule_all()
+    else:
+        scheduler.run_events()
+
+
+def _queue(args: argparse.Namespace) -> None:
+    import taskqueue
+
+    if args.action == "plan":
+        taskqueue.plan(args.send_invites)
+    else:
+        taskqueue.work(args.kind, args.once)
+
+
+def _tenants(args: argparse.Namespace) -> int:
+    import tenants
+
+    return 0 if tenants.run_job(args.job) else 1
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Парсер аргументов всех команд. Команда сохраняется в поле run
+
+    :return: парсер
+    """
+    parser = argparse.ArgumentParser(prog="cli.py", description="Собака Поздравляка")
+    subparsers = parser.add_subparsers(dest="subcommand", required=True, metavar="команда")
+
+    def add(name: str, run, help: str) -> argparse.ArgumentParser:
+        subparser = subparsers.add_parser(name, help=help, description=help)
+        subparser.set_defaults(run=run)
+        return subparser
+
+    add("main", _main, "ежедневный запуск: сверка участников, удаление и создание чатов")
+    add("make", _make, "создать чат имениннику")
+    add("clean", _clean, "разослать уведомления и удалить устаревшие чаты")
+    add("reconcile", _reconcile, "сверить участников основного чата с БД")
+    add("stats", _stats, "собрать количество участников активных чатов")
+    add("outbox", _outbox, "отправить сообщения из исходящей очереди")
+    add("daemon", _daemon, "запустить бота в режиме демона")
+    add("init-db", _init_db, "создать таблицы в БД")
+
+    session = add("import-session", _import_session, "перенести сессию телеграма из файла в БД")
+    session.add_argument("path", help="файл сессии, например bot.session")
+    session.add_argument("name", help="имя сессии в БД (SESSION_NAME)")
+
+    forecast = add("forecast", _forecast, "прогноз нехватки счетов для сбора")
+    forecast.add_argument("--start", type=date.fromisoformat, default=datetime.now().date(), help="первый день, ГГГГ-ММ-ДД")
+    forecast.add_argument("--days", type=int, default=365, help="на сколько дней вперед")
+    forecast.add_argument("--before", type=config.int_list, default=[3, 5, 7, 10, 14], help="DAYS_BEFORE для сравнения")
+    forecast.add_argument("--after", type=config.int_list, default=[1, 2, 3], help="DAYS_AFTER для сравнения")
+
+    runs = add("runs", _runs, "сравнение запусков бота по этапам")
+    runs.add_argument("--command", help="команда: main, partymaker, partycleaner, ...")
+    runs.add_argument("--last", type=int, default=10, help="сколько последних запусков показать")
+    runs.add_argument("--threshold", type=float, default=1.5, help="порог регрессии")
+
+    events = add("events", _events, "планировщик событий")
+    events.add_argument(
+        "action",
+        choices=["schedule", "run"],
+        help="schedule - запланировать события для пользователей и активных чатов, run - выполнить наступившие",
+    )
+
+    queue = add("queue", _queue, "очередь задач")
+    actions = queue.add_subparsers(dest="action", required=True)
+    plan = actions.add_parser("plan", help="поставить в очередь создание и удаление чатов")
+    plan.add_argument("--send-invites", action="store_true", help="отправлять ссылку в ЛС")
+    work = actions.add_parser("work", help="запустить воркер")
+    # Типы задач и задачи арендаторов проверяют taskqueue.work и tenants.run_job: списки живут там
+    work.add_argument("--kind", action="append", help="тип задачи из taskqueue.HANDLERS, можно несколько")
+    work.add_argument("--once", action="store_true", help="выполнить готовые задачи и выйти")
+
+    tenants = add("tenants", _tenants, "запустить задачу для всех арендаторов")
+    tenants.add_argument("job", help="задача из tenants.JOBS")
+
+    return parser
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    return build_parser().parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Разбирает аргументы и выполняет команду
+
+    :param argv: аргументы, по умолчанию sys.argv[1:]
+    :return: код выхода
+    """
+    args = parse_args(argv)
+    return args.run(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,39 +1,278 @@
 import os
-from typing import List
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, fields
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional
 
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, Engine
+if TYPE_CHECKING:
+    from sqlalchemy import Engine
 
-if not load_dotenv():
-    raise Exception(".env file not found! Please create it in src folder!")
+# Настройки читаются из окружения и .env при первом обращении, а не при импорте.
+# Обращаться к ним можно как раньше - config.DAYS_BEFORE, - или через get_settings().
+# Без обязательной переменной падает только то обращение, которому она нужна.
+# Настройки арендатора (MAIN_CHAT_ID, ADMIN_IDS, ...) подставляются поверх общих через override().
 
+# Переменные, без которых бот работать не может
+REQUIRED = (
+    "DB_HOST",
+    "DB_PORT",
+    "DB_USER",
+    "DB_PASS",
+    "DB_NAME",
+    "BOT_API_ID",
+    "BOT_API_HASH",
+    "BOT_PHONE",
+    "ADMIN_IDS",
+    "MAIN_CHAT_ID",
+)
 
-# Переменные, связанные с БД
-DB_HOST: str = os.environ.get("DB_HOST")
-DB_PORT: int = int(os.environ.get("DB_PORT"))
-DB_USER: str = os.environ.get("DB_USER")
-DB_PASS: str = os.environ.get("DB_PASS")
-DB_NAME: str = os.environ.get("DB_NAME")
 
-# Переменные, связанные с ботом (https://my.telegram.org/auth)
-BOT_API_ID: int = int(os.environ.get("BOT_API_ID"))
-BOT_API_HASH: str = os.environ.get("BOT_API_HASH")
-BOT_PHONE: str = os.environ.get("BOT_PHONE")
+def _int(value: Optional[str]) -> Optional[int]:
+    return int(value) if value not in (None, "") else None
 
-# tg id администраторов бота
-ADMIN_IDS: List[int] = [int(x) for x in os.environ.get("ADMIN_IDS").split(",")]
 
-# id основного чата с пользователями
-MAIN_CHAT_ID: int = int(os.environ.get("MAIN_CHAT_ID"))
+def _bool(value: Optional[str]) -> bool:
+    return (value or "").lower() in ("1", "true", "yes")
 
-# номер карты для перевода на случай ошибок Тинькофф
-CARD_NUMBER: str = os.environ.get("CARD_NUMBER", "")
 
-# За сколько дней до ДР должен создаваться чат
-DAYS_BEFORE: int = int(os.environ.get("DAYS_BEFORE", 7))
+def int_list(value: Optional[str]) -> Optional[List[int]]:
+    return [int(x) for x in value.split(",")] if value else None
 
-# Сколько дней после ДР чат должен существовать
-DAYS_AFTER: int = int(os.environ.get("DAYS_AFTER", 2))
 
-dsn = f"mariadb+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-engine: Engine = create_engine(dsn)
+@dataclass(frozen=True)
+class Settings:
+    # Переменные, связанные с БД
+    DB_HOST: Optional[str] = None
+    DB_PORT: Optional[int] = None
+    DB_USER: Optional[str] = None
+    DB_PASS: Optional[str] = None
+    DB_NAME: Optional[str] = None
+
+    # Переменные, связанные с ботом (https://my.telegram.org/auth)
+    BOT_API_ID: Optional[int] = None
+    BOT_API_HASH: Optional[str] = None
+    BOT_PHONE: Optional[str] = None
+
+    # Где хранится сессия телеграма: file - локальный файл <SESSION_NAME>.session,
+    # db - таблица tg_sessions (общая для нескольких процессов и хостов)
+    SESSION_BACKEND: str = "file"
+    SESSION_NAME: str = "bot"
+
+    # Арендатор (основной чат со своими пользователями, чатами и счетами), см. таблицу tenants.
+    # Без мультиарендного режима все данные принадлежат арендатору 1
+    TENANT_ID: int = 1
+
+    # tg id администраторов бота
+    ADMIN_IDS: Optional[List[int]] = None
+
+    # id основного чата с пользователями
+    MAIN_CHAT_ID: Optional[int] = None
+
+    # номер карты для перевода на случай ошибок Тинькофф
+    CARD_NUMBER: str = ""
+
+    # За сколько дней до ДР должен создаваться чат
+    DAYS_BEFORE: int = 7
+
+    # Сколько дней после ДР чат должен существовать
+    DAYS_AFTER: int = 2
+
+    # Через сколько дней пользователя, которого не удалось добавить в чат, снова пробуют пригласить
+    INVITABILITY_TTL_DAYS: int = 30
+
+    # Сколько приглашений в чаты можно отправить за сутки (0 - без ограничений). Кто не поместился,
+    # приглашается в следующих запусках. Пользователи с тегами из INVITE_PRIORITY_TAGS (через запятую)
+    # приглашаются раньше остальных
+    INVITE_DAILY_BUDGET: int = 0
+    INVITE_PRIORITY_TAGS: str = ""
+
+    # Интервалы запуска задач в режиме демона (в минутах)
+    DAEMON_MAKE_INTERVAL: int = 60
+    DAEMON_CLEAN_INTERVAL: int = 60
+    DAEMON_RECONCILE_INTERVAL: int = 360
+    DAEMON_STATS_INTERVAL: int = 1440
+
+    # Сколько чатов опрашивается одновременно при сборе статистики участников
+    STATS_CONCURRENCY: int = 4
+
+    # Отправка уведомлений из outbox: размер пачки, одновременные отправки,
+    # сообщений в секунду, аренда захваченного сообщения (сек), число попыток
+    # и базовая задержка повтора после ошибки (сек, удваивается с каждой попыткой)
+    OUTBOX_BATCH_SIZE: int = 50
+    OUTBOX_CONCURRENCY: int = 4
+    OUTBOX_RATE: float = 1.0
+    OUTBOX_LEASE_SECONDS: int = 300
+    OUTBOX_MAX_ATTEMPTS: int = 5
+    OUTBOX_BACKOFF_SECONDS: int = 60
+
+    # Общий лимит вызовов API телеграма для всех процессов одного аккаунта (token bucket).
+    # RATE_BACKEND: пусто - выключен, file - файл RATE_FILE с блокировкой (один хост), db - таблица rate_buckets.
+    # RATE_LIMITS: лимиты по классам методов в виде класс=запросов/секунд (invite, message, channel, upload, default).
+    # PACING_SCALE умножает намеренные паузы между вызовами: с общим лимитом их можно уменьшить
+    RATE_BACKEND: str = ""
+    RATE_FILE: str = "rate_budget.json"
+    RATE_LIMITS: str = "invite=1/10,message=1/3,channel=1/5,upload=30/1,default=3/1"
+    PACING_SCALE: float = 1.0
+
+    # Очередь задач: аренда задачи (сек), базовая задержка повтора (сек, удваивается с каждой попыткой),
+    # число попыток, лимиты одновременных задач по типам, размер пачки приглашений
+    # и пауза воркера при пустой очереди (сек)
+    TASK_LEASE_SECONDS: int = 900
+    TASK_BACKOFF_SECONDS: int = 60
+    TASK_MAX_ATTEMPTS: int = 5
+    TASK_CONCURRENCY: str = "create_channel=1,edit_photo=1,setup_admins=1,invite_batch=1,send_dm=2,send_intro=1,delete_channel=2"
+    TASK_INVITE_BATCH_SIZE: int = 20
+    TASK_POLL_INTERVAL: int = 30
+
+    # Архив истории чатов перед удалением: включение, папка, медиа (skip - не сохранять,
+    # dedup - сохранять один раз по sha256), максимальный размер медиафайла, одновременные выгрузки
+    # и ограничение времени выгрузки одного чата (сек)
+    ARCHIVE_ENABLED: bool = False
+    ARCHIVE_DIR: str = "archives"
+    ARCHIVE_MEDIA: str = "skip"
+    ARCHIVE_MEDIA_MAX_BYTES: int = 20 * 1024 * 1024
+    ARCHIVE_CONCURRENCY: int = 2
+    ARCHIVE_TIMEOUT: int = 1800
+
+    # Повторное использование каналов: вместо удаления канал очищается и возвращается в пул,
+    # а новый чат берется из пула (телеграм ограничивает создание каналов)
+    CHANNEL_RECYCLING: bool = False
+
+    # Планировщик событий: вместо ежедневного перебора чатов и пользователей демон выполняет
+    # только наступившие события (создание чата, уведомления, удаление). События с датой
+    # выполняются в EVENT_HOUR часов. DAEMON_EVENTS_INTERVAL - как часто (мин.) проверять события,
+    # если ближайшее событие еще не скоро
+    EVENTS_ENABLED: bool = False
+    EVENT_HOUR: int = 10
+    EVENT_BATCH_SIZE: int = 20
+    DAEMON_EVENTS_INTERVAL: int = 60
+
+    # Логирование: файл, уровень, ротация (size - по размеру, time - по времени) и формат
+    LOG_FILE: str = "bot.log"
+    LOG_LEVEL: str = "INFO"
+    LOG_ROTATION: str = "size"
+    LOG_MAX_BYTES: int = 10 * 1024 * 1024
+    LOG_ROTATION_WHEN: str = "midnight"
+    LOG_BACKUP_COUNT: int = 14
+    LOG_JSON: bool = False
+
+    # Профилирование cProfile: включение, папка для .prof, исключение намеренных пауз
+    # и количество функций в сводке
+    PROFILE: bool = False
+    PROFILE_DIR: str = "profiles"
+    PROFILE_EXCLUDE_SLEEP: bool = True
+    PROFILE_TOP: int = 25
+
+    # Порт HTTP-эндпоинта /metrics в режиме демона (0 - не поднимать)
+    METRICS_PORT: int = 0
+
+    # Папка textfile-коллектора node_exporter для запусков из cron (пусто - не писать)
+    METRICS_TEXTFILE_DIR: str = ""
+
+    missing: List[str] = field(default_factory=list, repr=False)
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """
+        Читает настройки из переменных окружения. Пустые числовые переменные считаются незаданными
+
+        :return: объект настроек
+        """
+        values = {}
+        for f in fields(cls):
+            raw = os.environ.get(f.name)
+            if f.name == "missing" or raw is None:
+                continue
+
+            if f.name == "ADMIN_IDS":
+                values[f.name] = int_list(raw)
+            elif f.type in ("bool", bool):
+                values[f.name] = _bool(raw)
+            elif f.type in ("int", int, "Optional[int]", Optional[int]):
+                values[f.name] = _int(raw)
+            elif f.type in ("float", float):
+                values[f.name] = float(raw)
+            else:
+                values[f.name] = raw
+
+        values["missing"] = [name for name in REQUIRED if values.get(name) is None]
+        return cls(**values)
+
+    @property
+    def dsn(self) -> str:
+        return (
+            f"mariadb+pymysql://{self.require('DB_USER')}:{self.require('DB_PASS')}"
+            f"@{self.require('DB_HOST')}:{self.require('DB_PORT')}/{self.require('DB_NAME')}"
+        )
+
+    def require(self, name: str):
+        """
+        Возвращает значение настройки, если обязательная переменная не задана - падает
+
+        :param name: имя переменной
+        :return: значение
+        """
+        if name in self.missing:
+            raise Exception(
+                f"Переменная {name} не задана! Добавьте ее в .env в папке src или в окружение"
+            )
+        return getattr(self, name)
+
+
+# Настройки текущего арендатора. ContextVar, чтобы арендаторы в разных потоках не мешали друг другу
+_overrides: ContextVar[Dict[str, Any]] = ContextVar("overrides", default={})
+
+
+@contextmanager
+def override(**values) -> Iterator[None]:
+    """
+    Подменяет настройки внутри блока (в текущем потоке)
+
+    :param values: новые значения настроек
+    """
+    token = _overrides.set({**_overrides.get(), **values})
+    try:
+        yield
+    finally:
+        _overrides.reset(token)
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """
+    Загружает .env (если он есть) и разбирает настройки. Результат кэшируется
+
+    :return: объект настроек
+    """
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return Settings.from_env()
+
+
+@lru_cache(maxsize=None)
+def get_engine() -> "Engine":
+    """
+    Создает движок SQLAlchemy при первом обращении к БД
+
+    :return: движок SQLAlchemy
+    """
+    from sqlalchemy import create_engine
+
+    # pool_pre_ping и pool_recycle нужны долгоживущему процессу (демону):
+    # соединения, закрытые сервером по wait_timeout, переоткрываются незаметно
+    return create_engine(get_settings().dsn, pool_pre_ping=True, pool_recycle=3600)
+
+
+def __getattr__(name: str):
+    if name == "engine":
+        return get_engine()
+    if name == "dsn":
+        return get_settings().dsn
+    if name in Settings.__dataclass_fields__ and name != "missing":
+        overrides = _overrides.get()
+        if name in overrides:
+            return overrides[name]
+        return get_settings().require(name)
+    raise AttributeError(f"module 'config' has no attribute '{name}'")
@@ -0,0 +1,257 @@
+import signal
+import sys
+import threading
+import time
+from typing import Callable, List, Optional
+
+from telethon.sync import TelegramClient
+
+import config
+import data
+import events
+import metrics
+import planning
+from digest import AdminDigest
+from logger import logging
+from partycleaner import PartyCleaner
+from partymaker import PartyMaker, remaining_invite_budget
+from repository import Repository
+from runs import record_run
+from scheduler import EventRunner, seconds_until_next_event
+from stats import ParticipationCollector
+from utils import ChatTools, signin
+
+
+def invite_duty(client: TelegramClient, digest: AdminDigest, repo: Repository = None) -> None:
+    """
+    Продолжает приглашения в уже созданные чаты, если не закончился дневной лимит
+
+    :return: None
+    """
+    pending_chat_ids = data.get_chats_with_pending_invites()
+    if not pending_chat_ids or remaining_invite_budget() == 0:
+        return
+
+    repo = repo or Repository()
+    for chat_id in pending_chat_ids:
+        pm = PartyMaker(client, config.MAIN_CHAT_ID, repo.chat_bdayer(chat_id), digest, repo=repo)
+        pm.attach_channel(chat_id)
+        pm.invite_users_to_channel()
+
+
+def make_duty(client: TelegramClient, digest: AdminDigest) -> None:
+    """
+    Продолжает приглашения в уже созданные чаты и создает чат для ближайшего именинника.
+    В сутки создается не больше одного чата, поэтому при частом запуске задача
+    ничего не делает, если сегодня чат уже создавался и приглашать некого (или закончился дневной лимит)
+
+    :return: None
+    """
+    bdayer_ids = planning.plan_creations()
+    if not bdayer_ids and not data.get_chats_with_pending_invites():
+        return
+
+    repo = Repository()
+    invite_duty(client, digest, repo)
+
+    for bdayer_id in bdayer_ids:
+        pm = PartyMaker(client, config.MAIN_CHAT_ID, repo.get_user(bdayer_id), digest, repo=repo)
+        pm.make_party()
+
+
+def clean_duty(client: TelegramClient, digest: AdminDigest) -> None:
+    """
+    Уведомляет чаты и удаляет устаревшие
+
+    :return: None
+    """
+    pc = PartyCleaner(client, digest)
+    pc.notify_channels()
+    pc.clean_party()
+
+
+def reconcile_duty(client: TelegramClient, digest: AdminDigest) -> None:
+    """
+    Сверяет состав основного чата с БД
+
+    :return: None
+    """
+    ct = ChatTools(client, config.MAIN_CHAT_ID)
+    ct.find_db_users_not_in_chat()
+    ct.notify_about_new_users(digest)
+
+    # Новым и снова активным пользователям планируется создание чата
+    if config.EVENTS_ENABLED:
+        events.schedule_new_users()
+
+
+def stats_duty(client: TelegramClient, digest: AdminDigest) -> None:
+    """
+    Обновляет количество участников активных чатов
+
+    :return: None
+    """
+    ParticipationCollector(client).run()
+
+
+def events_duty(client: TelegramClient, digest: AdminDigest) -> None:
+    """
+    Выполняет наступившие события: создание чатов, уведомления и удаление
+
+    :return: None
+    """
+    EventRunner(client, digest).run_due()
+
+
+class Duty:
+    """
+    Периодическая задача демона
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[TelegramClient, AdminDigest], None],
+        interval_minutes: int,
+        next_due: Callable[[], Optional[float]] = None,
+    ):
+        self.name = name
+        self.func = func
+        self.interval: float = interval_minutes * 60
+        # Через сколько секунд задача понадобится снова (например, наступит ближайшее событие).
+        # Задача запускается в этот момент, но не реже interval
+        self.next_due = next_due
+        self.next_run: float = time.monotonic()
+
+    def delay(self) -> float:
+        """
+        Через сколько секунд запустить задачу снова
+
+        :return: секунды
+        """
+        if self.next_due is None:
+            return self.interval
+
+        try:
+            due = self.next_due()
+        except Exception as e:
+            logging.info("Не удалось узнать срок задачи %s. Ошибка: %s", self.name, e)
+            return self.interval
+        return self.interval if due is None else min(self.interval, due)
+
+    def __repr__(self):
+        return "Duty(name=%s, interval=%s)" % (self.name, self.interval)
+
+
+class BirthdayDaemon:
+    """
+    Долгоживущий процесс: один раз авторизуется в телеграме, держит соединение
+    и пул соединений с БД, и запускает задачи по внутреннему расписанию
+    """
+
+    def __init__(self, client: TelegramClient, duties: List[Duty]):
+        self.client = client
+        self.duties = duties
+        self.stop_event = threading.Event()
+
+    def stop(self, signum=None, frame=None) -> None:
+        """
+        Просит демон остановиться. Текущая задача доработает до конца
+
+        :return: None
+        """
+        logging.info("Получен сигнал %s, останавливаемся после текущей задачи", signum)
+        self.stop_event.set()
+
+    def ensure_connected(self) -> None:
+        """
+        Переподключает клиент, если соединение было потеряно
+
+        :return: None
+        """
+        if not self.client.is_connected():
+            logging.info("Соединение с телеграмом потеряно, переподключаемся")
+            self.client.connect()
+
+    def run_duty(self, duty: Duty) -> None:
+        """
+        Выполняет задачу и отправляет сводку администраторам.
+        Ошибка в задаче не останавливает демон
+
+        :return: None
+        """
+        digest = AdminDigest()
+        started = time.monotonic()
+        try:
+            with record_run(f"daemon:{duty.name}"):
+                self.ensure_connected()
+                duty.func(self.client, digest)
+            logging.info("Задача %s выполнена за %.1f c", duty.name, time.monotonic() - started)
+
+        # PartyMaker завершает процесс через sys.exit, если не удалось создать чат
+        except (Exception, SystemExit) as e:
+            logging.exception("Задача %s завершилась с ошибкой: %s", duty.name, e)
+            digest.failure(f"Задача {duty.name} завершилась с ошибкой: {e}")
+
+        finally:
+            duty.next_run = time.monotonic() + duty.delay()
+            try:
+                digest.send(self.client)
+            except Exception as e:
+                logging.info("Не удалось отправить сводку. Ошибка: %s", e)
+
+    def run_forever(self) -> None:
+        """
+        Основной цикл: выполняет задачи, чей срок наступил, и спит до следующей
+
+        :return: None
+        """
+        logging.info("Демон запущен. Задачи: %s", self.duties)
+        while not self.stop_event.is_set():
+            for duty in self.duties:
+                if self.stop_event.is_set():
+                    break
+                if duty.next_run <= time.monotonic():
+                    self.run_duty(duty)
+
+            next_run = min(duty.next_run for duty in self.duties)
+            self.stop_event.wait(max(0.0, next_run - time.monotonic()))
+
+        logging.info("Демон остановлен")
+
+
+def run_daemon() -> None:
+    """
+    Запускает демон и работает до SIGTERM/SIGINT
+    """
+    dog_client = signin(config.BOT_API_ID, config.BOT_API_HASH)
+
+    if config.METRICS_PORT:
+        metrics.serve(config.METRICS_PORT)
+
+    with dog_client:
+        if config.EVENTS_ENABLED:
+            # Создание, уведомления и удаление выполняются по событиям в момент их наступления
+            duties = [
+                Duty("reconcile", reconcile_duty, config.DAEMON_RECONCILE_INTERVAL),
+                Duty("events", events_duty, config.DAEMON_EVENTS_INTERVAL, seconds_until_next_event),
+                Duty("invite", invite_duty, config.DAEMON_MAKE_INTERVAL),
+                Duty("stats", stats_duty, config.DAEMON_STATS_INTERVAL),
+            ]
+        else:
+            duties = [
+                Duty("reconcile", reconcile_duty, config.DAEMON_RECONCILE_INTERVAL),
+                Duty("clean", clean_duty, config.DAEMON_CLEAN_INTERVAL),
+                Duty("make", make_duty, config.DAEMON_MAKE_INTERVAL),
+                Duty("stats", stats_duty, config.DAEMON_STATS_INTERVAL),
+            ]
+
+        daemon = BirthdayDaemon(dog_client, duties)
+        signal.signal(signal.SIGTERM, daemon.stop)
+        signal.signal(signal.SIGINT, daemon.stop)
+        daemon.run_forever()
+
+
+if __name__ == "__main__":
+    run_daemon()
+    sys.exit(0)
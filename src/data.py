@@ -1,12 +1,21 @@
-from typing import List, Union, Type
+import calendar
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple, Type, Union
 
-from sqlalchemy import select, exc
+from sqlalchemy import Engine, delete, func, select, text, update, exc
 from sqlalchemy.exc import NoResultFound
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.orm import Session, sessionmaker
 
-from config import engine
+import config
+import metrics
+from tracing import RunTrace
 from logger import logging
-from models import Base, User, Chat, BankAccount
+from models import Base, User, Chat, BankAccount, Run, OutboxMessage, Task, ChatStat, Invitability, Tenant, ChatArchive, PooledChannel, ChatInvite, Event
+
+
+# Замеряем запросы всех движков: сам движок создается лениво при первом обращении к БД
+metrics.instrument_engine(Engine)
 
 
 def make_session() -> sessionmaker:
@@ -15,24 +24,56 @@ def make_session() -> sessionmaker:
 
     :return: неинициализированная сущность sessionmaker
     """
-    return sessionmaker(engine)
+    return sessionmaker(config.get_engine())
 
 
 def create_db_and_tables() -> None:
     """
     Создает БД и таблицы
     """
-    Base.metadata.create_all(engine)
+    Base.metadata.create_all(config.get_engine())
+
+
+def _current_chat(session: Session, chat_id: int) -> Optional[Chat]:
+    """
+    Текущий чат в канале. Канал из пула сохраняет chat_id, и у каждого чата в нем своя запись:
+    текущая - последняя созданная
+
+    :param session: сессия БД
+    :param chat_id: id чата/канала
+    :return: сущность Chat или None
+    """
+    return session.execute(
+        select(Chat).where(Chat.chat_id == chat_id).order_by(Chat.id.desc()).limit(1)
+    ).scalar_one_or_none()
+
+
+def _current_party_ids(chat_ids: Iterable[int]):
+    """
+    Подзапрос: id записей текущих чатов в указанных каналах
+
+    :param chat_ids: id чатов/каналов
+    :return: select по chats.id
+    """
+    return (
+        select(func.max(Chat.id))
+        .where(Chat.chat_id.in_(list(chat_ids)))
+        .group_by(Chat.chat_id)
+    )
 
 
 def get_active_chats() -> List[Type[Chat]]:
     """
-    Возвращает список активных (не удаленных) чатов
+    Возвращает список активных (не удаленных) чатов текущего арендатора
     """
 
     s = make_session()
     with s() as session:
-        chats = session.query(Chat).filter(Chat.is_active == True).all()
+        chats = (
+            session.query(Chat)
+            .filter(Chat.tenant_id == config.TENANT_ID, Chat.is_active == True)
+            .all()
+        )
         return chats
 
 
@@ -47,12 +88,12 @@ def deactivate_chat(chat_id) -> Chat:
 
     s = make_session()
     with s() as session:
-        chat = session.execute(select(Chat).filter_by(chat_id=chat_id)).scalar_one()
+        chat = _current_chat(session, chat_id)
         chat.is_active = False
 
         try:
             account = session.execute(
-                select(BankAccount).filter_by(used_in=chat_id)
+                select(BankAccount).filter_by(used_in=chat.id)
             ).scalar_one()
             account.used_in = None
 
@@ -73,10 +114,10 @@ def get_chat_bdayer(chat_id: int) -> Union[User, None]:
 
     s = make_session()
     with s() as session:
-        chat = session.execute(select(Chat).filter_by(chat_id=chat_id)).first()
+        chat = _current_chat(session, chat_id)
         if chat:
             user = session.execute(
-                select(User).filter_by(tg_id=chat[0].bdayer_id)
+                select(User).filter_by(tg_id=chat.bdayer_id)
             ).first()
             if user:
                 return user[0]
@@ -103,11 +144,30 @@ def get_active_chats_for_user(user_id) -> List[Type[Chat]]:
         return chats
 
 
+def count_chats_created_since(since: datetime) -> int:
+    """
+    Считает чаты текущего арендатора, созданные начиная с указанного момента (включая удаленные).
+    Используется, чтобы не создавать больше одного чата в сутки
+
+    :param since: момент времени, с которого ведется подсчет
+    :return: количество чатов
+    """
+
+    s = make_session()
+    with s() as session:
+        return (
+            session.query(Chat)
+            .filter(Chat.tenant_id == config.TENANT_ID, Chat.created_at >= since)
+            .count()
+        )
+
+
 def chat_create(
     chat_id: int, invite_link: str, bdayer_id: int, chat_title: str
 ) -> Chat:
     """
-    Добавляет в таблицу chats запись о созданном чате
+    Добавляет в таблицу chats запись о созданном чате.
+    Для переиспользованного канала (см. channel_pool) добавляется новая запись, записи прошлых чатов сохраняются
 
     :param chat_id: id чата/канала
     :param invite_link: ссылка для приглашения пользователей
@@ -121,6 +181,7 @@ def chat_create(
 
         chat = Chat(
             chat_id=chat_id,
+            tenant_id=config.TENANT_ID,
             invite_link=invite_link,
             bdayer_id=bdayer_id,
             chat_title=chat_title,
@@ -128,7 +189,7 @@ def chat_create(
         session.add(chat)
         session.commit()
 
-        logging.info(f"Запись о создании чата добавлена в таблицу. Чат: {chat}")
+        logging.info("Запись о создании чата добавлена в таблицу. Чат: %s", chat)
         return chat
 
 
@@ -147,7 +208,7 @@ def chat_update(
 
     s = make_session()
     with s() as session:
-        chat = session.execute(select(Chat).filter_by(chat_id=chat_id)).scalar_one()
+        chat = _current_chat(session, chat_id)
         if added is not None:
             chat.users_added = added
         if invited is not None:
@@ -158,6 +219,27 @@ def chat_update(
     return chat
 
 
+def add_chat_invited(chat_id: int, count: int = 1) -> None:
+    """
+    Увеличивает количество приглашенных ссылкой одним UPDATE. В отличие от chat_update
+    не теряет приглашения, записанные одновременно другими воркерами
+
+    :param chat_id: id чата
+    :param count: сколько приглашений добавить
+    :return: None
+    """
+
+    s = make_session()
+    with s() as session:
+        party_id = _current_chat(session, chat_id).id
+        session.execute(
+            update(Chat)
+            .where(Chat.id == party_id)
+            .values(users_invited=Chat.users_invited + count)
+        )
+        session.commit()
+
+
 def log_notified(
     chat_id: int, birthday_sent: bool = None, deletion_sent: bool = None
 ) -> Chat:
@@ -172,7 +254,7 @@ def log_notified(
 
     s = make_session()
     with s() as session:
-        chat = session.execute(select(Chat).filter_by(chat_id=chat_id)).scalar_one()
+        chat = _current_chat(session, chat_id)
 
         if birthday_sent is not None:
             chat.notification_birthday_sent = birthday_sent
@@ -182,6 +264,675 @@ def log_notified(
     return chat
 
 
+def save_participation(counts: Dict[int, int], day: date = None) -> int:
+    """
+    Записывает количество участников чатов одним пакетным UPDATE в chats
+    и добавляет (или перезаписывает) точку за день в chat_stats
+
+    :param counts: количество участников по id чата
+    :param day: день для chat_stats, по умолчанию сегодня
+    :return: количество обновленных чатов
+    """
+    if not counts:
+        return 0
+
+    day = day or datetime.now().date()
+
+    s = make_session()
+    with s() as session:
+        totals = session.execute(
+            select(Chat.id, Chat.chat_id, Chat.users_added, Chat.users_invited).where(
+                Chat.id.in_(_current_party_ids(counts))
+            )
+        ).all()
+        session.execute(
+            update(Chat),
+            [{"id": party_id, "participated": counts[chat_id]} for party_id, chat_id, _, _ in totals],
+        )
+
+        stmt = insert(ChatStat).values(
+            [
+                {
+                    "party_id": party_id,
+                    "day": day,
+                    "participants": counts[chat_id],
+                    "users_added": added,
+                    "users_invited": invited,
+                }
+                for party_id, chat_id, added, invited in totals
+            ]
+        )
+        session.execute(
+            stmt.on_duplicate_key_update(
+                participants=stmt.inserted.participants,
+                users_added=stmt.inserted.users_added,
+                users_invited=stmt.inserted.users_invited,
+            )
+        )
+        session.commit()
+
+    logging.info("Обновлено количество участников чатов: %s", counts)
+    return len(counts)
+
+
+def start_archive(chat_id: int, path: str) -> int:
+    """
+    Добавляет запись о начатой выгрузке архива чата
+
+    :param chat_id: id чата
+    :param path: путь к файлу архива
+    :return: id записи
+    """
+
+    s = make_session()
+    with s() as session:
+        archive = ChatArchive(party_id=_current_chat(session, chat_id).id, path=path)
+        session.add(archive)
+        session.commit()
+        return archive.id
+
+
+def finish_archive(
+    archive_id: int,
+    status: str,
+    messages: int = 0,
+    media_files: int = 0,
+    size_bytes: int = 0,
+    error: str = None,
+) -> None:
+    """
+    Записывает результат выгрузки архива
+
+    :param archive_id: id записи
+    :param status: done или failed
+    :param messages: количество сообщений
+    :param media_files: количество сохраненных медиафайлов
+    :param size_bytes: размер архива в байтах
+    :param error: текст ошибки
+    :return: None
+    """
+
+    s = make_session()
+    with s() as session:
+        session.execute(
+            update(ChatArchive)
+            .where(ChatArchive.id == archive_id)
+            .values(
+                status=status,
+                messages=messages,
+                media_files=media_files,
+                size_bytes=size_bytes,
+                error=error,
+                finished_at=datetime.now(),
+            )
+        )
+        session.commit()
+
+
+def get_archived_chat_ids(chat_ids: Iterable[int]) -> Set[int]:
+    """
+    Из указанных чатов выбирает те, для которых уже есть готовый архив.
+    Учитываются только архивы текущего чата в канале: архив прошлого чата в том же канале не заменяет его
+
+    :param chat_ids: id чатов
+    :return: множество id чатов
+    """
+
+    s = make_session()
+    with s() as session:
+        return set(
+            session.execute(
+                select(Chat.chat_id)
+                .join(ChatArchive, ChatArchive.party_id == Chat.id)
+                .where(
+                    Chat.id.in_(_current_party_ids(chat_ids)),
+                    ChatArchive.status == "done",
+                )
+            ).scalars()
+        )
+
+
+class PendingMessage(NamedTuple):
+    """
+    Сообщение из outbox, захваченное на отправку
+    """
+
+    id: int
+    chat_id: int
+    text: str
+    attempts: int
+
+
+def enqueue_chat_notification(
+    chat_id: int,
+    kind: str,
+    text: str,
+    birthday_sent: bool = None,
+    deletion_sent: bool = None,
+) -> bool:
+    """
+    Отмечает уведомление в записи о чате и ставит сообщение в outbox в одной транзакции.
+    Повторная постановка того же уведомления игнорируется
+
+    :param chat_id: Id чата.
+    :param kind: Тип уведомления (birthday, deletion).
+    :param text: Текст сообщения.
+    :param birthday_sent: Отметить уведомление о дне рождения.
+    :param deletion_sent: Отметить уведомление о скором удалении.
+    :return: True, если сообщение поставлено в очередь
+    """
+
+    s = make_session()
+    with s() as session:
+        chat = _current_chat(session, chat_id)
+        # Канал из пула сохраняет chat_id, поэтому ключ включает запись чата
+        dedup_key = f"{kind}:{chat_id}:{chat.id}"
+
+        if birthday_sent is not None:
+            chat.notification_birthday_sent = birthday_sent
+        if deletion_sent is not None:
+            chat.notification_deletion_sent = deletion_sent
+
+        exists = session.execute(
+            select(OutboxMessage.id).filter_by(dedup_key=dedup_key)
+        ).first()
+        if exists is None:
+            session.add(
+                OutboxMessage(
+                    tenant_id=chat.tenant_id, chat_id=chat_id, kind=kind, text=text, dedup_key=dedup_key
+                )
+            )
+
+        session.commit()
+        return exists is None
+
+
+def claim_outbox(limit: int, lease_seconds: int) -> List[PendingMessage]:
+    """
+    Захватывает пачку неотправленных сообщений текущего арендатора: их отправляет его телеграм-аккаунт.
+    Сообщения после ошибки ждут своего available_at,
+    а зависшие в отправке дольше аренды (например, процесс упал) захватываются повторно
+
+    :param limit: размер пачки
+    :param lease_seconds: на сколько секунд сообщение закрепляется за отправителем
+    :return: захваченные сообщения
+    """
+
+    now = datetime.now()
+
+    s = make_session()
+    with s() as session:
+        messages = (
+            session.execute(
+                select(OutboxMessage)
+                .where(
+                    OutboxMessage.tenant_id == config.TENANT_ID,
+                    (
+                        (OutboxMessage.status == "pending")
+                        & ((OutboxMessage.available_at == None) | (OutboxMessage.available_at <= now))
+                    )
+                    | (
+                        (OutboxMessage.status == "sending")
+                        & (OutboxMessage.locked_until < now)
+                    ),
+                )
+                .order_by(OutboxMessage.created_at)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )
+            .scalars()
+            .all()
+        )
+
+        claimed = []
+        for message in messages:
+            message.status = "sending"
+            message.locked_until = now + timedelta(seconds=lease_seconds)
+            claimed.append(
+                PendingMessage(message.id, message.chat_id, message.text, message.attempts)
+            )
+
+        session.commit()
+        return claimed
+
+
+def mark_outbox_sent(message_id: int) -> bool:
+    """
+    Отмечает сообщение отправленным. Повторная отметка ничего не меняет
+
+    :param message_id: id сообщения в outbox
+    :return: True, если отметка изменила статус
+    """
+
+    s = make_session()
+    with s() as session:
+        result = session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id == message_id, OutboxMessage.status == "sending")
+            .values(status="sent", sent_at=datetime.now(), locked_until=None)
+        )
+        session.commit()
+        return result.rowcount == 1
+
+
+def mark_outbox_failed(
+    message_id: int, error: str, max_attempts: int, backoff_seconds: int, min_delay: int = 0
+) -> Optional[datetime]:
+    """
+    Возвращает сообщение в очередь с экспоненциальной задержкой (как fail_task)
+    или помечает его failed, если попытки закончились
+
+    :param message_id: id сообщения в outbox
+    :param error: текст ошибки
+    :param max_attempts: максимальное количество попыток
+    :param backoff_seconds: базовая задержка перед повтором
+    :param min_delay: задержка не меньше указанной (например, FloodWait от телеграма)
+    :return: время следующей попытки или None, если попыток больше не будет
+    """
+
+    s = make_session()
+    with s() as session:
+        message = session.get(OutboxMessage, message_id)
+        message.attempts += 1
+        message.last_error = error
+        message.locked_until = None
+
+        retry_at = None
+        if message.attempts >= max_attempts:
+            message.status = "failed"
+        else:
+            message.status = "pending"
+            retry_at = datetime.now() + timedelta(
+                seconds=max(backoff_seconds * 2 ** (message.attempts - 1), min_delay)
+            )
+        message.available_at = retry_at
+
+        session.commit()
+        return retry_at
+
+
+class QueuedTask(NamedTuple):
+    """
+    Задача из очереди, захваченная воркером
+    """
+
+    id: int
+    kind: str
+    payload: dict
+    attempts: int
+
+
+def enqueue_task(
+    kind: str,
+    payload: dict,
+    dedup_key: str = None,
+    run_after: datetime = None,
+    max_attempts: int = 5,
+) -> bool:
+    """
+    Ставит задачу в очередь текущего арендатора. Задача с уже существующим dedup_key повторно не ставится,
+    поэтому два шедулера, запланировавшие одно и то же, не создадут дубликатов
+
+    :param kind: тип задачи
+    :param payload: параметры задачи
+    :param dedup_key: ключ уникальности задачи
+    :param run_after: не выполнять раньше этого момента
+    :param max_attempts: максимальное количество попыток
+    :return: True, если задача поставлена
+    """
+
+    s = make_session()
+    with s() as session:
+        if dedup_key is not None:
+            exists = session.execute(
+                select(Task.id).filter_by(dedup_key=dedup_key)
+            ).first()
+            if exists is not None:
+                return False
+
+        session.add(
+            Task(
+                tenant_id=config.TENANT_ID,
+                kind=kind,
+                payload=payload,
+                dedup_key=dedup_key,
+                run_after=run_after or datetime.now(),
+                max_attempts=max_attempts,
+            )
+        )
+        try:
+            session.commit()
+        except exc.IntegrityError:
+            # Ту же задачу одновременно поставил другой процесс
+            return False
+
+        logging.info("Задача %s поставлена в очередь: %s", kind, payload)
+        return True
+
+
+def claim_task(
+    kind: str, worker_id: str, concurrency: int, lease_seconds: int
+) -> Optional[QueuedTask]:
+    """
+    Захватывает одну задачу текущего арендатора указанного типа, если задач этого типа у арендатора
+    выполняется меньше concurrency: задачи выполняет его телеграм-аккаунт.
+    Задачи упавших воркеров (с истекшей арендой) захватываются повторно.
+    Подсчет и захват выполняются под именованной блокировкой типа задачи,
+    чтобы два воркера не превысили лимит одновременно
+
+    :param kind: тип задачи
+    :param worker_id: идентификатор воркера
+    :param concurrency: сколько задач этого типа может выполняться одновременно
+    :param lease_seconds: срок аренды задачи в секундах
+    :return: захваченная задача или None
+    """
+
+    now = datetime.now()
+    lock_name = f"tasks:{config.TENANT_ID}:{kind}"
+
+    # Именованная блокировка принадлежит соединению, поэтому сессия работает в нем же
+    with config.get_engine().connect() as connection:
+        locked = connection.execute(
+            text("SELECT GET_LOCK(:name, 10)"), {"name": lock_name}
+        ).scalar()
+        connection.commit()
+        if not locked:
+            return None
+
+        try:
+            with Session(bind=connection) as session:
+                running = session.execute(
+                    select(func.count(Task.id)).where(
+                        Task.tenant_id == config.TENANT_ID,
+                        Task.kind == kind,
+                        Task.status == "running",
+                        Task.locked_until >= now,
+                    )
+                ).scalar_one()
+                if running >= concurrency:
+                    return None
+
+                task = session.execute(
+                    select(Task)
+                    .where(
+                        Task.tenant_id == config.TENANT_ID,
+                        Task.kind == kind,
+                        Task.run_after <= now,
+                        (Task.status == "pending")
+                        | ((Task.status == "running") & (Task.locked_until < now)),
+                    )
+                    .order_by(Task.run_after)
+                    .limit(1)
+                    .with_for_update(skip_locked=True)
+                ).scalar_one_or_none()
+                if task is None:
+                    return None
+
+                task.status = "running"
+                task.attempts += 1
+                task.locked_by = worker_id
+                task.locked_until = now + timedelta(seconds=lease_seconds)
+                claimed = QueuedTask(task.id, task.kind, dict(task.payload), task.attempts)
+                session.commit()
+                return claimed
+
+        finally:
+            connection.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": lock_name})
+            connection.commit()
+
+
+def complete_task(task_id: int) -> None:
+    """
+    Отмечает задачу выполненной
+
+    :param task_id: id задачи
+    :return: None
+    """
+
+    s = make_session()
+    with s() as session:
+        session.execute(
+            update(Task)
+            .where(Task.id == task_id)
+            .values(status="done", finished_at=datetime.now(), locked_until=None)
+        )
+        session.commit()
+
+
+def fail_task(task_id: int, error: str, backoff_seconds: int) -> Optional[datetime]:
+    """
+    Возвращает задачу в очередь с экспоненциальной задержкой или помечает failed,
+    если попытки закончились
+
+    :param task_id: id задачи
+    :param error: текст ошибки
+    :param backoff_seconds: базовая задержка перед повтором
+    :return: время следующей попытки или None, если попыток больше не будет
+    """
+
+    s = make_session()
+    with s() as session:
+        task = session.get(Task, task_id)
+        task.last_error = error
+        task.locked_until = None
+
+        retry_at = None
+        if task.attempts >= task.max_attempts:
+            task.status = "failed"
+            task.finished_at = datetime.now()
+        else:
+            task.status = "pending"
+            retry_at = datetime.now() + timedelta(
+                seconds=backoff_seconds * 2 ** (task.attempts - 1)
+            )
+            task.run_after = retry_at
+
+        session.commit()
+        return retry_at
+
+
+class DueEvent(NamedTuple):
+    """
+    Наступившее событие, захваченное для выполнения
+    """
+
+    id: int
+    kind: str
+    tg_id: Optional[int]
+    chat_id: Optional[int]
+    due_at: datetime
+    attempts: int
+
+
+def schedule_events(events: List[dict]) -> int:
+    """
+    Добавляет события текущего арендатора. Событие с уже существующим dedup_key не добавляется
+
+    :param events: словари с полями kind, due_at, dedup_key и tg_id или chat_id
+    :return: количество добавленных событий
+    """
+    if not events:
+        return 0
+
+    stmt = insert(Event).values(
+        [{"tenant_id": config.TENANT_ID, "status": "pending", **event} for event in events]
+    )
+
+    s = make_session()
+    with s() as session:
+        result = session.execute(stmt.on_duplicate_key_update(dedup_key=stmt.inserted.dedup_key))
+        session.commit()
+        return result.rowcount
+
+
+def claim_due_events(limit: int, lease_seconds: int, now: datetime = None) -> List[DueEvent]:
+    """
+    Захватывает наступившие события в порядке срока. События, зависшие в выполнении
+    дольше аренды (например, процесс упал), захватываются повторно
+
+    :param limit: максимальное количество событий
+    :param lease_seconds: срок аренды в секундах
+    :param now: текущее время, по умолчанию datetime.now()
+    :return: список событий
+    """
+    now = now or datetime.now()
+
+    s = make_session()
+    with s() as session:
+        events = session.execute(
+            select(Event)
+            .where(
+                Event.tenant_id == config.TENANT_ID,
+                Event.due_at <= now,
+                (Event.status == "pending")
+                | ((Event.status == "running") & (Event.locked_until < now)),
+            )
+            .order_by(Event.due_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+
+        claimed = []
+        for event in events:
+            event.status = "running"
+            event.attempts += 1
+            event.locked_until = now + timedelta(seconds=lease_seconds)
+            claimed.append(
+                DueEvent(event.id, event.kind, event.tg_id, event.chat_id, event.due_at, event.attempts)
+            )
+        session.commit()
+        return claimed
+
+
+def complete_event(event_id: int) -> None:
+    """
+    Отмечает событие выполненным
+
+    :param event_id: id события
+    :return: None
+    """
+
+    s = make_session()
+    with s() as session:
+        session.execute(
+            update(Event)
+            .where(Event.id == event_id)
+            .values(status="done", finished_at=datetime.now(), locked_until=None)
+        )
+        session.commit()
+
+
+def postpone_event(event_id: int, due_at: datetime) -> None:
+    """
+    Переносит событие на другое время без учета попытки (например, исчерпан дневной лимит создания чатов)
+
+    :param event_id: id события
+    :param due_at: новый срок
+    :return: None
+    """
+
+    s = make_session()
+    with s() as session:
+        session.execute(
+            update(Event)
+            .where(Event.id == event_id)
+            .values(status="pending", due_at=due_at, attempts=Event.attempts - 1, locked_until=None)
+        )
+        session.commit()
+
+
+def fail_event(
+    event_id: int, error: str, backoff_seconds: int, max_attempts: int
+) -> Optional[datetime]:
+    """
+    Переносит упавшее событие с экспоненциальной задержкой или помечает failed, если попытки закончились
+
+    :param event_id: id события
+    :param error: текст ошибки
+    :param backoff_seconds: базовая задержка перед повтором
+    :param max_attempts: максимальное количество попыток
+    :return: время следующей попытки или None, если попыток больше не будет
+    """
+
+    s = make_session()
+    with s() as session:
+        event = session.get(Event, event_id)
+        event.last_error = error
+        event.locked_until = None
+
+        retry_at = None
+        if event.attempts >= max_attempts:
+            event.status = "failed"
+            event.finished_at = datetime.now()
+        else:
+            event.status = "pending"
+            retry_at = datetime.now() + timedelta(
+                seconds=backoff_seconds * 2 ** (event.attempts - 1)
+            )
+            event.due_at = retry_at
+
+        session.commit()
+        return retry_at
+
+
+def next_event_due() -> Optional[datetime]:
+    """
+    Срок ближайшего невыполненного события текущего арендатора
+
+    :return: срок или None, если событий нет
+    """
+
+    s = make_session()
+    with s() as session:
+        return session.execute(
+            select(func.min(Event.due_at)).where(
+                Event.tenant_id == config.TENANT_ID, Event.status == "pending"
+            )
+        ).scalar_one()
+
+
+def get_users_without_events() -> List[Type[User]]:
+    """
+    Активные пользователи текущего арендатора, для которых не запланировано создание чата
+    (новые, снова активные или пропущенные при прошлом планировании)
+
+    :return: список пользователей
+    """
+
+    scheduled = select(Event.id).where(
+        Event.tg_id == User.tg_id,
+        Event.kind == "create_chat",
+        Event.status.in_(("pending", "running")),
+    )
+
+    s = make_session()
+    with s() as session:
+        return (
+            session.execute(
+                select(User).where(
+                    User.tenant_id == config.TENANT_ID,
+                    User.is_active == True,
+                    ~scheduled.exists(),
+                )
+            )
+            .scalars()
+            .all()
+        )
+
+
+def get_chat(chat_id: int) -> Union[Chat, None]:
+    """
+    Получить запись о текущем чате в канале по id
+
+    :param chat_id: id чата/канала
+    :return: сущность Chat или None
+    """
+
+    s = make_session()
+    with s() as session:
+        return _current_chat(session, chat_id)
+
+
 def get_user(tg_id) -> Union[User, None]:
     """
     Получить пользователя из БД по tg_id
@@ -200,7 +951,7 @@ def get_user(tg_id) -> Union[User, None]:
 
 def get_all_users() -> List[Type[User]]:
     """
-    Получить всех пользователей из таблицы users
+    Получить всех пользователей текущего арендатора из таблицы users
     Список отсортирован по месяцу и дню рождения
 
     :return:
@@ -208,26 +959,104 @@ def get_all_users() -> List[Type[User]]:
 
     s = make_session()
     with s() as session:
-        users = session.query(User).order_by(User.birth_month, User.birth_day).all()
+        users = (
+            session.query(User)
+            .filter(User.tenant_id == config.TENANT_ID)
+            .order_by(User.birth_month, User.birth_day)
+            .all()
+        )
         return users
 
 
+def get_all_user_ids() -> Set[int]:
+    """
+    Получить множество tg_id всех пользователей текущего арендатора из таблицы users.
+    Загружаются только id, без создания ORM-объектов
+
+    :return: множество tg_id
+    """
+
+    s = make_session()
+    with s() as session:
+        return set(
+            session.execute(
+                select(User.tg_id).where(User.tenant_id == config.TENANT_ID)
+            ).scalars()
+        )
+
+
+def birthday_window_doys(today: date, before: int, after: int) -> List[int]:
+    """
+    Дни года (по високосному календарю, как User.birth_doy), для которых сегодня должен существовать чат.
+    Окно совпадает с FindBirthday.check_birthday: ДР от (сегодня - after + 1) до (сегодня + before).
+    Переход через новый год получается сам собой, а в невисокосный год 29 февраля празднуется 28-го
+
+    :param today: сегодняшняя дата
+    :param before: за сколько дней до ДР создается чат
+    :param after: сколько дней после ДР существует чат
+    :return: список дней года
+    """
+    doys = set()
+    for offset in range(1 - after, before + 1):
+        day = today + timedelta(days=offset)
+        doys.add(date(2000, day.month, day.day).timetuple().tm_yday)
+        if day.month == 2 and day.day == 28 and not calendar.isleap(day.year):
+            doys.add(60)
+    return sorted(doys)
+
+
+def get_birthday_window_users(
+    before: int = None, after: int = None, today: date = None
+) -> List[Type[User]]:
+    """
+    Получить активных пользователей текущего арендатора, для которых сегодня должен существовать чат.
+    Фильтрация выполняется в БД по индексу на birth_doy
+
+    :param before: за сколько дней до ДР создается чат. По умолчанию config.DAYS_BEFORE
+    :param after: сколько дней после ДР существует чат. По умолчанию config.DAYS_AFTER
+    :param today: дата, по умолчанию сегодня
+    :return: список пользователей
+    """
+    if before is None:
+        before = config.DAYS_BEFORE
+    if after is None:
+        after = config.DAYS_AFTER
+
+    doys = birthday_window_doys(today or datetime.now().date(), before, after)
+
+    s = make_session()
+    with s() as session:
+        return (
+            session.query(User)
+            .filter(
+                User.tenant_id == config.TENANT_ID,
+                User.birth_doy.in_(doys),
+                User.is_active == True,
+            )
+            .all()
+        )
+
+
 def get_active_users() -> List[Type[User]]:
     """
-    Получить всех пользователей из таблицы users
+    Получить активных пользователей текущего арендатора из таблицы users
 
     :return:
     """
 
     s = make_session()
     with s() as session:
-        users = session.query(User).filter(User.is_active == True).all()
+        users = (
+            session.query(User)
+            .filter(User.tenant_id == config.TENANT_ID, User.is_active == True)
+            .all()
+        )
         return users
 
 
 def get_account_link(chat_id) -> str:
     """
-    Проверяет, закреплен ли за чатом банковский счет. Если нет - закрепляет один из свободных.
+    Проверяет, закреплен ли за чатом банковский счет. Если нет - закрепляет один из свободных счетов арендатора.
 
     :raises RuntimeError: ошибка при отсутствии свободных счетов.
     :return: ссылка на счет
@@ -235,25 +1064,359 @@ def get_account_link(chat_id) -> str:
 
     s = make_session()
     with s() as session:
+        party_id = _current_chat(session, chat_id).id
 
         try:
             existing_account = (
-                session.query(BankAccount).filter(BankAccount.used_in == chat_id).one()
+                session.query(BankAccount).filter(BankAccount.used_in == party_id).one()
             )
             return existing_account.link
 
         except exc.NoResultFound:
             free_account = (
-                session.query(BankAccount).filter(BankAccount.used_in == None).first()
+                session.query(BankAccount)
+                .filter(BankAccount.tenant_id == config.TENANT_ID, BankAccount.used_in == None)
+                .first()
             )
             if free_account is not None:
-                free_account.used_in = chat_id
+                free_account.used_in = party_id
                 session.commit()
                 return free_account.link
             else:
                 raise RuntimeError("Нет свободных счетов!")
 
 
+def get_tenants() -> List[Type[Tenant]]:
+    """
+    Возвращает активных арендаторов
+
+    :return: список сущностей Tenant
+    """
+
+    s = make_session()
+    with s() as session:
+        return session.query(Tenant).filter(Tenant.is_active == True).all()
+
+
+def release_channel(channel_id: int) -> None:
+    """
+    Возвращает очищенный канал в пул
+
+    :param channel_id: id канала
+    :return: None
+    """
+
+    stmt = insert(PooledChannel).values(
+        channel_id=channel_id,
+        tenant_id=config.TENANT_ID,
+        status="free",
+        released_at=datetime.now(),
+    )
+
+    s = make_session()
+    with s() as session:
+        session.execute(
+            stmt.on_duplicate_key_update(
+                status=stmt.inserted.status, released_at=stmt.inserted.released_at, taken_at=None
+            )
+        )
+        session.commit()
+
+    logging.info("Канал %s возвращен в пул", channel_id)
+
+
+def take_pooled_channel() -> Optional[int]:
+    """
+    Забирает из пула канал, освободившийся раньше всех
+
+    :return: id канала или None, если пул пуст
+    """
+
+    s = make_session()
+    with s() as session:
+        channel = session.execute(
+            select(PooledChannel)
+            .where(PooledChannel.tenant_id == config.TENANT_ID, PooledChannel.status == "free")
+            .order_by(PooledChannel.released_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).scalar_one_or_none()
+        if channel is None:
+            return None
+
+        channel_id = channel.channel_id
+        channel.status = "taken"
+        channel.taken_at = datetime.now()
+        session.commit()
+        return channel_id
+
+
+def drop_pooled_channel(channel_id: int) -> None:
+    """
+    Удаляет канал из пула (например, если его удалили вручную)
+
+    :param channel_id: id канала
+    :return: None
+    """
+
+    s = make_session()
+    with s() as session:
+        session.execute(delete(PooledChannel).where(PooledChannel.channel_id == channel_id))
+        session.commit()
+
+
+def count_free_channels() -> int:
+    """
+    Количество каналов в пуле, готовых к переиспользованию
+
+    :return: количество каналов
+    """
+
+    s = make_session()
+    with s() as session:
+        return session.execute(
+            select(func.count()).where(
+                PooledChannel.tenant_id == config.TENANT_ID, PooledChannel.status == "free"
+            )
+        ).scalar_one()
+
+
+def get_bank_accounts() -> List[Type[BankAccount]]:
+    """
+    Получить все счета для сбора текущего арендатора
+
+    :return: список сущностей BankAccount
+    """
+
+    s = make_session()
+    with s() as session:
+        return (
+            session.query(BankAccount)
+            .filter(BankAccount.tenant_id == config.TENANT_ID)
+            .all()
+        )
+
+
+def get_unreachable_user_ids() -> Set[int]:
+    """
+    tg_id пользователей, которых сейчас нельзя добавить в чат (запись еще не истекла)
+
+    :return: множество tg_id
+    """
+
+    s = make_session()
+    with s() as session:
+        return set(
+            session.execute(
+                select(Invitability.tg_id).where(
+                    Invitability.reachable == False,
+                    Invitability.expires_at > datetime.now(),
+                )
+            ).scalars()
+        )
+
+
+def save_invitability(outcomes: Dict[int, Optional[str]], ttl_days: int) -> None:
+    """
+    Записывает результаты приглашений одним запросом
+
+    :param outcomes: причина отказа по tg_id, None - пользователь добавлен
+    :param ttl_days: через сколько дней результат устаревает
+    :return: None
+    """
+    if not outcomes:
+        return
+
+    now = datetime.now()
+    stmt = insert(Invitability).values(
+        [
+            {
+                "tg_id": tg_id,
+                "reachable": reason is None,
+                "reason": reason,
+                "checked_at": now,
+                "expires_at": now + timedelta(days=ttl_days),
+            }
+            for tg_id, reason in outcomes.items()
+        ]
+    )
+
+    s = make_session()
+    with s() as session:
+        session.execute(
+            stmt.on_duplicate_key_update(
+                reachable=stmt.inserted.reachable,
+                reason=stmt.inserted.reason,
+                checked_at=stmt.inserted.checked_at,
+                expires_at=stmt.inserted.expires_at,
+            )
+        )
+        session.commit()
+
+
+def queue_chat_invites(chat_id: int, priorities: Dict[int, int]) -> None:
+    """
+    Добавляет пользователей в очередь приглашений текущего чата в канале. Для тех, кто уже в очереди,
+    обновляется только приоритет
+
+    :param chat_id: id чата
+    :param priorities: приоритет по tg_id
+    :return: None
+    """
+    if not priorities:
+        return
+
+    s = make_session()
+    with s() as session:
+        party_id = _current_chat(session, chat_id).id
+        stmt = insert(ChatInvite).values(
+            [
+                {
+                    "party_id": party_id,
+                    "tg_id": tg_id,
+                    "priority": priority,
+                    "status": "pending",
+                }
+                for tg_id, priority in priorities.items()
+            ]
+        )
+        session.execute(stmt.on_duplicate_key_update(priority=stmt.inserted.priority))
+        session.commit()
+
+
+def get_pending_invites(chat_id: int) -> List[int]:
+    """
+    Очередь приглашений текущего чата в канале по убыванию приоритета
+
+    :param chat_id: id чата
+    :return: tg_id пользователей, которых еще не приглашали
+    """
+
+    s = make_session()
+    with s() as session:
+        return list(
+            session.execute(
+                select(ChatInvite.tg_id)
+                .where(
+                    ChatInvite.party_id == _current_chat(session, chat_id).id,
+                    ChatInvite.status == "pending",
+                )
+                .order_by(ChatInvite.priority.desc(), ChatInvite.tg_id)
+            ).scalars()
+        )
+
+
+def save_invite_results(chat_id: int, results: Dict[int, Tuple[str, Optional[str]]]) -> None:
+    """
+    Записывает результаты приглашений одним пакетным UPDATE
+
+    :param chat_id: id чата
+    :param results: пара (статус, ошибка) по tg_id
+    :return: None
+    """
+    if not results:
+        return
+
+    now = datetime.now()
+    s = make_session()
+    with s() as session:
+        party_id = _current_chat(session, chat_id).id
+        session.execute(
+            update(ChatInvite),
+            [
+                {
+                    "party_id": party_id,
+                    "tg_id": tg_id,
+                    "status": status,
+                    "error": error,
+                    "attempted_at": now,
+                }
+                for tg_id, (status, error) in results.items()
+            ],
+        )
+        session.commit()
+
+
+def count_invites_attempted_since(since: datetime) -> int:
+    """
+    Сколько приглашений в чаты текущего арендатора отправлено начиная с указанного момента.
+    Пропущенные без вызова API (skipped) не считаются
+
+    :param since: начало периода
+    :return: количество приглашений
+    """
+
+    s = make_session()
+    with s() as session:
+        return session.execute(
+            select(func.count())
+            .select_from(ChatInvite)
+            .join(Chat, Chat.id == ChatInvite.party_id)
+            .where(
+                Chat.tenant_id == config.TENANT_ID,
+                ChatInvite.status.in_(("added", "failed")),
+                ChatInvite.attempted_at >= since,
+            )
+        ).scalar_one()
+
+
+def get_past_participation() -> Dict[int, int]:
+    """
+    В сколько чатов текущего арендатора пользователь был успешно добавлен
+
+    :return: количество чатов по tg_id
+    """
+
+    s = make_session()
+    with s() as session:
+        rows = session.execute(
+            select(ChatInvite.tg_id, func.count())
+            .join(Chat, Chat.id == ChatInvite.party_id)
+            .where(Chat.tenant_id == config.TENANT_ID, ChatInvite.status == "added")
+            .group_by(ChatInvite.tg_id)
+        ).all()
+        return dict(rows)
+
+
+def get_chats_with_pending_invites() -> List[int]:
+    """
+    Активные чаты текущего арендатора, в очереди приглашений которых еще кто-то есть
+
+    :return: список id чатов
+    """
+
+    s = make_session()
+    with s() as session:
+        return list(
+            session.execute(
+                select(Chat.chat_id)
+                .join(ChatInvite, ChatInvite.party_id == Chat.id)
+                .where(
+                    Chat.tenant_id == config.TENANT_ID,
+                    Chat.is_active == True,
+                    ChatInvite.status == "pending",
+                )
+                .distinct()
+            ).scalars()
+        )
+
+
+def count_bank_accounts() -> int:
+    """
+    Количество счетов для сбора текущего арендатора (занятых и свободных)
+
+    :return: количество счетов
+    """
+
+    s = make_session()
+    with s() as session:
+        return session.execute(
+            select(func.count())
+            .select_from(BankAccount)
+            .where(BankAccount.tenant_id == config.TENANT_ID)
+        ).scalar_one()
+
+
 def deactivate_user(tg_id: int) -> bool:
     """
     Деактивирует пользователя
@@ -269,12 +1432,83 @@ def deactivate_user(tg_id: int) -> bool:
             user.is_active = False
             session.commit()
 
-            logging.info(f"Деактивирован пользователь: {user}")
+            logging.info("Деактивирован пользователь: %s", user)
             return True
 
         except exc.NoResultFound:
             return False
 
 
+def deactivate_users(tg_ids: Iterable[int]) -> int:
+    """
+    Деактивирует пользователей одним UPDATE-запросом
+
+    :param tg_ids: tg_id пользователей
+    :return: количество деактивированных пользователей
+    """
+    tg_ids = list(tg_ids)
+    if not tg_ids:
+        return 0
+
+    s = make_session()
+    with s() as session:
+        result = session.execute(
+            update(User)
+            .where(User.tg_id.in_(tg_ids), User.is_active == True)
+            .values(is_active=False)
+        )
+        session.commit()
+
+        logging.info("Деактивированы пользователи: %s", tg_ids)
+        return result.rowcount
+
+
+def save_run(trace: RunTrace) -> Run:
+    """
+    Сохраняет трассу запуска в таблицу runs
+
+    :param trace: трасса запуска
+    :return: сущность Run
+    """
+
+    s = make_session()
+    with s() as session:
+        run = Run(
+            command=trace.command,
+            started_at=trace.started_at,
+            finished_at=trace.finished_at,
+            duration=trace.duration,
+            status=trace.status,
+            error=trace.error,
+            stages=trace.stages,
+            api_calls=dict(trace.api_calls),
+            api_calls_total=sum(trace.api_calls.values()),
+            sleep_seconds=trace.sleep_seconds,
+        )
+        session.add(run)
+        session.commit()
+
+        logging.info("Трасса запуска сохранена: %s", trace)
+        return run
+
+
+def get_runs(command: str = None, limit: int = 10) -> List[Type[Run]]:
+    """
+    Возвращает последние запуски, от старых к новым
+
+    :param command: фильтр по команде
+    :param limit: количество запусков
+    :return: список сущностей Run
+    """
+
+    s = make_session()
+    with s() as session:
+        query = session.query(Run)
+        if command is not None:
+            query = query.filter(Run.command == command)
+        runs = query.order_by(Run.started_at.desc()).limit(limit).all()
+        return list(reversed(runs))
+
+
 if __name__ == "__main__":
     create_db_and_tables()
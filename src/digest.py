@@ -0,0 +1,129 @@
+from typing import Dict, List, Optional
+
+from telethon.sync import TelegramClient
+
+import config
+from logger import logging
+
+# Максимальная длина текстового сообщения в телеграме
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Порядок и заголовки разделов сводки
+SECTIONS = {
+    "created": "Созданные чаты",
+    "deleted": "Удаленные чаты",
+    "departed": "Удалены пользователи, покинувшие чат ЦПУ",
+    "new_users": "Новые пользователи в чате (добавьте их ФИО и ДР)",
+    "failures": "Ошибки",
+}
+
+
+class AdminDigest:
+    """
+    Собирает события за один запуск и отправляет администраторам одной сводкой,
+    вместо отдельного сообщения на каждое событие
+    """
+
+    def __init__(self, title: str = "Сводка по работе бота"):
+        self.title = title
+        self.events: Dict[str, List[str]] = {section: [] for section in SECTIONS}
+
+    def __len__(self) -> int:
+        return sum(len(lines) for lines in self.events.values())
+
+    def add(self, section: str, line: str) -> None:
+        """
+        Добавляет событие в раздел сводки
+
+        :param section: ключ раздела из SECTIONS
+        :param line: текст события
+        :return: None
+        """
+        self.events[section].append(line)
+
+    def chat_created(self, chat_title: str, invite_link: str) -> None:
+        self.add("created", f"{chat_title} {invite_link}")
+
+    def chat_deleted(self, chat_title: str) -> None:
+        self.add("deleted", chat_title)
+
+    def user_departed(self, short_name: str, last_name: str) -> None:
+        self.add("departed", f"{short_name} {last_name}")
+
+    def new_user(self, tg_id: int, username: str, first_name: str, last_name: str) -> None:
+        self.add("new_users", f"{first_name} {last_name} (@{username}, tgid: {tg_id})")
+
+    def failure(self, text: str) -> None:
+        self.add("failures", text)
+
+    def render(self) -> str:
+        """
+        Формирует текст сводки. Пустые разделы пропускаются
+
+        :return: текст сводки
+        """
+        lines = [self.title]
+        for section, header in SECTIONS.items():
+            if self.events[section]:
+                lines.append("")
+                lines.append(f"{header} ({len(self.events[section])}):")
+                lines.extend(f"- {event}" for event in self.events[section])
+        return "\n".join(lines)
+
+    def chunks(self, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+        """
+        Делит сводку на сообщения не длиннее limit символов по границам строк.
+        Слишком длинные строки режутся принудительно
+
+        :param limit: максимальная длина одного сообщения
+        :return: список сообщений
+        """
+        chunks = []
+        current = ""
+        for line in self.render().split("\n"):
+            while len(line) > limit:
+                if current:
+                    chunks.append(current)
+                    current = ""
+                chunks.append(line[:limit])
+                line = line[limit:]
+
+            candidate = f"{current}\n{line}" if current else line
+            if len(candidate) > limit:
+                chunks.append(current)
+                current = line
+            else:
+                current = candidate
+
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def send(self, client: TelegramClient, admin_ids: Optional[List[int]] = None) -> None:
+        """
+        Отправляет сводку каждому администратору и очищает накопленные события.
+        Если событий нет - ничего не отправляется
+
+        :param client: клиент телеграма
+        :param admin_ids: tg id получателей, по умолчанию config.ADMIN_IDS
+        :return: None
+        """
+        if len(self) == 0:
+            logging.info("Нет событий для сводки администраторам")
+            return
+
+        if admin_ids is None:
+            admin_ids = config.ADMIN_IDS
+
+        messages = self.chunks()
+        for tg_id in admin_ids:
+            for message in messages:
+                try:
+                    client.send_message(tg_id, message)
+                except Exception as e:
+                    logging.info("Не удалось отправить сводку администратору %s. Ошибка: %s", tg_id, e)
+
+        logging.info(
+            "Сводка из %s событий отправлена администраторам (%s сообщ.)", len(self), len(messages)
+        )
+        self.events = {section: [] for section in SECTIONS}
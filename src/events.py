@@ -0,0 +1,138 @@
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, List
+
+import config
+import data
+from logger import logging
+from models import User
+from utils import FindBirthday
+
+# Типы событий. Создание чата планируется для пользователя, остальные - для созданного чата
+CREATE_CHAT = "create_chat"
+BIRTHDAY_NOTICE = "birthday_notice"
+DELETION_WARNING = "deletion_warning"
+DELETE_CHAT = "delete_chat"
+
+
+def window_birthday(birth_month: int, birth_day: int, day: date) -> date:
+    """
+    День рождения, окно чата которого содержит указанный день или начнется позже.
+    Чат существует с (ДР - DAYS_BEFORE) по (ДР + DAYS_AFTER - 1) включительно, как в FindBirthday.check_birthday
+
+    :param birth_month: месяц рождения
+    :param birth_day: день рождения
+    :param day: день
+    :return: дата дня рождения
+    """
+    since = day - timedelta(days=max(config.DAYS_AFTER - 1, 0))
+    bdate = FindBirthday.birthday_in_year(since.year, birth_month, birth_day).date()
+    if bdate < since:
+        bdate = FindBirthday.birthday_in_year(since.year + 1, birth_month, birth_day).date()
+    return bdate
+
+
+def at_event_hour(day: date) -> datetime:
+    return datetime.combine(day, time(hour=config.EVENT_HOUR))
+
+
+def user_events(user: User, day: date) -> List[dict]:
+    """
+    Событие создания чата к ближайшему дню рождения пользователя.
+    Если окно чата уже открыто, событие наступает сразу
+
+    :param user: пользователь
+    :param day: день, начиная с которого ищется день рождения
+    :return: события для data.schedule_events
+    """
+    bdate = window_birthday(user.birth_month, user.birth_day, day)
+    opens = bdate - timedelta(days=config.DAYS_BEFORE)
+    due_at = at_event_hour(opens) if opens > day else datetime.combine(day, time())
+    return [
+        {
+            "kind": CREATE_CHAT,
+            "tg_id": user.tg_id,
+            "due_at": due_at,
+            "dedup_key": f"{CREATE_CHAT}:{user.tg_id}:{bdate}",
+        }
+    ]
+
+
+def chat_events(chat_id: int, bdayer: User, created: date) -> List[dict]:
+    """
+    Уведомление о дне рождения, предупреждение об удалении (за сутки) и удаление чата
+
+    :param chat_id: id чата
+    :param bdayer: именинник
+    :param created: день создания чата
+    :return: события для data.schedule_events
+    """
+    bdate = window_birthday(bdayer.birth_month, bdayer.birth_day, created)
+    deletion_day = bdate + timedelta(days=config.DAYS_AFTER)
+    due = {
+        BIRTHDAY_NOTICE: at_event_hour(bdate),
+        DELETION_WARNING: at_event_hour(deletion_day - timedelta(days=1)),
+        DELETE_CHAT: at_event_hour(deletion_day),
+    }
+    return [
+        {"kind": kind, "chat_id": chat_id, "due_at": due_at, "dedup_key": f"{kind}:{chat_id}:{bdate}"}
+        for kind, due_at in due.items()
+    ]
+
+
+def schedule_users(users: Iterable[User], day: date = None) -> int:
+    """
+    Планирует создание чатов к ближайшим дням рождения пользователей
+
+    :param users: пользователи
+    :param day: день, начиная с которого ищутся дни рождения, по умолчанию сегодня
+    :return: количество новых событий
+    """
+    day = day or datetime.now().date()
+    events = [
+        event
+        for user in users
+        if user.birth_month and user.birth_day
+        for event in user_events(user, day)
+    ]
+    return data.schedule_events(events)
+
+
+def schedule_chat(chat_id: int, bdayer: User, created: date = None) -> int:
+    """
+    Планирует события созданного чата
+
+    :param chat_id: id чата
+    :param bdayer: именинник
+    :param created: день создания чата, по умолчанию сегодня
+    :return: количество новых событий
+    """
+    return data.schedule_events(chat_events(chat_id, bdayer, created or datetime.now().date()))
+
+
+def schedule_new_users() -> int:
+    """
+    Планирует создание чатов для активных пользователей без запланированного события
+    (новые пользователи, снова активные, первый запуск планировщика)
+
+    :return: количество новых событий
+    """
+    scheduled = schedule_users(data.get_users_without_events())
+    if scheduled:
+        logging.info("Запланировано создание чатов для %s пользователей", scheduled)
+    return scheduled
+
+
+def schedule_active_chats() -> int:
+    """
+    Планирует события для активных чатов, созданных до включения планировщика
+
+    :return: количество новых событий
+    """
+    users = {user.tg_id: user for user in data.get_all_users()}
+    scheduled = sum(
+        schedule_chat(chat.chat_id, users[chat.bdayer_id], chat.created_at.date())
+        for chat in data.get_active_chats()
+        if chat.bdayer_id in users
+    )
+    logging.info("Запланированы события для активных чатов: %s", scheduled)
+    return scheduled
@@ -0,0 +1,195 @@
+import calendar
+import sys
+from datetime import date
+from typing import Iterable, List, NamedTuple, Tuple
+
+import numpy as np
+import pandas as pd
+
+import config
+import data
+from models import User
+
+
+class Shortfall(NamedTuple):
+    """
+    Период, когда чатов больше, чем счетов для сбора
+    """
+
+    start: date
+    end: date
+    deficit: int
+
+
+def birthday_arrays(users: Iterable[User]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Месяцы и дни рождения активных пользователей с заполненной датой рождения
+
+    :param users: пользователи
+    :return: массивы месяцев и дней
+    """
+    pairs = [
+        (user.birth_month, user.birth_day)
+        for user in users
+        if user.is_active and user.birth_month and user.birth_day
+    ]
+    if not pairs:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+
+    months, days = np.array(pairs, dtype=int).T
+    return months, days
+
+
+def birthday_dates(months: np.ndarray, days: np.ndarray, year: int) -> np.ndarray:
+    """
+    Даты дней рождения в указанном году. В невисокосный год 29 февраля празднуется 28-го
+
+    :param months: месяцы рождения
+    :param days: дни рождения
+    :param year: год
+    :return: массив datetime64[D]
+    """
+    if not calendar.isleap(year):
+        days = np.where((months == 2) & (days == 29), 28, days)
+
+    month_starts = (np.datetime64(str(year), "Y") + (months - 1).astype("timedelta64[M]")).astype(
+        "datetime64[D]"
+    )
+    return month_starts + (days - 1).astype("timedelta64[D]")
+
+
+def occupancy_timeline(
+    months: np.ndarray,
+    days: np.ndarray,
+    start: date,
+    horizon: int = 365,
+    before: int = None,
+    after: int = None,
+) -> pd.Series:
+    """
+    Считает, сколько чатов (и, значит, счетов) занято в каждый день.
+    Чат занимает счет со дня создания (за before дней до ДР) по день удаления (через after дней после ДР) включительно.
+    Ограничение "не больше одного нового чата в сутки" не учитывается, поэтому прогноз - оценка сверху
+
+    :param months: месяцы рождения
+    :param days: дни рождения
+    :param start: первый день прогноза
+    :param horizon: количество дней прогноза
+    :param before: за сколько дней до ДР создается чат. По умолчанию config.DAYS_BEFORE
+    :param after: сколько дней после ДР существует чат. По умолчанию config.DAYS_AFTER
+    :return: количество занятых счетов по дням
+    """
+    if before is None:
+        before = config.DAYS_BEFORE
+    if after is None:
+        after = config.DAYS_AFTER
+
+    first_day = np.datetime64(start, "D")
+    index = pd.date_range(start, periods=horizon, freq="D")
+
+    # Окна дней рождения соседних лет тоже могут попасть в прогноз (ДР в начале января, прогноз с декабря)
+    years = range(start.year - 1, (index[-1].year if horizon else start.year) + 2)
+    bdates = np.concatenate([birthday_dates(months, days, year) for year in years])
+
+    opened = (bdates - before - first_day).astype(int)
+    closed = (bdates + after + 1 - first_day).astype(int)
+
+    # Массив изменений: +1 в день создания чата, -1 на следующий день после удаления
+    delta = np.zeros(horizon + 1, dtype=int)
+    np.add.at(delta, np.clip(opened, 0, horizon), 1)
+    np.add.at(delta, np.clip(closed, 0, horizon), -1)
+
+    return pd.Series(np.cumsum(delta[:horizon]), index=index, name="chats")
+
+
+def find_shortfalls(timeline: pd.Series, accounts: int) -> List[Shortfall]:
+    """
+    Находит периоды, когда занятых счетов больше, чем есть в таблице bank_accounts
+
+    :param timeline: результат occupancy_timeline
+    :param accounts: количество счетов
+    :return: периоды нехватки
+    """
+    deficit = timeline - accounts
+    short = deficit > 0
+    if not short.any():
+        return []
+
+    # Номер периода растет на каждом переходе "хватает" -> "не хватает"
+    period = (short & ~short.shift(fill_value=False)).cumsum()[short]
+    grouped = deficit[short].groupby(period)
+    return [
+        Shortfall(group.index[0].date(), group.index[-1].date(), int(group.max()))
+        for _, group in grouped
+    ]
+
+
+def what_if(
+    months: np.ndarray,
+    days: np.ndarray,
+    accounts: int,
+    start: date,
+    horizon: int,
+    befores: Iterable[int],
+    afters: Iterable[int],
+) -> pd.DataFrame:
+    """
+    Прогноз для других настроек DAYS_BEFORE и DAYS_AFTER
+
+    :return: таблица с пиком, количеством дней нехватки и необходимым числом счетов для каждой пары настроек
+    """
+    rows = []
+    for before in befores:
+        for after in afters:
+            timeline = occupancy_timeline(months, days, start, horizon, before, after)
+            rows.append(
+                {
+                    "DAYS_BEFORE": before,
+                    "DAYS_AFTER": after,
+                    "peak": int(timeline.max()) if horizon else 0,
+                    "shortfall_days": int((timeline > accounts).sum()),
+                    "accounts_needed": max(0, int(timeline.max()) - accounts) if horizon else 0,
+                }
+            )
+    return pd.DataFrame(rows).set_index(["DAYS_BEFORE", "DAYS_AFTER"])
+
+
+def report(start: date, horizon: int, befores: Iterable[int], afters: Iterable[int]) -> None:
+    """
+    Печатает прогноз нехватки счетов и сравнение с другими настройками
+
+    :param start: первый день
+    :param horizon: на сколько дней вперед
+    :param befores: DAYS_BEFORE для сравнения
+    :param afters: DAYS_AFTER для сравнения
+    :return: None
+    """
+    months, days = birthday_arrays(data.get_active_users())
+    accounts = data.count_bank_accounts()
+
+    timeline = occupancy_timeline(months, days, start, horizon)
+    peak = int(timeline.max()) if horizon else 0
+    print(
+        f"Пользователей с датой рождения: {len(months)}, счетов: {accounts}, "
+        f"DAYS_BEFORE={config.DAYS_BEFORE}, DAYS_AFTER={config.DAYS_AFTER}"
+    )
+    if peak:
+        print(f"Пик одновременных чатов: {peak} ({timeline.idxmax():%d.%m.%Y})")
+
+    shortfalls = find_shortfalls(timeline, accounts)
+    if shortfalls:
+        print("\nНе хватит счетов:")
+        for shortfall in shortfalls:
+            print(f"  {shortfall.start:%d.%m.%Y} - {shortfall.end:%d.%m.%Y}: не хватает {shortfall.deficit}")
+    else:
+        print("Счетов хватает на весь период")
+
+    print("\nДругие настройки:")
+    print(what_if(months, days, accounts, start, horizon, befores, afters).to_string())
+
+
+if __name__ == "__main__":
+    import cli
+
+    args = cli.parse_args(["forecast", *sys.argv[1:]])
+    report(args.start, args.days, args.before, args.after)
@@ -1,7 +1,97 @@
+import atexit
+import gzip
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import shutil
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(message)s",
-    handlers=[logging.FileHandler("bot.log"), logging.StreamHandler()],
-)
+import config
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Форматирует записи лога в JSON, по одной записи на строку
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def gzip_rotator(source: str, dest: str) -> None:
+    """
+    Сжимает ротированный файл лога
+    """
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def make_file_handler() -> logging.Handler:
+    """
+    Создает файловый обработчик с ротацией по размеру или по времени и сжатием старых файлов
+
+    :return: обработчик
+    """
+    if config.LOG_ROTATION == "time":
+        handler = logging.handlers.TimedRotatingFileHandler(
+            config.LOG_FILE,
+            when=config.LOG_ROTATION_WHEN,
+            backupCount=config.LOG_BACKUP_COUNT,
+            encoding="utf-8",
+            delay=True,
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            config.LOG_FILE,
+            maxBytes=config.LOG_MAX_BYTES,
+            backupCount=config.LOG_BACKUP_COUNT,
+            encoding="utf-8",
+            delay=True,
+        )
+
+    handler.namer = lambda name: name + ".gz"
+    handler.rotator = gzip_rotator
+    return handler
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """
+    Настраивает корневой логгер. Запись в файл и консоль выполняется в отдельном потоке
+    QueueListener, поэтому вызовы logging.* не ждут дискового ввода-вывода
+
+    :return: запущенный QueueListener
+    """
+    if config.LOG_JSON:
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("%(asctime)s %(levelname)s %(message)s")
+
+    handlers = [make_file_handler(), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+
+    root = logging.getLogger()
+    root.setLevel(config.LOG_LEVEL)
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+listener = setup_logging()
@@ -4,23 +4,30 @@ from typing import List
 from telethon.sync import TelegramClient
 
 import config
-import data
+import metrics
+import profiling
+from digest import AdminDigest
 from models import User
 from partycleaner import PartyCleaner
 from partymaker import PartyMaker
+from repository import Repository
+from runs import record_run
 from utils import FindBirthday, ChatTools, signin
 
 
-def main(chat_users: List[User], client: TelegramClient):
+@profiling.profiled("main")
+def main(
+    chat_users: List[User], client: TelegramClient, digest: AdminDigest, repo: Repository = None
+):
 
     # Вычисляем именников
-    fb = FindBirthday(chat_users)
+    fb = FindBirthday(chat_users, repo)
     birthday_users = fb.birthday_users
 
     chat_id = config.MAIN_CHAT_ID
 
     # Удаляем устаревшие чаты
-    pc = PartyCleaner(client)
+    pc = PartyCleaner(client, digest, repo)
     pc.clean_party()
 
     # В день должно создаваться не больше одного чата. Во избежание бана от телеграма
@@ -28,20 +35,35 @@ def main(chat_users: List[User], client: TelegramClient):
     print("Bday User: ", bday_user)
 
     # Мероприятия по созданию чата
-    pm = PartyMaker(client, chat_id, bday_user)
+    pm = PartyMaker(client, chat_id, bday_user, digest, repo=repo)
     pm.make_party()
 
 
-if __name__ == "__main__":
+def daily_run() -> None:
+    """
+    Ежедневный запуск: сверка участников, удаление устаревших чатов и создание чата имениннику
+    """
     dog_client = signin(config.BOT_API_ID, config.BOT_API_HASH)
 
-    with dog_client:
+    with dog_client, record_run("main"):
+        # Все события запуска собираются в одну сводку для администраторов
+        run_digest = AdminDigest()
+
+        try:
+            # Пользователи, чаты и счета загружаются один раз и общие для всех этапов запуска
+            repo = Repository()
 
-        ct = ChatTools(dog_client, config.MAIN_CHAT_ID)
-        ct.find_db_users_not_in_chat()  # Ищем пользователей в БД, но не в чате
-        ct.find_chat_users_not_in_db()  # Ищем пользователей в чате, но не в БД
+            ct = ChatTools(dog_client, config.MAIN_CHAT_ID, repo)
+            ct.find_db_users_not_in_chat()  # Ищем пользователей в БД, но не в чате
+            ct.notify_about_new_users(run_digest)  # Ищем пользователей в чате, но не в БД
 
-        users = data.get_active_users()
-        main(users, dog_client)
+            users = repo.birthday_window_users()
+            main(users, dog_client, run_digest, repo)
+        finally:
+            run_digest.send(dog_client)
+            metrics.write_textfile("main")
 
+
+if __name__ == "__main__":
+    daily_run()
     sys.exit(0)
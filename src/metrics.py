@@ -0,0 +1,210 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterator, Type, Union
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    start_http_server,
+    write_to_textfile,
+)
+from sqlalchemy import Engine, event
+
+import config
+import tracing
+from logger import logging
+
+# telethon нужен только командам, которые ходят в телеграм (см. cli)
+if TYPE_CHECKING:
+    from telethon.sync import TelegramClient
+
+REGISTRY = CollectorRegistry()
+
+TELEGRAM_REQUEST_SECONDS = Histogram(
+    "birthday_dog_telegram_request_seconds",
+    "Длительность запросов к API телеграма",
+    ["request"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+    registry=REGISTRY,
+)
+TELEGRAM_FLOOD_WAITS = Counter(
+    "birthday_dog_telegram_flood_waits_total",
+    "Количество FloodWait. waited=true - Telethon переждал сам, false - пробросил ошибку",
+    ["request", "waited"],
+    registry=REGISTRY,
+)
+TELEGRAM_FLOOD_WAIT_SECONDS = Counter(
+    "birthday_dog_telegram_flood_wait_seconds_total",
+    "Суммарная длительность FloodWait. waited=true - Telethon переждал сам, false - пробросил ошибку",
+    ["request", "waited"],
+    registry=REGISTRY,
+)
+PACING_SLEEP_SECONDS = Counter(
+    "birthday_dog_pacing_sleep_seconds_total",
+    "Время, проведенное в намеренных паузах между вызовами API",
+    registry=REGISTRY,
+)
+RATE_LIMIT_WAIT_SECONDS = Counter(
+    "birthday_dog_rate_limit_wait_seconds_total",
+    "Время ожидания токена общего лимита вызовов API",
+    ["method_class"],
+    registry=REGISTRY,
+)
+DB_QUERY_SECONDS = Histogram(
+    "birthday_dog_db_query_seconds",
+    "Длительность запросов к БД",
+    ["statement"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+    registry=REGISTRY,
+)
+STAGE_SECONDS = Histogram(
+    "birthday_dog_stage_seconds",
+    "Длительность этапов создания и удаления чатов",
+    ["stage"],
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200),
+    registry=REGISTRY,
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Замеряет длительность этапа. Работает и как контекстный менеджер, и как декоратор
+
+    :param name: название этапа
+    """
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.labels(name).observe(seconds)
+        tracing.record_stage(name, seconds, failed)
+
+
+def observe_rate_wait(method_class: str, seconds: float) -> None:
+    RATE_LIMIT_WAIT_SECONDS.labels(method_class).inc(seconds)
+
+
+def observe_sleep(seconds: float) -> None:
+    PACING_SLEEP_SECONDS.inc(seconds)
+    tracing.record_sleep(seconds)
+
+
+# Сообщение, с которым Telethon пережидает FloodWait (telethon.client.users._fmt_flood)
+FLOOD_SLEEP_MESSAGE = "Sleeping%s for %ds (%s) on %s flood wait"
+
+
+class FloodSleepCounter(logging.Filter):
+    """
+    Считает FloodWait, которые Telethon пережидает сам (flood_sleep_threshold). Хука для этого
+    у Telethon нет, а ошибка до обертки _call не доходит, поэтому ожидание видно только по записи в лог
+    """
+
+    def __init__(self, level: int):
+        super().__init__()
+        # Уровень логгера до подключения: записи ниже него в лог не пропускаются
+        self.level = level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Ранние ожидания (" early") повторяют уже учтенный FloodWait
+        if record.msg == FLOOD_SLEEP_MESSAGE and record.args[0] == "":
+            _, seconds, _, name = record.args
+            name = "batch" if name == "list" else name
+            TELEGRAM_FLOOD_WAITS.labels(name, "true").inc()
+            TELEGRAM_FLOOD_WAIT_SECONDS.labels(name, "true").inc(seconds)
+        return record.levelno >= self.level
+
+
+def instrument_client(client: "TelegramClient") -> "TelegramClient":
+    """
+    Оборачивает низкоуровневый вызов API клиента, чтобы замерять каждый запрос.
+    Повторы и FloodWait обрабатывает сам Telethon (flood_sleep_threshold, request_retries):
+    короткие ожидания входят в длительность запроса и считаются по логу Telethon (FloodSleepCounter),
+    а FloodWait, который Telethon не стал пережидать, учитывается в метриках и пробрасывается дальше
+
+    :param client: клиент телеграма
+    :return: тот же клиент
+    """
+    from telethon import errors
+
+    call = client._call
+
+    # Логгер общий для всех клиентов, счетчик подключается к нему один раз
+    flood_log = client._log["telethon.client.users"]
+    if not any(isinstance(f, FloodSleepCounter) for f in flood_log.filters):
+        flood_log.addFilter(FloodSleepCounter(flood_log.getEffectiveLevel()))
+        flood_log.setLevel(min(flood_log.getEffectiveLevel(), logging.INFO))
+
+    async def _call(sender, request, ordered=False, flood_sleep_threshold=None):
+        name = "batch" if isinstance(request, list) else type(request).__name__
+        tracing.record_api_call(name)
+
+        started = time.perf_counter()
+        try:
+            return await call(sender, request, ordered=ordered, flood_sleep_threshold=flood_sleep_threshold)
+        except errors.FloodWaitError as e:
+            TELEGRAM_FLOOD_WAITS.labels(name, "false").inc()
+            TELEGRAM_FLOOD_WAIT_SECONDS.labels(name, "false").inc(e.seconds)
+            raise
+        finally:
+            TELEGRAM_REQUEST_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+    client._call = _call
+    return client
+
+
+def instrument_engine(engine: Union[Engine, Type[Engine]]) -> Union[Engine, Type[Engine]]:
+    """
+    Подписывается на события движка SQLAlchemy, чтобы замерять запросы к БД.
+    Если передан класс Engine - замеряются все движки, включая созданные позже
+
+    :param engine: движок SQLAlchemy или класс Engine
+    :return: тот же движок
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+        DB_QUERY_SECONDS.labels(verb).observe(time.perf_counter() - started)
+
+    return engine
+
+
+def serve(port: int = None) -> None:
+    """
+    Поднимает HTTP-эндпоинт /metrics для Prometheus (режим демона)
+
+    :param port: порт, по умолчанию config.METRICS_PORT
+    :return: None
+    """
+    port = port or config.METRICS_PORT
+    start_http_server(port, registry=REGISTRY)
+    logging.info("Метрики доступны на порту %s", port)
+
+
+def write_textfile(job: str) -> None:
+    """
+    Записывает метрики в файл для textfile-коллектора node_exporter (запуски из cron).
+    Ничего не делает, если config.METRICS_TEXTFILE_DIR не задан
+
+    :param job: имя задачи, используется в имени файла
+    :return: None
+    """
+    if not config.METRICS_TEXTFILE_DIR:
+        return
+
+    path = os.path.join(config.METRICS_TEXTFILE_DIR, f"birthday_dog_{job}.prom")
+    write_to_textfile(path, REGISTRY)
+    logging.info("Метрики записаны в %s", path)
@@ -1,6 +1,21 @@
 from typing import List, Optional
 
-from sqlalchemy import ForeignKey, String, BigInteger, Integer, DateTime, Boolean, func
+from sqlalchemy import (
+    ForeignKey,
+    String,
+    BigInteger,
+    Integer,
+    DateTime,
+    Date,
+    Computed,
+    Boolean,
+    LargeBinary,
+    Float,
+    JSON,
+    Text,
+    Index,
+    func,
+)
 from sqlalchemy.orm import DeclarativeBase, Mapped, relationship, mapped_column
 
 
@@ -8,9 +23,43 @@ class Base(DeclarativeBase):
     pass
 
 
+class Tenant(Base):
+    """
+    Арендатор: основной чат со своими пользователями, чатами, счетами и телеграм-аккаунтом.
+    Пустые поля берутся из общих настроек (.env)
+    """
+
+    __tablename__ = "tenants"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    name: Mapped[str] = mapped_column(String(64), nullable=False, unique=True)
+    main_chat_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    admin_ids: Mapped[list] = mapped_column(JSON, nullable=True)
+    card_number: Mapped[str] = mapped_column(String(32), nullable=True)
+    session_name: Mapped[str] = mapped_column(String(64), nullable=True)
+    days_before: Mapped[int] = mapped_column(Integer, nullable=True)
+    days_after: Mapped[int] = mapped_column(Integer, nullable=True)
+    is_active: Mapped[bool] = mapped_column(Boolean, nullable=False, default=True)
+
+    def __repr__(self):
+        return "Tenant(id=%s, name='%s', main_chat_id='%s')" % (
+            self.id,
+            self.name,
+            self.main_chat_id,
+        )
+
+
+BIRTH_DOY_SQL = (
+    "dayofyear(makedate(2000, 1) + interval (birth_month - 1) month + interval (birth_day - 1) day)"
+)
+
+
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (Index("ix_users_tenant_id_birth_doy", "tenant_id", "birth_doy"),)
     tg_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    tenant_id: Mapped[int] = mapped_column(
+        ForeignKey("tenants.id"), nullable=False, default=1, server_default="1"
+    )
     username: Mapped[str] = mapped_column(String(32), nullable=True, unique=True)
     short_name: Mapped[str] = mapped_column(String(32), nullable=True)
     last_name: Mapped[str] = mapped_column(String(32), nullable=True)
@@ -18,6 +67,16 @@ class User(Base):
     birth_month: Mapped[int] = mapped_column(Integer, nullable=True)
     gender: Mapped[str] = mapped_column(String(32), nullable=True)
     is_active: Mapped[bool] = mapped_column(Boolean, nullable=False, default=True)
+    # Команда, отдел и т.п. Коллег именинника приглашают в чат первыми
+    tags: Mapped[Optional[List[str]]] = mapped_column(JSON, nullable=True)
+
+    # День года рождения по високосному календарю (29 февраля - 60, 31 декабря - 366).
+    # Вычисляется БД, по нему именинники выбираются индексом, а не перебором всех пользователей
+    birth_doy: Mapped[int] = mapped_column(
+        Integer,
+        Computed(BIRTH_DOY_SQL, persisted=True),
+        nullable=True,
+    )
 
     chats: Mapped[List["Chat"]] = relationship()
     bank_account: Mapped[List["BankAccount"]] = relationship()
@@ -37,8 +96,17 @@ class User(Base):
 
 
 class Chat(Base):
+    """
+    Чат дня рождения. Канал из пула (см. PooledChannel) сохраняет chat_id,
+    поэтому каждый чат в канале - отдельная запись со своим id, а текущий чат канала - последняя из них
+    """
+
     __tablename__ = "chats"
-    chat_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
+    tenant_id: Mapped[int] = mapped_column(
+        ForeignKey("tenants.id"), nullable=False, default=1, server_default="1"
+    )
     chat_title: Mapped[str] = mapped_column(String(64), nullable=True, default=None)
     invite_link: Mapped[str] = mapped_column(String(64), nullable=False, unique=True)
     bdayer_id: Mapped[int] = mapped_column(ForeignKey("users.tg_id"))
@@ -61,7 +129,8 @@ class Chat(Base):
     bank_account: Mapped["BankAccount"] = relationship(back_populates="chat")
 
     def __repr__(self):
-        return "Chat(id=%s, invite_link='%s', bdayer_id='%s', created_at='%s')" % (
+        return "Chat(id=%s, chat_id=%s, invite_link='%s', bdayer_id='%s', created_at='%s')" % (
+            self.id,
             self.chat_id,
             self.invite_link,
             self.bdayer_id,
@@ -72,9 +141,13 @@ class Chat(Base):
 class BankAccount(Base):
     __tablename__ = "bank_accounts"
     link: Mapped[str] = mapped_column(String(64), primary_key=True)
+    tenant_id: Mapped[int] = mapped_column(
+        ForeignKey("tenants.id"), nullable=False, default=1, server_default="1"
+    )
     owner_id: Mapped[int] = mapped_column(ForeignKey("users.tg_id"))
+    # Запись чата (chats.id), за которым закреплен счет
     used_in: Mapped[int] = mapped_column(
-        ForeignKey("chats.chat_id", ondelete="SET NULL"), nullable=True
+        ForeignKey("chats.id", ondelete="SET NULL"), nullable=True
     )
 
     user: Mapped["User"] = relationship(back_populates="bank_account")
@@ -86,3 +159,340 @@ class BankAccount(Base):
             self.owner_id,
             self.used_in,
         )
+
+
+class TelegramSession(Base):
+    """
+    Авторизация телеграм-аккаунта, общая для всех процессов и хостов
+    """
+
+    __tablename__ = "tg_sessions"
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    dc_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    server_address: Mapped[str] = mapped_column(String(64), nullable=True)
+    port: Mapped[int] = mapped_column(Integer, nullable=True)
+    auth_key: Mapped[bytes] = mapped_column(LargeBinary(256), nullable=True)
+    takeout_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    updated_at = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+        nullable=False,
+    )
+
+    def __repr__(self):
+        return "TelegramSession(name=%s, dc_id='%s', updated_at='%s')" % (
+            self.name,
+            self.dc_id,
+            self.updated_at,
+        )
+
+
+class TelegramEntity(Base):
+    """
+    Кэш сущностей телеграма (id и access_hash пользователей и каналов) для сессии
+    """
+
+    __tablename__ = "tg_entities"
+    session_name: Mapped[str] = mapped_column(
+        ForeignKey("tg_sessions.name", ondelete="CASCADE"), primary_key=True
+    )
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    hash: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    username: Mapped[str] = mapped_column(String(32), nullable=True, index=True)
+    phone: Mapped[str] = mapped_column(String(32), nullable=True, index=True)
+    name: Mapped[str] = mapped_column(String(255), nullable=True)
+    date: Mapped[int] = mapped_column(BigInteger, nullable=True)
+
+    def __repr__(self):
+        return "TelegramEntity(id=%s, username='%s', name='%s')" % (
+            self.id,
+            self.username,
+            self.name,
+        )
+
+
+class Run(Base):
+    """
+    Трасса одного запуска бота: этапы, вызовы API, паузы и результат
+    """
+
+    __tablename__ = "runs"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    command: Mapped[str] = mapped_column(String(32), nullable=False, index=True)
+    started_at = mapped_column(DateTime(timezone=True), nullable=False, index=True)
+    finished_at = mapped_column(DateTime(timezone=True), nullable=True)
+    duration: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+    status: Mapped[str] = mapped_column(String(16), nullable=False)
+    error: Mapped[str] = mapped_column(Text, nullable=True)
+    stages: Mapped[dict] = mapped_column(JSON, nullable=False, default=dict)
+    api_calls: Mapped[dict] = mapped_column(JSON, nullable=False, default=dict)
+    api_calls_total: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    sleep_seconds: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+
+    def __repr__(self):
+        return "Run(id=%s, command='%s', started_at='%s', status='%s')" % (
+            self.id,
+            self.command,
+            self.started_at,
+            self.status,
+        )
+
+
+class OutboxMessage(Base):
+    """
+    Сообщение в чат, поставленное в очередь на отправку (transactional outbox).
+    Записывается в той же транзакции, что и изменение состояния чата
+    """
+
+    __tablename__ = "outbox"
+    __table_args__ = (Index("ix_outbox_status_created_at", "status", "created_at"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    # Сообщение отправляет телеграм-аккаунт арендатора, которому принадлежит чат
+    tenant_id: Mapped[int] = mapped_column(
+        ForeignKey("tenants.id"), nullable=False, default=1, server_default="1"
+    )
+    chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    kind: Mapped[str] = mapped_column(String(32), nullable=False)
+    text: Mapped[str] = mapped_column(Text, nullable=False)
+    dedup_key: Mapped[str] = mapped_column(String(128), nullable=False, unique=True)
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="pending")
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    last_error: Mapped[str] = mapped_column(Text, nullable=True)
+    locked_until = mapped_column(DateTime(timezone=True), nullable=True)
+    # После ошибки сообщение отправляется повторно не раньше этого времени
+    available_at = mapped_column(DateTime(timezone=True), nullable=True)
+    created_at = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+    sent_at = mapped_column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return "OutboxMessage(id=%s, chat_id='%s', kind='%s', status='%s')" % (
+            self.id,
+            self.chat_id,
+            self.kind,
+            self.status,
+        )
+
+
+class Task(Base):
+    """
+    Задача в очереди (создание канала, пачка приглашений, сообщение в ЛС, удаление канала, ...).
+    Задачу захватывает воркер на время аренды, после ошибки она повторяется с задержкой
+    """
+
+    __tablename__ = "tasks"
+    __table_args__ = (Index("ix_tasks_kind_status_run_after", "kind", "status", "run_after"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    tenant_id: Mapped[int] = mapped_column(
+        ForeignKey("tenants.id"), nullable=False, default=1, server_default="1"
+    )
+    kind: Mapped[str] = mapped_column(String(32), nullable=False)
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False, default=dict)
+    dedup_key: Mapped[str] = mapped_column(String(128), nullable=True, unique=True)
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="pending")
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    max_attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=5)
+    run_after = mapped_column(DateTime(timezone=True), nullable=False)
+    locked_by: Mapped[str] = mapped_column(String(64), nullable=True)
+    locked_until = mapped_column(DateTime(timezone=True), nullable=True)
+    last_error: Mapped[str] = mapped_column(Text, nullable=True)
+    created_at = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+    finished_at = mapped_column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return "Task(id=%s, kind='%s', status='%s', attempts='%s')" % (
+            self.id,
+            self.kind,
+            self.status,
+            self.attempts,
+        )
+
+
+class Event(Base):
+    """
+    Запланированное событие: создание чата для пользователя, уведомление о дне рождения,
+    предупреждение об удалении и удаление чата. Срок событий вычисляется один раз,
+    а выполняются только наступившие события (по индексу на due_at), без перебора всех чатов и пользователей
+    """
+
+    __tablename__ = "events"
+    __table_args__ = (
+        Index("ix_events_tenant_id_status_due_at", "tenant_id", "status", "due_at"),
+        Index("ix_events_tg_id_kind_status", "tg_id", "kind", "status"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    tenant_id: Mapped[int] = mapped_column(
+        ForeignKey("tenants.id"), nullable=False, default=1, server_default="1"
+    )
+    kind: Mapped[str] = mapped_column(String(32), nullable=False)
+    tg_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    chat_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    due_at = mapped_column(DateTime(timezone=True), nullable=False)
+    dedup_key: Mapped[str] = mapped_column(String(128), nullable=False, unique=True)
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="pending")
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    locked_until = mapped_column(DateTime(timezone=True), nullable=True)
+    last_error: Mapped[str] = mapped_column(Text, nullable=True)
+    created_at = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+    finished_at = mapped_column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return "Event(id=%s, kind='%s', due_at='%s', status='%s')" % (
+            self.id,
+            self.kind,
+            self.due_at,
+            self.status,
+        )
+
+
+class RateBucket(Base):
+    """
+    Общее ведро токенов для вызовов API одного аккаунта и класса методов (см. ratelimit)
+    """
+
+    __tablename__ = "rate_buckets"
+    bucket: Mapped[str] = mapped_column(String(128), primary_key=True)
+    tokens: Mapped[float] = mapped_column(Float(precision=53), nullable=False)
+    # Время последнего пополнения в секундах unix
+    refilled_at: Mapped[float] = mapped_column(Float(precision=53), nullable=False)
+
+    def __repr__(self):
+        return "RateBucket(bucket='%s', tokens=%s)" % (self.bucket, self.tokens)
+
+
+class ChatStat(Base):
+    """
+    Количество участников чата за день
+    """
+
+    __tablename__ = "chat_stats"
+    party_id: Mapped[int] = mapped_column(
+        ForeignKey("chats.id", ondelete="CASCADE"), primary_key=True
+    )
+    day = mapped_column(Date, primary_key=True)
+    participants: Mapped[int] = mapped_column(Integer, nullable=False)
+    users_added: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    users_invited: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "ChatStat(party_id=%s, day='%s', participants='%s')" % (
+            self.party_id,
+            self.day,
+            self.participants,
+        )
+
+
+class ChatInvite(Base):
+    """
+    Очередь приглашений в чат. Пользователи приглашаются по убыванию priority;
+    очередь хранится в БД, поэтому прерванное дневным лимитом приглашение продолжается в следующем запуске
+    """
+
+    __tablename__ = "chat_invites"
+    __table_args__ = (
+        Index("ix_chat_invites_party_id_status_priority", "party_id", "status", "priority"),
+        Index("ix_chat_invites_attempted_at", "attempted_at"),
+    )
+    party_id: Mapped[int] = mapped_column(
+        ForeignKey("chats.id", ondelete="CASCADE"), primary_key=True
+    )
+    tg_id: Mapped[int] = mapped_column(
+        ForeignKey("users.tg_id", ondelete="CASCADE"), primary_key=True
+    )
+    priority: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # pending - ждет приглашения, added - добавлен, failed - не удалось добавить,
+    # skipped - не приглашался напрямую (недоступен или уже не активен)
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="pending")
+    error: Mapped[str] = mapped_column(String(64), nullable=True)
+    attempted_at = mapped_column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return "ChatInvite(party_id=%s, tg_id=%s, priority=%s, status='%s')" % (
+            self.party_id,
+            self.tg_id,
+            self.priority,
+            self.status,
+        )
+
+
+class Invitability(Base):
+    """
+    Можно ли добавить пользователя в чат напрямую. Запись о недоступности действует до expires_at,
+    после чего пользователя снова пробуют пригласить
+    """
+
+    __tablename__ = "invitability"
+    tg_id: Mapped[int] = mapped_column(
+        ForeignKey("users.tg_id", ondelete="CASCADE"), primary_key=True
+    )
+    reachable: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    reason: Mapped[str] = mapped_column(String(64), nullable=True)
+    checked_at = mapped_column(DateTime(timezone=True), nullable=False)
+    expires_at = mapped_column(DateTime(timezone=True), nullable=False)
+
+    def __repr__(self):
+        return "Invitability(tg_id=%s, reachable='%s', reason='%s', expires_at='%s')" % (
+            self.tg_id,
+            self.reachable,
+            self.reason,
+            self.expires_at,
+        )
+
+
+class ChatArchive(Base):
+    """
+    Архив истории чата, выгруженный перед удалением
+    """
+
+    __tablename__ = "chat_archives"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    party_id: Mapped[int] = mapped_column(ForeignKey("chats.id"), nullable=False)
+    path: Mapped[str] = mapped_column(String(255), nullable=False)
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="running")
+    messages: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    media_files: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    size_bytes: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    error: Mapped[str] = mapped_column(Text, nullable=True)
+    started_at = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+    finished_at = mapped_column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return "ChatArchive(id=%s, party_id='%s', status='%s', messages='%s')" % (
+            self.id,
+            self.party_id,
+            self.status,
+            self.messages,
+        )
+
+
+class PooledChannel(Base):
+    """
+    Очищенный канал, который можно переиспользовать для следующего именинника вместо создания нового
+    """
+
+    __tablename__ = "channel_pool"
+    channel_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    tenant_id: Mapped[int] = mapped_column(
+        ForeignKey("tenants.id"), nullable=False, default=1, server_default="1"
+    )
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="free")
+    released_at = mapped_column(DateTime(timezone=True), nullable=False)
+    taken_at = mapped_column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return "PooledChannel(channel_id=%s, status='%s', released_at='%s')" % (
+            self.channel_id,
+            self.status,
+            self.released_at,
+        )
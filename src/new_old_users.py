@@ -1,11 +1,24 @@
 import config
+import metrics
+from runs import record_run
 from utils import ChatTools, signin
 
-if __name__ == "__main__":
+
+def reconcile() -> None:
+    """
+    Сверяет участников основного чата с пользователями в БД
+    """
     dog_client = signin(config.BOT_API_ID, config.BOT_API_HASH)
 
-    with dog_client:
+    with dog_client, record_run("reconcile"):
+
+        try:
+            ct = ChatTools(dog_client, config.MAIN_CHAT_ID)
+            ct.find_db_users_not_in_chat()
+            ct.find_chat_users_not_in_db()
+        finally:
+            metrics.write_textfile("reconcile")
 
-        ct = ChatTools(dog_client, config.MAIN_CHAT_ID)
-        ct.find_db_users_not_in_chat()
-        ct.find_chat_users_not_in_db()
+
+if __name__ == "__main__":
+    reconcile()
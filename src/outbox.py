@@ -0,0 +1,107 @@
+import asyncio
+import contextvars
+import functools
+import time
+from typing import List
+
+from telethon.sync import TelegramClient
+
+import config
+import data
+from data import PendingMessage
+from logger import logging
+from runs import record_run
+from utils import signin
+
+
+class OutboxDispatcher:
+    """
+    Отправляет сообщения из outbox пачками: несколько сообщений одновременно,
+    но не чаще config.OUTBOX_RATE сообщений в секунду
+    """
+
+    def __init__(self, client: TelegramClient):
+        self.client = client
+        self.batch_size: int = config.OUTBOX_BATCH_SIZE
+        self.concurrency: int = config.OUTBOX_CONCURRENCY
+        self.min_interval: float = 1 / config.OUTBOX_RATE
+        self.lease_seconds: int = config.OUTBOX_LEASE_SECONDS
+        self.max_attempts: int = config.OUTBOX_MAX_ATTEMPTS
+        self.backoff_seconds: int = config.OUTBOX_BACKOFF_SECONDS
+
+        self._last_send: float = 0.0
+        self._rate_lock = None
+
+    def drain(self) -> int:
+        """
+        Отправляет все сообщения из очереди
+
+        :return: количество отправленных сообщений
+        """
+        sent = 0
+        while True:
+            batch = data.claim_outbox(self.batch_size, self.lease_seconds)
+            if not batch:
+                break
+            sent += self.client.loop.run_until_complete(self.send_batch(batch))
+
+        logging.info("Из outbox отправлено сообщений: %s", sent)
+        return sent
+
+    async def send_batch(self, batch: List[PendingMessage]) -> int:
+        self._rate_lock = asyncio.Lock()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(message: PendingMessage) -> bool:
+            async with semaphore:
+                await self.wait_rate_limit()
+                try:
+                    await self.client.send_message(message.chat_id, message.text)
+                except Exception as e:
+                    retry_at = await self.run_blocking(
+                        data.mark_outbox_failed,
+                        message.id,
+                        repr(e),
+                        self.max_attempts,
+                        self.backoff_seconds,
+                        min_delay=getattr(e, "seconds", 0) or 0,
+                    )
+                    logging.info(
+                        "Не удалось отправить сообщение %s, повтор в %s. Ошибка: %s", message, retry_at, e
+                    )
+                    return False
+
+                await self.run_blocking(data.mark_outbox_sent, message.id)
+                return True
+
+        results = await asyncio.gather(*(send(message) for message in batch))
+        return sum(results)
+
+    @staticmethod
+    async def run_blocking(func, *args, **kwargs):
+        # Запись в БД не должна останавливать цикл событий с остальными отправками пачки.
+        # Копия контекста нужна для настроек арендатора (config.override)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, contextvars.copy_context().run, functools.partial(func, *args, **kwargs)
+        )
+
+    async def wait_rate_limit(self) -> None:
+        async with self._rate_lock:
+            delay = self._last_send + self.min_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._last_send = time.monotonic()
+
+
+def drain() -> None:
+    """
+    Отправляет все готовые сообщения исходящей очереди
+    """
+    dog_client = signin(config.BOT_API_ID, config.BOT_API_HASH)
+
+    with dog_client, record_run("outbox"):
+        OutboxDispatcher(dog_client).drain()
+
+
+if __name__ == "__main__":
+    drain()
@@ -0,0 +1,32 @@
+import random
+import time
+from typing import Tuple
+
+import config
+import metrics
+import profiling
+
+
+def pause(seconds: float) -> None:
+    """
+    Намеренная пауза между вызовами API, чтобы телеграм не принял бота за спамера.
+    Все такие паузы должны идти через эту функцию, чтобы их можно было учитывать.
+    Длительность умножается на config.PACING_SCALE
+
+    :param seconds: длительность паузы в секундах
+    :return: None
+    """
+    seconds *= config.PACING_SCALE
+    with profiling.paused():
+        time.sleep(seconds)
+    metrics.observe_sleep(seconds)
+
+
+def pause_between(minmax: Tuple[float, float]) -> None:
+    """
+    Пауза случайной длительности, имитирующая пользователя
+
+    :param minmax: минимальная и максимальная длительность паузы в секундах
+    :return: None
+    """
+    pause(random.uniform(*minmax))
@@ -1,30 +1,53 @@
 import sys
-import time
-from typing import List, Type
+from typing import Iterable, List, Set, Type
 
 from telethon.errors.rpcerrorlist import ChannelPrivateError
 from telethon.sync import TelegramClient
-from telethon.tl.functions.channels import DeleteChannelRequest
+from telethon.tl.functions.channels import (
+    DeleteChannelRequest,
+    DeleteHistoryRequest,
+    EditTitleRequest,
+)
 from telethon.tl.types import PeerChannel
 
 import config
 import data
+import metrics
+import pacing
+import profiling
+from archive import ChatArchiver
+from digest import AdminDigest
 from logger import logging
 from models import Chat
+from outbox import OutboxDispatcher
+from repository import Repository
+from runs import record_run
 from utils import signin, FindBirthday
 
+# Название очищенного канала, ожидающего следующего именинника
+POOL_TITLE = "Свободный чат"
+
+BIRTHDAY_NOTICE_TEXT = "Не забудьте поздравить именинника с днем рождения, ведь он сегодня!"
+DELETION_NOTICE_TEXT = "Внимание! Чат будет удален через 24 часа!"
+
 
 class PartyCleaner:
     """
     Ищет чаты, которые необходимо удалить по прошествию дня рождения
     """
 
-    def __init__(self, client):
+    def __init__(self, client, digest: AdminDigest = None, repo: Repository = None):
         self.client: TelegramClient = client
-        self.active_chats = data.get_active_chats()
+        self.digest: AdminDigest = digest if digest is not None else AdminDigest()
+        self.repo: Repository = repo if repo is not None else Repository()
 
         logging.info("Инициализирован класс PartyCleaner")
 
+    @property
+    def active_chats(self) -> List[Chat]:
+        return self.repo.active_chats()
+
+    @metrics.stage("delete_channel")
     def delete_channel(self, channel_id) -> None:
         """
         Удаляет указанный канал в телеграме
@@ -35,9 +58,70 @@ class PartyCleaner:
         try:
             channel = self.client.get_entity(PeerChannel(channel_id))
             self.client(DeleteChannelRequest(channel_id))
-            logging.info(f"Удален канал в телеграме {channel.title}")
+            logging.info("Удален канал в телеграме %s", channel.title)
+        except ChannelPrivateError:
+            logging.info("Похоже, что канал в телеграме был удален вручную")
+
+    @metrics.stage("recycle_channel")
+    def recycle_channel(self, channel_id) -> bool:
+        """
+        Очищает канал для следующего именинника: удаляет участников (кроме бота) и историю сообщений
+        и меняет название. Ссылка-приглашение перевыпускается при повторном использовании канала
+
+        :param channel_id: id канала
+        :return: True, если канал очищен, False - если канала больше нет
+        """
+        try:
+            channel = self.client.get_entity(PeerChannel(channel_id))
         except ChannelPrivateError:
             logging.info("Похоже, что канал в телеграме был удален вручную")
+            return False
+
+        me = self.client.get_me()
+        for participant in self.client.iter_participants(channel):
+            if participant.id == me.id:
+                continue
+
+            try:
+                # Администратора нельзя исключить, пока у него есть права
+                if participant.id in config.ADMIN_IDS:
+                    self.client.edit_admin(channel, participant, is_admin=False)
+                self.client.kick_participant(channel, participant)
+            except Exception as e:
+                logging.info("Не удалось исключить %s из канала %s. Ошибка: %s", participant.id, channel_id, e)
+            finally:
+                pacing.pause_between((1, 3))
+
+        last_messages = self.client.get_messages(channel, limit=1)
+        if last_messages:
+            self.client(DeleteHistoryRequest(channel, max_id=last_messages[0].id, for_everyone=True))
+        self.client(EditTitleRequest(channel, POOL_TITLE))
+
+        logging.info("Канал %s (%s) очищен для повторного использования", channel.title, channel_id)
+        return True
+
+    def retire_channel(self, channel_id) -> None:
+        """
+        Убирает чат после дня рождения. При config.CHANNEL_RECYCLING канал очищается и возвращается в пул,
+        иначе (или если очистить не удалось) - удаляется. Чат деактивируется в БД
+
+        :param channel_id: id канала
+        :return: None
+        """
+        if config.CHANNEL_RECYCLING:
+            try:
+                recycled = self.recycle_channel(channel_id)
+            except Exception as e:
+                logging.info("Не удалось очистить канал %s, удаляем. Ошибка: %s", channel_id, e)
+                recycled = False
+
+            if recycled:
+                self.repo.deactivate_chat(channel_id)
+                data.release_channel(channel_id)
+                return
+
+        self.delete_channel(channel_id)
+        self.repo.deactivate_chat(channel_id)
 
     def send_channel_notification(self, channel_id) -> None:
         """
@@ -53,7 +137,7 @@ class PartyCleaner:
             "Ссылка для сбора более не активна! Просьба не отправлять по ней деньги.",
         )
         logging.info(
-            f"В чат канала {channel.title} отправлено предупреждение об удалении"
+            "В чат канала %s отправлено предупреждение об удалении", channel.title
         )
 
     def get_channels_to_notify_birthday(self) -> List[Type[Chat]]:
@@ -66,7 +150,7 @@ class PartyCleaner:
         chats_to_notify_birthday = []
         for chat in self.active_chats:
             if not chat.notification_birthday_sent:
-                bdayer = data.get_chat_bdayer(chat.chat_id)
+                bdayer = self.repo.chat_bdayer(chat.chat_id)
                 bday_today = FindBirthday.check_birthday_today(
                     bdayer.birth_month, bdayer.birth_day
                 )
@@ -86,7 +170,7 @@ class PartyCleaner:
         chats_to_notify_deletion = []
         for chat in self.active_chats:
             if not chat.notification_deletion_sent:
-                bdayer = data.get_chat_bdayer(chat.chat_id)
+                bdayer = self.repo.chat_bdayer(chat.chat_id)
                 in_birthday_interval = FindBirthday.check_birthday(
                     bdayer.birth_month, bdayer.birth_day, after=config.DAYS_AFTER - 1
                 )
@@ -104,7 +188,7 @@ class PartyCleaner:
 
         chats_to_clean = []
         for chat in self.active_chats:
-            bdayer = data.get_chat_bdayer(chat.chat_id)
+            bdayer = self.repo.chat_bdayer(chat.chat_id)
             in_birthday_interval = FindBirthday.check_birthday(
                 bdayer.birth_month, bdayer.birth_day
             )
@@ -113,6 +197,7 @@ class PartyCleaner:
                 chats_to_clean.append(chat)
         return chats_to_clean
 
+    @metrics.stage("notify_channels")
     def notify_channels(self) -> None:
 
         channels_to_notify_birthday = self.get_channels_to_notify_birthday()
@@ -124,24 +209,30 @@ class PartyCleaner:
         if len(channels_to_notify_deletion) == 0:
             logging.info("Нет чатов для уведомления о скором удалении")
 
+        # Уведомления ставятся в outbox в одной транзакции с отметкой в таблице chats,
+        # поэтому падение процесса не приводит к потере или дублированию сообщений
         for channel in channels_to_notify_birthday:
-
-            self.client.send_message(
+            self.repo.enqueue_chat_notification(
                 channel.chat_id,
-                message="Не забудьте поздравить именинника с днем рождения, ведь он сегодня!",
+                "birthday",
+                BIRTHDAY_NOTICE_TEXT,
+                birthday_sent=True,
             )
-            data.log_notified(channel.chat_id, birthday_sent=True)
-            logging.info(f"Чат уведомлен о дне рождения именинника {channel}")
+            logging.info("Уведомление о дне рождения именинника поставлено в очередь %s", channel)
 
         for channel in channels_to_notify_deletion:
-
-            self.client.send_message(
+            self.repo.enqueue_chat_notification(
                 channel.chat_id,
-                message="Внимание! Чат будет удален через 24 часа!",
+                "deletion",
+                DELETION_NOTICE_TEXT,
+                deletion_sent=True,
             )
-            data.log_notified(channel.chat_id, deletion_sent=True)
-            logging.info(f"Чат уведомлен о скором удалении {channel}")
+            logging.info("Уведомление о скором удалении поставлено в очередь %s", channel)
 
+        OutboxDispatcher(self.client).drain()
+
+    @profiling.profiled("clean_party")
+    @metrics.stage("clean_party")
     def clean_party(self) -> None:
         """
         Вызывает все методы для уборки после ДР
@@ -152,22 +243,58 @@ class PartyCleaner:
             logging.info("Нет чатов для очистки")
             return
 
+        self.clean_chats(channels_to_clean)
+
+    def clean_chats(self, channels_to_clean: Iterable[Chat]) -> Set[int]:
+        """
+        Архивирует (при config.ARCHIVE_ENABLED) и удаляет или возвращает в пул указанные чаты
+
+        :param channels_to_clean: чаты
+        :return: id убранных чатов
+        """
+        channels_to_clean = list(channels_to_clean)
+
+        # Перед удалением все чаты выгружаются одновременно. Чат без архива не удаляется,
+        # выгрузка повторится при следующем запуске
+        if config.ARCHIVE_ENABLED:
+            archived = ChatArchiver(self.client).archive_all(
+                channel.chat_id for channel in channels_to_clean
+            )
+            for channel in channels_to_clean:
+                if channel.chat_id not in archived:
+                    self.digest.failure(
+                        f"Не удалось сохранить архив чата {channel.chat_title or channel.chat_id}, удаление отложено"
+                    )
+            channels_to_clean = [
+                channel for channel in channels_to_clean if channel.chat_id in archived
+            ]
+
         for channel in channels_to_clean:
 
-            self.delete_channel(channel.chat_id)
-            data.deactivate_chat(channel.chat_id)
+            self.retire_channel(channel.chat_id)
+            self.digest.chat_deleted(channel.chat_title or str(channel.chat_id))
 
-            logging.info(f"Деактивирован канал в БД {channel.chat_id}")
-            time.sleep(10)
-        return
+            logging.info("Деактивирован канал в БД %s", channel.chat_id)
+            pacing.pause(10)
+        return {channel.chat_id for channel in channels_to_clean}
 
 
-if __name__ == "__main__":
+def clean_parties() -> None:
+    """
+    Рассылает уведомления в активные чаты и удаляет устаревшие
+    """
     dog_client = signin(config.BOT_API_ID, config.BOT_API_HASH)
 
-    with dog_client:
+    with dog_client, record_run("partycleaner"):
         pc = PartyCleaner(dog_client)
-        pc.notify_channels()
-        pc.clean_party()
+        try:
+            pc.notify_channels()
+            pc.clean_party()
+        finally:
+            pc.digest.send(dog_client)
+            metrics.write_textfile("partycleaner")
 
+
+if __name__ == "__main__":
+    clean_parties()
     sys.exit(0)
@@ -1,51 +1,136 @@
-import random
 import sys
 import time
-from typing import List, Tuple
+from datetime import datetime
+from typing import Collection, Dict, List, Optional, Set, Tuple
 
+from telethon.errors.rpcerrorlist import (
+    UserChannelsTooMuchError,
+    UserNotMutualContactError,
+    UserPrivacyRestrictedError,
+)
 from telethon.sync import TelegramClient
 from telethon.tl import types
 from telethon.tl.functions.channels import (
     CreateChannelRequest,
     InviteToChannelRequest,
     EditPhotoRequest,
+    EditTitleRequest,
 )
 from telethon.tl.functions.messages import ExportChatInviteRequest
+from telethon.tl.types import PeerChannel
 
 import config
 import data
+import metrics
+import pacing
+import profiling
+from digest import AdminDigest
 from logger import logging
 from models import User
+from repository import Repository
+from runs import record_run
+from stages import Stage, StageGraph
 from utils import signin, FindBirthday
 
+# Ошибки, после которых пользователя бесполезно приглашать снова до истечения config.INVITABILITY_TTL_DAYS
+UNREACHABLE_ERRORS = (
+    UserPrivacyRestrictedError,
+    UserNotMutualContactError,
+    UserChannelsTooMuchError,
+)
+
+# Вес сигналов в приоритете приглашения: общий тег с именинником (та же команда или отдел),
+# приоритетный тег из config.INVITE_PRIORITY_TAGS, участие в прошлых чатах (не больше MAX_PARTICIPATION_SCORE)
+SHARED_TAG_WEIGHT = 100
+PRIORITY_TAG_WEIGHT = 10
+MAX_PARTICIPATION_SCORE = 5
+
+# Сколько секунд после создания канала ждать перед приглашением пользователей
+CHANNEL_SETTLE_SECONDS = 10
+
+
+def invite_priority(
+    user: User, bdayer_tags: Collection[str], priority_tags: Collection[str], participated: int
+) -> int:
+    """
+    Приоритет приглашения пользователя в чат: чем больше, тем раньше
+
+    :param user: пользователь
+    :param bdayer_tags: теги именинника
+    :param priority_tags: приоритетные теги
+    :param participated: в сколько прошлых чатов пользователь был добавлен
+    :return: приоритет
+    """
+    tags = set(user.tags or [])
+    return (
+        SHARED_TAG_WEIGHT * len(tags & set(bdayer_tags))
+        + PRIORITY_TAG_WEIGHT * bool(tags & set(priority_tags))
+        + min(participated, MAX_PARTICIPATION_SCORE)
+    )
+
+
+def remaining_invite_budget() -> Optional[int]:
+    """
+    Сколько приглашений еще можно отправить сегодня (config.INVITE_DAILY_BUDGET)
+
+    :return: количество приглашений или None, если лимита нет
+    """
+    if not config.INVITE_DAILY_BUDGET:
+        return None
+
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    return max(0, config.INVITE_DAILY_BUDGET - data.count_invites_attempted_since(today))
+
 
 class PartyMaker:
     """
     Отвечает за создание чата для именинника, добавление и приглашение участников
     """
 
-    def __init__(self, client: TelegramClient, main_chat_id: int, bdayer: User):
+    def __init__(
+        self,
+        client: TelegramClient,
+        main_chat_id: int,
+        bdayer: User,
+        digest: AdminDigest = None,
+        warm_up: bool = True,
+        repo: Repository = None,
+    ):
 
         self.client: TelegramClient = client
-        self.chat_users: List[User] = data.get_active_users()
+        self.digest: AdminDigest = digest if digest is not None else AdminDigest()
+        self.repo: Repository = repo if repo is not None else Repository()
+        self.chat_users: List[User] = self.repo.active_users()
         self.bdayer: User = bdayer
         self.bday_str: str = self.convert_birthday(bdayer.birth_day, bdayer.birth_month)
 
         self.chat = None
+        self.chat_title: str = ""
         self.channel = None
         self.invite_link: str = ""
+        # Канал взят из пула (config.CHANNEL_RECYCLING), а не создан заново
+        self.recycled: bool = False
+        self.created_at: Optional[float] = None
+
+        # Подготовленные заранее (см. make_party) следующие приглашенные и текст приветствия
+        self.invitees: Optional[List[User]] = None
+        self.intro_text: Optional[str] = None
 
         self.successfully_added: List[User] = []
         self.successfully_invited: List[User] = []
+        # Счетчики из БД для чата, созданного в прошлых запусках (см. attach_channel)
+        self.added_before: int = 0
+        self.invited_before: int = 0
         self.to_sleep: int = (
             5  # Обязательно нужно спать между вызовами API, иначе телеграм может забанить аккаунт
         )
         self.sleep_minmax: Tuple[int, int] = (4, 10)
 
-        # Обязательные вызовы API
-        client.get_me()
-        client.get_dialogs()
-        client.get_participants(main_chat_id, aggressive=True)
+        # Обязательные вызовы API. Воркеру очереди задач достаточно сделать их один раз за процесс
+        if warm_up:
+            client.get_me()
+            client.get_dialogs()
+            client.get_participants(main_chat_id, aggressive=True)
 
         logging.info("Инициализирован класс PartyMaker")
 
@@ -69,35 +154,39 @@ class PartyMaker:
 
         return f"{day}.{month}"
 
+    @metrics.stage("create_channel")
     def create_channel_for_bdayer(self, log_to_db=True) -> int:
         """
         Создает чат канального типа для именинника и вызывает функцию log_chat_creation, которая записывает данные в БД.
         Параметр megagroup установлен на True, чтобы новые пользователи могли видеть историю сообщений.
+        При config.CHANNEL_RECYCLING сначала используется очищенный канал из пула
 
         :return: id созданного чата
         """
         try:
 
-            chat_title = (
+            self.chat_title = chat_title = (
                 f"ДР {self.bdayer.short_name} {self.bdayer.last_name} {self.bday_str}"
             )
-            new_channel = self.client(
-                CreateChannelRequest(title=chat_title, about="", megagroup=True)
-            )
-
-            self.channel = new_channel.chats[0]
-            self.invite_link = self.client(
-                ExportChatInviteRequest(self.channel.id)
-            ).link
+            self.channel = self.take_pooled_channel(chat_title) if config.CHANNEL_RECYCLING else None
+            if self.channel is None:
+                new_channel = self.client(
+                    CreateChannelRequest(title=chat_title, about="", megagroup=True)
+                )
+                self.channel = new_channel.chats[0]
+                self.invite_link = self.client(
+                    ExportChatInviteRequest(self.channel.id)
+                ).link
+            self.created_at = time.monotonic()
 
             logging.info(
-                f"Создан канал {chat_title}. ID: {self.channel.id}. Ссылка: {self.invite_link}"
+                "Создан канал %s. ID: %s. Ссылка: %s", chat_title, self.channel.id, self.invite_link
             )
 
             # Добавляем запись о создании чата в БД
             if log_to_db:
 
-                data.chat_create(
+                self.repo.chat_create(
                     chat_id=self.channel.id,
                     invite_link=self.invite_link,
                     bdayer_id=self.bdayer.tg_id,
@@ -105,8 +194,8 @@ class PartyMaker:
                 )
                 logging.info("Данные со создании чата записаны в БД")
 
-                money_link = data.get_account_link(self.channel.id)
-                data.chat_update(chat_id=self.channel.id, account_link=money_link)
+                money_link = self.repo.get_account_link(self.channel.id)
+                self.repo.chat_update(chat_id=self.channel.id, account_link=money_link)
                 logging.info("Данные дополнены ссылкой на сбор")
 
             return self.channel
@@ -114,10 +203,55 @@ class PartyMaker:
         except Exception as e:
             exit_msg = f"Не удалось создать чат. Ошибка: {e}"
             logging.info(exit_msg)
+            self.digest.failure(exit_msg)
             sys.exit(exit_msg)
         finally:
-            time.sleep(self.to_sleep)
+            pacing.pause(self.to_sleep)
+
+    def take_pooled_channel(self, chat_title: str):
+        """
+        Берет очищенный канал из пула, переименовывает его и выпускает новую ссылку-приглашение
+        (старая ссылка отзывается). Канал, который не удалось подготовить, убирается из пула
+
+        :param chat_title: новое название канала
+        :return: канал или None, если в пуле нет пригодных каналов
+        """
+        while True:
+            channel_id = data.take_pooled_channel()
+            if channel_id is None:
+                return None
+
+            try:
+                channel = self.client.get_entity(PeerChannel(channel_id))
+                self.client(EditTitleRequest(channel, chat_title))
+                self.invite_link = self.client(
+                    ExportChatInviteRequest(channel, legacy_revoke_permanent=True)
+                ).link
+            except Exception as e:
+                logging.info("Канал %s из пула не подходит, убираем его. Ошибка: %s", channel_id, e)
+                data.drop_pooled_channel(channel_id)
+                continue
+
+            self.recycled = True
+            logging.info("Канал %s взят из пула", channel_id)
+            return channel
+
+    def attach_channel(self, chat_id: int) -> None:
+        """
+        Продолжает работу с чатом, созданным ранее (например, в другой задаче очереди)
+
+        :param chat_id: id чата
+        :return: None
+        """
 
+        chat = self.repo.get_chat(chat_id)
+        self.channel = self.client.get_entity(PeerChannel(chat_id))
+        self.chat_title = chat.chat_title
+        self.invite_link = chat.invite_link
+        self.added_before = chat.users_added
+        self.invited_before = chat.users_invited
+
+    @metrics.stage("edit_photo")
     def edit_channel_photo(self) -> None:
         """
         Меняет аватарку чата
@@ -130,6 +264,39 @@ class PartyMaker:
             EditPhotoRequest(self.channel.id, types.InputChatUploadedPhoto(file))
         )
 
+    def render_intro(self, fake_link=False) -> str:
+        """
+        Текст приветственного сообщения. Закрепляет за чатом счет для сбора, если его еще нет
+
+        :return: текст сообщения
+        """
+        if fake_link:
+            money_link = "test"
+        else:
+            money_link = self.repo.get_account_link(self.channel.id)
+
+        return (
+            f"Всем привет! {self.bdayer.short_name} {self.bdayer.last_name} "
+            f"отмечает день рождения {self.bday_str}!\n\n"
+            f"Собираем денюжку по ссылке: {money_link}\n\n"
+            "Если у вас проблемы с переводом по ссылке,"
+            "можно перевести по номеру карты:\n\n"
+            f"{config.CARD_NUMBER}\n\n"
+            "(Обязательно указывайте именинника в комментариях к платежу)"
+        )
+
+    def prepare_intro(self) -> None:
+        """
+        Готовит текст приветствия заранее. При ошибке текст будет подготовлен при отправке
+
+        :return: None
+        """
+        try:
+            self.intro_text = self.render_intro()
+        except Exception as e:
+            logging.info("Не удалось подготовить приветствие. Ошибка: %s", e)
+
+    @metrics.stage("send_intro")
     def send_introduction_to_channel(self, fake_link=False) -> None:
         """
         Отправляет приветственное сообщение в чат
@@ -137,20 +304,7 @@ class PartyMaker:
         :return: None
         """
         try:
-            if fake_link:
-                money_link = "test"
-            else:
-                money_link = data.get_account_link(self.channel.id)
-
-            intro_text = (
-                f"Всем привет! {self.bdayer.short_name} {self.bdayer.last_name} "
-                f"отмечает день рождения {self.bday_str}!\n\n"
-                f"Собираем денюжку по ссылке: {money_link}\n\n"
-                "Если у вас проблемы с переводом по ссылке,"
-                "можно перевести по номеру карты:\n\n"
-                f"{config.CARD_NUMBER}\n\n"
-                "(Обязательно указывайте именинника в комментариях к платежу)"
-            )
+            intro_text = self.intro_text or self.render_intro(fake_link)
 
             intro_msg = self.client.send_message(self.channel.id, intro_text)
 
@@ -159,9 +313,9 @@ class PartyMaker:
                 self.client.pin_message(self.channel.id, intro_msg, notify=True)
 
             except Exception as e:
-                logging.info(f"Не удалось закрепить сообщение! Ошибка: {e}")
+                logging.info("Не удалось закрепить сообщение! Ошибка: %s", e)
 
-            time.sleep(random.uniform(*self.sleep_minmax))
+            pacing.pause_between(self.sleep_minmax)
             self.client.send_message(
                 self.channel.id,
                 f"Приглашать пользователей в чат "
@@ -169,11 +323,11 @@ class PartyMaker:
             )
             logging.info("В чат отправлено введение")
         except Exception as e:
-            logging.info(f"Не удалось отправить сообщение в чат! Ошибка: {e}")
+            logging.info("Не удалось отправить сообщение в чат! Ошибка: %s", e)
 
         finally:
             # Имитируем пользователя
-            time.sleep(random.uniform(*self.sleep_minmax))
+            pacing.pause_between(self.sleep_minmax)
 
     def send_unable_message(self, user: User) -> None:
         """
@@ -197,16 +351,16 @@ class PartyMaker:
             self.client.send_message(user.tg_id, unable_message)
             self.successfully_invited.append(user)
             logging.info(
-                f"Пользователю {user.short_name} {user.last_name} отправлено приглашение в чат"
+                "Пользователю %s %s отправлено приглашение в чат", user.short_name, user.last_name
             )
 
         except Exception as e:
             logging.info(
-                f"Не удалось отправить приглашение пользователю. {user} Ошибка: {e}"
+                "Не удалось отправить приглашение пользователю. %s Ошибка: %s", user, e
             )
 
         finally:
-            time.sleep(self.to_sleep)
+            pacing.pause(self.to_sleep)
 
     def make_invite_list(self) -> List[User]:
         """
@@ -225,10 +379,77 @@ class PartyMaker:
                         invite_list.append(user)
 
         logging.info(
-            f"Список сформирован. Количество приглашенных (исколючая админов): {len(invite_list)}"
+            "Список сформирован. Количество приглашенных (исколючая админов): %s", len(invite_list)
         )
         return invite_list
 
+    def score_invitees(self, invite_list: List[User]) -> Dict[int, int]:
+        """
+        Приоритеты приглашения для пользователей (см. invite_priority)
+
+        :param invite_list: пользователи
+        :return: приоритет по tg_id
+        """
+        bdayer_tags = self.bdayer.tags or []
+        priority_tags = [tag.strip() for tag in config.INVITE_PRIORITY_TAGS.split(",") if tag.strip()]
+        participation = data.get_past_participation()
+        return {
+            user.tg_id: invite_priority(
+                user, bdayer_tags, priority_tags, participation.get(user.tg_id, 0)
+            )
+            for user in invite_list
+        }
+
+    def next_invitees(self, unreachable_ids: Set[int], limit: Optional[int] = None) -> List[User]:
+        """
+        Пополняет очередь приглашений чата пользователями из make_invite_list и берет из нее следующих
+        по приоритету. Недоступные пользователи (их не приглашают напрямую) берутся вне лимитов
+
+        :param unreachable_ids: tg_id пользователей, которых сейчас нельзя добавить в чат
+        :param limit: сколько пользователей пригласить, по умолчанию - сколько позволяет дневной лимит
+        :return: пользователи по убыванию приоритета
+        """
+        candidates = {user.tg_id: user for user in self.make_invite_list()}
+        data.queue_chat_invites(self.channel.id, self.score_invitees(list(candidates.values())))
+
+        budget = remaining_invite_budget()
+        if limit is not None:
+            budget = limit if budget is None else min(budget, limit)
+
+        invitees, gone = [], {}
+        for tg_id in data.get_pending_invites(self.channel.id):
+            user = candidates.get(tg_id)
+            if user is None:
+                # Пользователь стал неактивным, пока ждал в очереди
+                gone[tg_id] = ("skipped", "inactive")
+            elif tg_id in unreachable_ids:
+                invitees.append(user)
+            elif budget is None or budget > 0:
+                invitees.append(user)
+                if budget is not None:
+                    budget -= 1
+
+        data.save_invite_results(self.channel.id, gone)
+        return invitees
+
+    def prepare_invites(self) -> None:
+        """
+        Заранее выбирает из очереди приглашений тех, кого пригласит invite_users_to_channel
+
+        :return: None
+        """
+        self.invitees = self.next_invitees(data.get_unreachable_user_ids())
+
+    def wait_for_channel(self) -> None:
+        """
+        Ждет, пока с создания канала пройдет CHANNEL_SETTLE_SECONDS. Время предыдущих этапов засчитывается
+
+        :return: None
+        """
+        if self.created_at is not None:
+            pacing.pause(max(0.0, CHANNEL_SETTLE_SECONDS - (time.monotonic() - self.created_at)))
+
+    @metrics.stage("invite_admins")
     def invite_admins(self) -> None:
         """
         Добавляет пользователей в чат, если позволяют их настройки приватности.
@@ -241,14 +462,15 @@ class PartyMaker:
             if admin_id != self.bdayer.tg_id:
                 try:
                     self.client(InviteToChannelRequest(self.channel.id, [admin_id]))
-                    logging.info(f"Успешно добавлен админ. tgid: {admin_id}")
+                    logging.info("Успешно добавлен админ. tgid: %s", admin_id)
 
                 except Exception as e:
-                    logging.info(f"{e}. Не удалось пригласить админа. tgid: {admin_id}")
+                    logging.info("%s. Не удалось пригласить админа. tgid: %s", e, admin_id)
 
                 finally:
-                    time.sleep(self.to_sleep)
+                    pacing.pause(self.to_sleep)
 
+    @metrics.stage("grant_admin_rights")
     def grant_channel_admin_rights(self) -> None:
         """
         Выдает права администратора чата
@@ -264,73 +486,168 @@ class PartyMaker:
                     anonymous=False,
                     title="друг собаки",
                 )
-                logging.info(f"Пользователю {admin_id} выданы права администратора")
+                logging.info("Пользователю %s выданы права администратора", admin_id)
 
-    def invite_users_to_channel(self, send_invites=False) -> None:
+    @metrics.stage("invite_users")
+    def invite_users_to_channel(
+        self, send_invites=False, invite_list: Optional[List[User]] = None, limit: Optional[int] = None
+    ) -> List[User]:
         """
         Добавляет пользователей в чат, если позволяют их настройки приватности.
-        Если добавить пользователя не удалось, ему отправляется ссылка с приглашением в ЛС
+        Если добавить пользователя не удалось, ему отправляется ссылка с приглашением в ЛС.
+        Пользователей, которых недавно не удалось добавить из-за настроек приватности, сразу приглашают ссылкой.
+        Без invite_list пользователи берутся из очереди приглашений чата по приоритету и в пределах
+        дневного лимита config.INVITE_DAILY_BUDGET, остальные остаются в очереди до следующего запуска
 
         :type send_invites: Флаг, указывающий на то, отправляются ли пользователям приглашения
-        :return: None
+        :param invite_list: кого приглашать, по умолчанию - следующих из очереди приглашений
+        :param limit: сколько пользователей из очереди пригласить за вызов
+        :return: пользователи, обработанные в этом вызове
         """
 
-        invite_list = self.make_invite_list()
-        for num, user in enumerate(invite_list, start=1):
+        # Тех, кого заведомо не добавить, не приглашаем: это лишний вызов API, пауза и риск FloodWait
+        unreachable_ids = data.get_unreachable_user_ids()
 
-            try:
+        queued = invite_list is None
+        if queued:
+            if self.invitees is not None and limit is None:
+                invite_list, self.invitees = self.invitees, None
+            else:
+                invite_list = self.next_invitees(unreachable_ids, limit)
 
-                self.client(InviteToChannelRequest(self.channel.id, [user.tg_id]))
-                self.successfully_added.append(user)
-                logging.info(
-                    f"Успешно добавлен {user.short_name} {user.tg_id} {num}/{len(invite_list)}"
-                )
+        unreachable = [user for user in invite_list if user.tg_id in unreachable_ids]
+        invite_list = [user for user in invite_list if user.tg_id not in unreachable_ids]
+        if unreachable:
+            logging.info(
+                "Не приглашаем напрямую %s пользователей: их нельзя добавить в чат", len(unreachable)
+            )
 
-            # TODO: Обработать FloodWaitError и UserChannelsTooMuchError
-            except Exception as e:
-                logging.info(
-                    f"{e}. Не удалось пригласить пользователя {user.short_name}. tgid: {user.tg_id}"
-                )
+        outcomes: Dict[int, Optional[str]] = {}
+        results: Dict[int, Tuple[str, Optional[str]]] = {
+            user.tg_id: ("skipped", "unreachable") for user in unreachable
+        }
+        try:
+            for num, user in enumerate(invite_list, start=1):
 
-                if send_invites:
-                    self.send_unable_message(user)
+                try:
 
-            finally:
-                data.chat_update(
-                    self.channel.id,
-                    len(self.successfully_added),
-                    len(self.successfully_invited),
-                )
-                time.sleep(random.uniform(*self.sleep_minmax))
+                    self.client(InviteToChannelRequest(self.channel.id, [user.tg_id]))
+                    self.successfully_added.append(user)
+                    outcomes[user.tg_id] = None
+                    results[user.tg_id] = ("added", None)
+                    logging.info(
+                        "Успешно добавлен %s %s %s/%s", user.short_name, user.tg_id, num, len(invite_list)
+                    )
+
+                # Короткие FloodWait пережидает Telethon (flood_sleep_threshold), длинные попадают сюда
+                except Exception as e:
+                    if isinstance(e, UNREACHABLE_ERRORS):
+                        outcomes[user.tg_id] = type(e).__name__
+                    results[user.tg_id] = ("failed", type(e).__name__)
+                    logging.info(
+                        "%s. Не удалось пригласить пользователя %s. tgid: %s", e, user.short_name, user.tg_id
+                    )
+
+                    if send_invites:
+                        self.send_unable_message(user)
+
+                finally:
+                    self.repo.chat_update(
+                        self.channel.id,
+                        self.added_before + len(self.successfully_added),
+                        self.invited_before + len(self.successfully_invited),
+                    )
+                    pacing.pause_between(self.sleep_minmax)
+
+        finally:
+            data.save_invitability(outcomes, config.INVITABILITY_TTL_DAYS)
+            if queued:
+                data.save_invite_results(self.channel.id, results)
+
+        if send_invites and unreachable:
+            for user in unreachable:
+                self.send_unable_message(user)
+            self.repo.chat_update(
+                self.channel.id, invited=self.invited_before + len(self.successfully_invited)
+            )
+
+        return unreachable + invite_list
 
+    @profiling.profiled("make_party")
+    @metrics.stage("make_party")
     def make_party(self) -> None:
-        self.create_channel_for_bdayer()
-        self.edit_channel_photo()
-        self.invite_admins()
-        self.grant_channel_admin_rights()
+        """
+        Создает чат для именинника. Этапы описаны графом зависимостей: подготовка приглашений и приветствия
+        (только БД) идет параллельно с вызовами API, а вызовы API выполняются по одному с прежними паузами.
+        Пауза перед приглашениями отсчитывается от создания канала, поэтому обычно уже прошла
 
-        time.sleep(10)
-        self.invite_users_to_channel()
-        self.send_introduction_to_channel()
+        :return: None
+        """
+        StageGraph(
+            "make_party",
+            [
+                Stage("create_channel", self.create_channel_for_bdayer, done=lambda: self.channel is not None),
+                Stage("edit_photo", self.edit_channel_photo, after=("create_channel",), done=lambda: self.recycled),
+                Stage("invite_admins", self.invite_admins, after=("create_channel",)),
+                Stage("grant_admin_rights", self.grant_channel_admin_rights, after=("invite_admins",)),
+                Stage(
+                    "prepare_invites",
+                    self.prepare_invites,
+                    after=("create_channel",),
+                    done=lambda: self.invitees is not None,
+                    local=True,
+                ),
+                Stage(
+                    "prepare_intro",
+                    self.prepare_intro,
+                    after=("create_channel",),
+                    done=lambda: self.intro_text is not None,
+                    local=True,
+                ),
+                Stage("wait_for_channel", self.wait_for_channel, after=("create_channel",)),
+                Stage(
+                    "invite_users",
+                    self.invite_users_to_channel,
+                    after=("grant_admin_rights", "prepare_invites", "wait_for_channel"),
+                ),
+                Stage("send_intro", self.send_introduction_to_channel, after=("invite_users", "prepare_intro")),
+            ],
+        ).run()
+
+        self.digest.chat_created(
+            self.chat_title,
+            f"{self.invite_link} (добавлено: {len(self.successfully_added)}, "
+            f"приглашено ссылкой: {len(self.successfully_invited)})",
+        )
 
 
-if __name__ == "__main__":
+def make_today_party() -> None:
+    """
+    Создает чат первому имениннику из окна дней рождения
+    """
     dog_client = signin(config.BOT_API_ID, config.BOT_API_HASH)
 
-    with dog_client:
+    with dog_client, record_run("partymaker"):
         chat_id = config.MAIN_CHAT_ID
-        users = data.get_active_users()
-
-        fb = FindBirthday(users)
+        repo = Repository()
+        fb = FindBirthday(repo.birthday_window_users(), repo)
         birthday_users = fb.birthday_users
 
         if len(birthday_users) != 0:
             bday_user: User = birthday_users[0]
-            logging.info(f"Именинник: {bday_user}")
+            logging.info("Именинник: %s", bday_user)
 
-            pm = PartyMaker(dog_client, chat_id, bday_user)
-            pm.make_party()
+            digest = AdminDigest()
+            try:
+                pm = PartyMaker(dog_client, chat_id, bday_user, digest, repo=repo)
+                pm.make_party()
+            finally:
+                digest.send(dog_client)
+                metrics.write_textfile("partymaker")
         else:
             logging.info("Нет именинников!")
 
+
+if __name__ == "__main__":
+    make_today_party()
     sys.exit(0)
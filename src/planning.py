@@ -0,0 +1,118 @@
+from datetime import datetime
+from typing import Iterable, List, Tuple
+
+import config
+import data
+from digest import AdminDigest
+from logger import logging
+from partycleaner import PartyCleaner
+from partymaker import PartyMaker
+from runs import record_run
+from utils import FindBirthday, signin
+
+
+def plan_cleanup() -> List[int]:
+    """
+    Возвращает id чатов, которые пора удалить. Телеграм не нужен
+
+    :return: список id чатов
+    """
+    chats = PartyCleaner(client=None).get_channels_to_clean()
+    return [chat.chat_id for chat in chats]
+
+
+def creations_left() -> int:
+    """
+    Сколько чатов еще можно создать сегодня.
+    В сутки создается не больше одного нового канала. Каналы из пула (config.CHANNEL_RECYCLING)
+    под это ограничение не попадают
+
+    :return: количество чатов
+    """
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    limit = 0 if data.count_chats_created_since(today) > 0 else 1
+    if config.CHANNEL_RECYCLING:
+        limit += data.count_free_channels()
+    return limit
+
+
+def plan_creations() -> List[int]:
+    """
+    Возвращает tg_id именинников, для которых нужно создать чат (не больше creations_left)
+
+    :return: список tg_id именинников
+    """
+    limit = creations_left()
+    if limit == 0:
+        logging.info("Сегодня чат уже создавался, пропускаем")
+        return []
+
+    birthday_users = FindBirthday(data.get_birthday_window_users()).birthday_users
+    if len(birthday_users) == 0:
+        logging.info("Нет именинников!")
+        return []
+
+    return [user.tg_id for user in birthday_users[:limit]]
+
+
+def notify_chats() -> None:
+    """
+    Отправляет в чаты уведомления о дне рождения и о скором удалении
+
+    :return: None
+    """
+    with signin(config.BOT_API_ID, config.BOT_API_HASH) as client, record_run("notify_chats"):
+        PartyCleaner(client).notify_channels()
+
+
+def clean_chat(chat_id: int) -> List[Tuple[str, str]]:
+    """
+    Удаляет (или возвращает в пул, см. config.CHANNEL_RECYCLING) один чат в телеграме и деактивирует его в БД
+
+    :param chat_id: id чата
+    :return: события для сводки администраторам в виде пар (раздел, текст)
+    """
+    chat_titles = {chat.chat_id: chat.chat_title for chat in data.get_active_chats()}
+
+    with signin(config.BOT_API_ID, config.BOT_API_HASH) as client, record_run("clean_chat"):
+        PartyCleaner(client).retire_channel(chat_id)
+
+    logging.info("Деактивирован канал в БД %s", chat_id)
+    return [("deleted", chat_titles.get(chat_id) or str(chat_id))]
+
+
+def create_party(bdayer_id: int) -> List[Tuple[str, str]]:
+    """
+    Создает чат для именинника. Если прошлая попытка задачи успела создать чат,
+    продолжает его оставшиеся этапы (как taskqueue.create_channel), а не создает второй канал со вторым счетом
+
+    :param bdayer_id: tg_id именинника
+    :return: события для сводки администраторам в виде пар (раздел, текст)
+    """
+    bdayer = data.get_user(bdayer_id)
+    existing = data.get_active_chats_for_user(bdayer_id)
+    digest = AdminDigest()
+
+    with signin(config.BOT_API_ID, config.BOT_API_HASH) as client, record_run("create_party"):
+        pm = PartyMaker(client, config.MAIN_CHAT_ID, bdayer, digest)
+        if existing:
+            logging.info("Чат для именинника %s уже создан: %s", bdayer_id, existing[0].chat_id)
+            pm.attach_channel(existing[0].chat_id)
+        pm.make_party()
+
+    return [(section, line) for section, lines in digest.events.items() for line in lines]
+
+
+def send_report(events: Iterable[Tuple[str, str]]) -> None:
+    """
+    Отправляет администраторам одну сводку по событиям всех задач
+
+    :param events: пары (раздел, текст), собранные задачами
+    :return: None
+    """
+    digest = AdminDigest()
+    for section, line in events:
+        digest.add(section, line)
+
+    with signin(config.BOT_API_ID, config.BOT_API_HASH) as client:
+        digest.send(client)
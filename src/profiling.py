@@ -0,0 +1,103 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+
+import config
+from logger import logging
+
+# Активный профилировщик потока. Профилируется только самый внешний вызов в потоке,
+# вложенные profiled-функции попадают в его профиль. Потоки (арендаторы, задачи Airflow)
+# профилируются независимо и не останавливают чужой профилировщик
+_local = threading.local()
+
+
+def active_profiler() -> Optional[cProfile.Profile]:
+    return getattr(_local, "profiler", None)
+
+
+def profiled(name: str) -> Callable:
+    """
+    Декоратор: при включенном config.PROFILE профилирует функцию через cProfile
+    и сохраняет профиль в config.PROFILE_DIR/<name>-<время>.prof вместе с текстовой сводкой
+
+    :param name: имя профиля
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not config.PROFILE or active_profiler() is not None:
+                return func(*args, **kwargs)
+
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as e:
+                # С Python 3.12 профилировщик в процессе может быть только один:
+                # если другой поток уже профилируется, этот вызов выполняется без профиля
+                logging.info("Профиль %s пропущен, уже профилируется другой поток: %s", name, e)
+                return func(*args, **kwargs)
+
+            _local.profiler = profiler
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.disable()
+                _local.profiler = None
+                dump(profiler, name)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def paused() -> Iterator[None]:
+    """
+    Приостанавливает профилирование на время намеренных пауз,
+    если включен config.PROFILE_EXCLUDE_SLEEP
+    """
+    profiler = active_profiler()
+    if profiler is None or not config.PROFILE_EXCLUDE_SLEEP:
+        yield
+        return
+
+    profiler.disable()
+    try:
+        yield
+    finally:
+        try:
+            profiler.enable()
+        except ValueError:
+            # Пока профиль стоял на паузе, профилирование начал другой поток (Python 3.12+)
+            logging.info("Профилирование продолжить не удалось, профиль будет неполным")
+
+
+def dump(profiler: cProfile.Profile, name: str) -> str:
+    """
+    Сохраняет профиль и сводку по функциям с наибольшим собственным временем
+
+    :param profiler: остановленный профилировщик
+    :param name: имя профиля
+    :return: путь к файлу .prof
+    """
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    path = os.path.join(
+        config.PROFILE_DIR, f"{name}-{datetime.now():%Y%m%d-%H%M%S}.prof"
+    )
+    profiler.dump_stats(path)
+
+    summary = io.StringIO()
+    stats = pstats.Stats(profiler, stream=summary)
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(config.PROFILE_TOP)
+    with open(path[: -len(".prof")] + ".txt", "w", encoding="utf-8") as f:
+        f.write(summary.getvalue())
+
+    logging.info("Профиль %s сохранен в %s\n%s", name, path, summary.getvalue())
+    return path
@@ -0,0 +1,191 @@
+import asyncio
+import contextvars
+import fcntl
+import json
+import time
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.mysql import insert
+from telethon.sync import TelegramClient
+
+import config
+import data
+import metrics
+from logger import logging
+from models import RateBucket
+
+# Классы методов API со своими лимитами. Остальные запросы относятся к классу default
+METHOD_CLASSES: Dict[str, str] = {
+    "InviteToChannelRequest": "invite",
+    "SendMessageRequest": "message",
+    "SendMediaRequest": "message",
+    "ForwardMessagesRequest": "message",
+    "UpdatePinnedMessageRequest": "message",
+    "CreateChannelRequest": "channel",
+    "DeleteChannelRequest": "channel",
+    "DeleteHistoryRequest": "channel",
+    "EditTitleRequest": "channel",
+    "EditPhotoRequest": "channel",
+    "EditAdminRequest": "channel",
+    "EditBannedRequest": "channel",
+    "ExportChatInviteRequest": "channel",
+    "SaveFilePartRequest": "upload",
+    "SaveBigFilePartRequest": "upload",
+    "GetFileRequest": "upload",
+}
+
+
+def method_class(request) -> str:
+    return METHOD_CLASSES.get(type(request).__name__, "default")
+
+
+def parse_limits(value: str) -> Dict[str, Tuple[float, float]]:
+    """
+    Разбирает лимиты вида "invite=1/10,message=1/3": не больше 1 приглашения за 10 секунд и т.д.
+
+    :param value: строка из config.RATE_LIMITS
+    :return: (запросов в секунду, размер ведра) для каждого класса методов
+    """
+    limits = {}
+    for item in value.split(","):
+        if item.strip():
+            name, limit = item.split("=")
+            requests, seconds = limit.split("/")
+            limits[name.strip()] = (float(requests) / float(seconds), float(requests))
+    return limits
+
+
+def take_token(
+    tokens: float, refilled_at: float, now: float, rate: float, capacity: float
+) -> Tuple[float, float]:
+    """
+    Берет токен из ведра. Токен можно взять в долг: тогда ожидание растет с длиной очереди,
+    и процессы получают токены в порядке обращения
+
+    :param tokens: токенов в ведре на момент refilled_at
+    :param refilled_at: время последнего пополнения
+    :param now: текущее время
+    :param rate: токенов в секунду
+    :param capacity: размер ведра
+    :return: токенов в ведре после взятия и сколько секунд ждать
+    """
+    tokens = min(capacity, tokens + (now - refilled_at) * rate) - 1
+    return tokens, max(0.0, -tokens / rate)
+
+
+class FileBudget:
+    """
+    Ведра в JSON-файле под блокировкой fcntl. Подходит для процессов на одном хосте
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def take(self, bucket: str, rate: float, capacity: float) -> float:
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                buckets = json.loads(content) if content else {}
+
+                now = time.time()
+                tokens, refilled_at = buckets.get(bucket, (capacity, now))
+                tokens, wait = take_token(tokens, refilled_at, now, rate, capacity)
+                buckets[bucket] = (tokens, now)
+
+                f.seek(0)
+                f.truncate()
+                json.dump(buckets, f)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return wait
+
+
+class DBBudget:
+    """
+    Ведра в таблице rate_buckets. Строка ведра блокируется на время взятия токена,
+    поэтому лимит общий для процессов на разных хостах
+    """
+
+    def take(self, bucket: str, rate: float, capacity: float) -> float:
+        stmt = insert(RateBucket).values(bucket=bucket, tokens=capacity, refilled_at=time.time())
+
+        s = data.make_session()
+        with s() as session:
+            session.execute(stmt.on_duplicate_key_update(bucket=stmt.inserted.bucket))
+            row = session.execute(
+                select(RateBucket).where(RateBucket.bucket == bucket).with_for_update()
+            ).scalar_one()
+
+            now = time.time()
+            row.tokens, wait = take_token(row.tokens, row.refilled_at, now, rate, capacity)
+            row.refilled_at = now
+            session.commit()
+        return wait
+
+
+def make_budget() -> Optional[object]:
+    """
+    Хранилище ведер согласно config.RATE_BACKEND
+
+    :return: FileBudget, DBBudget или None, если общий лимит выключен
+    """
+    if config.RATE_BACKEND == "file":
+        return FileBudget(config.RATE_FILE)
+    if config.RATE_BACKEND == "db":
+        return DBBudget()
+    return None
+
+
+def limit_client(client: TelegramClient) -> TelegramClient:
+    """
+    Оборачивает низкоуровневый вызов API клиента: перед каждым запросом берется токен
+    из общего ведра аккаунта (config.SESSION_NAME) и класса метода. Так одновременно работающие
+    процессы одного аккаунта вместе не превышают config.RATE_LIMITS.
+    Токен берется в пуле потоков, а ожидание токена - asyncio.sleep, поэтому цикл событий не блокируется.
+    Ничего не делает, если config.RATE_BACKEND не задан
+
+    :param client: клиент телеграма
+    :return: тот же клиент
+    """
+    budget = make_budget()
+    if budget is None:
+        return client
+
+    limits = parse_limits(config.RATE_LIMITS)
+    call = client._call
+
+    async def _call(sender, request, ordered=False, flood_sleep_threshold=None):
+        for item in request if isinstance(request, list) else [request]:
+            name = method_class(item)
+            if name not in limits:
+                continue
+
+            rate, capacity = limits[name]
+            try:
+                # Блокировка файла или строки БД не должна останавливать цикл событий клиента:
+                # на нем же идут одновременные отправки outbox, сбор статистики и выгрузка архивов.
+                # Копия контекста нужна для настроек арендатора (config.override)
+                wait = await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    contextvars.copy_context().run,
+                    budget.take,
+                    f"{config.SESSION_NAME}:{name}",
+                    rate,
+                    capacity,
+                )
+            except Exception as e:
+                logging.info("Не удалось взять токен общего лимита %s. Ошибка: %s", name, e)
+                continue
+
+            if wait > 0:
+                metrics.observe_rate_wait(name, wait)
+                await asyncio.sleep(wait)
+
+        return await call(sender, request, ordered=ordered, flood_sleep_threshold=flood_sleep_threshold)
+
+    client._call = _call
+    return client
@@ -0,0 +1,227 @@
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Set
+
+import config
+import data
+import events
+from logger import logging
+from models import BankAccount, Chat, User
+
+
+class Repository:
+    """
+    Снимок пользователей, активных чатов и счетов на время одного запуска.
+    Загружается из БД один раз и передается всем компонентам (FindBirthday, PartyMaker, PartyCleaner, ChatTools).
+    Изменения записываются в БД через функции data и сразу применяются к снимку,
+    поэтому компоненты видят одно и то же состояние без повторных запросов
+    """
+
+    def __init__(self, load: bool = True):
+        self.users: Dict[int, User] = {}
+        self.chats: Dict[int, Chat] = {}
+        self.chats_by_bdayer: Dict[int, List[Chat]] = defaultdict(list)
+        self.accounts: Dict[str, BankAccount] = {}
+        self.account_by_chat: Dict[int, BankAccount] = {}
+
+        if load:
+            self.reload()
+
+    @classmethod
+    def seeded(
+        cls,
+        users: Iterable[User] = (),
+        chats: Iterable[Chat] = (),
+        accounts: Iterable[BankAccount] = (),
+    ) -> "Repository":
+        """
+        Снимок только из переданных записей, без загрузки всей БД. Нужен, когда запуск работает
+        с одним чатом (scheduler.EventRunner). Чаты, которых нет в снимке, читаются из БД (get_chat)
+
+        :param users: пользователи
+        :param chats: активные чаты
+        :param accounts: счета
+        :return: снимок
+        """
+        repo = cls(load=False)
+        repo._fill(users, chats, accounts)
+        return repo
+
+    def reload(self) -> None:
+        """
+        Загружает снимок из БД
+
+        :return: None
+        """
+        self._fill(data.get_all_users(), data.get_active_chats(), data.get_bank_accounts())
+
+        logging.info(
+            "Загружен снимок БД: пользователей %s, активных чатов %s, счетов %s",
+            len(self.users),
+            len(self.chats),
+            len(self.accounts),
+        )
+
+    def _fill(
+        self, users: Iterable[User], chats: Iterable[Chat], accounts: Iterable[BankAccount]
+    ) -> None:
+        self.users = {user.tg_id: user for user in users}
+
+        self.chats = {}
+        self.chats_by_bdayer = defaultdict(list)
+        for chat in chats:
+            self._add_chat(chat)
+
+        self.accounts = {account.link: account for account in accounts}
+        # Счет закреплен за записью чата (chats.id), а снимок ищет его по id канала
+        chat_ids = {chat.id: chat.chat_id for chat in self.chats.values()}
+        self.account_by_chat = {
+            chat_ids[account.used_in]: account
+            for account in self.accounts.values()
+            if account.used_in in chat_ids
+        }
+
+    def _add_chat(self, chat: Chat) -> None:
+        self.chats[chat.chat_id] = chat
+        self.chats_by_bdayer[chat.bdayer_id].append(chat)
+
+    # Чтение
+
+    def get_user(self, tg_id: int) -> Optional[User]:
+        return self.users.get(tg_id)
+
+    def active_users(self) -> List[User]:
+        return [user for user in self.users.values() if user.is_active]
+
+    def all_user_ids(self) -> Set[int]:
+        return set(self.users)
+
+    def birthday_window_users(
+        self, before: int = None, after: int = None, today: date = None
+    ) -> List[User]:
+        """
+        Активные пользователи, для которых сегодня должен существовать чат.
+        Окно фильтруется в БД по индексу (data.get_birthday_window_users), а возвращаются объекты снимка,
+        чтобы изменения этого запуска (например, деактивация) были видны
+
+        :param before: за сколько дней до ДР создается чат. По умолчанию config.DAYS_BEFORE
+        :param after: сколько дней после ДР существует чат. По умолчанию config.DAYS_AFTER
+        :param today: дата, по умолчанию сегодня
+        :return: список пользователей
+        """
+        users = []
+        for user in data.get_birthday_window_users(before, after, today):
+            user = self.users.setdefault(user.tg_id, user)
+            if user.is_active:
+                users.append(user)
+        return users
+
+    def get_chat(self, chat_id: int) -> Optional[Chat]:
+        """
+        Чат из снимка. Чат, созданный после загрузки снимка (например, другим процессом), читается из БД
+
+        :param chat_id: id чата
+        :return: сущность Chat или None
+        """
+        if chat_id not in self.chats:
+            chat = data.get_chat(chat_id)
+            if chat is None or not chat.is_active:
+                return chat
+            self._add_chat(chat)
+        return self.chats[chat_id]
+
+    def active_chats(self) -> List[Chat]:
+        return list(self.chats.values())
+
+    def active_chats_for_user(self, tg_id: int) -> List[Chat]:
+        return list(self.chats_by_bdayer.get(tg_id, []))
+
+    def chat_bdayer(self, chat_id: int) -> Optional[User]:
+        chat = self.get_chat(chat_id)
+        return self.users.get(chat.bdayer_id) if chat is not None else None
+
+    # Запись
+
+    def chat_create(self, chat_id: int, invite_link: str, bdayer_id: int, chat_title: str) -> Chat:
+        data.chat_create(
+            chat_id=chat_id, invite_link=invite_link, bdayer_id=bdayer_id, chat_title=chat_title
+        )
+        # Объект, возвращенный после commit, отсоединен от сессии, поэтому перечитываем запись
+        chat = data.get_chat(chat_id)
+        self._add_chat(chat)
+
+        bdayer = self.users.get(bdayer_id)
+        if config.EVENTS_ENABLED and bdayer is not None:
+            events.schedule_chat(chat_id, bdayer, chat.created_at.date())
+        return chat
+
+    def chat_update(
+        self, chat_id: int, added: int = None, invited: int = None, account_link: str = None
+    ) -> None:
+        data.chat_update(chat_id, added, invited, account_link)
+
+        chat = self.chats.get(chat_id)
+        if chat is not None:
+            if added is not None:
+                chat.users_added = added
+            if invited is not None:
+                chat.users_invited = invited
+            if account_link is not None:
+                chat.account_link = account_link
+
+    def get_account_link(self, chat_id: int) -> str:
+        """
+        Ссылка на счет чата. Свободный счет закрепляется в БД (data.get_account_link),
+        чтобы два процесса не получили один и тот же счет
+
+        :param chat_id: id чата
+        :return: ссылка на счет
+        """
+        if chat_id in self.account_by_chat:
+            return self.account_by_chat[chat_id].link
+
+        link = data.get_account_link(chat_id)
+        account = self.accounts.get(link)
+        chat = self.get_chat(chat_id)
+        if account is not None and chat is not None:
+            account.used_in = chat.id
+            self.account_by_chat[chat_id] = account
+        return link
+
+    def deactivate_chat(self, chat_id: int) -> None:
+        data.deactivate_chat(chat_id)
+
+        chat = self.chats.pop(chat_id, None)
+        if chat is not None:
+            chat.is_active = False
+            self.chats_by_bdayer[chat.bdayer_id].remove(chat)
+
+        account = self.account_by_chat.pop(chat_id, None)
+        if account is not None:
+            account.used_in = None
+
+    def enqueue_chat_notification(
+        self,
+        chat_id: int,
+        kind: str,
+        text: str,
+        birthday_sent: bool = None,
+        deletion_sent: bool = None,
+    ) -> bool:
+        queued = data.enqueue_chat_notification(chat_id, kind, text, birthday_sent, deletion_sent)
+
+        chat = self.chats.get(chat_id)
+        if chat is not None:
+            if birthday_sent is not None:
+                chat.notification_birthday_sent = birthday_sent
+            if deletion_sent is not None:
+                chat.notification_deletion_sent = deletion_sent
+        return queued
+
+    def deactivate_users(self, tg_ids: Iterable[int]) -> int:
+        tg_ids = list(tg_ids)
+        count = data.deactivate_users(tg_ids)
+        for tg_id in tg_ids:
+            if tg_id in self.users:
+                self.users[tg_id].is_active = False
+        return count
@@ -0,0 +1,118 @@
+import sys
+from contextlib import contextmanager
+from typing import Iterator, List
+
+import pandas as pd
+
+import data
+import tracing
+from logger import logging
+from models import Run
+
+
+@contextmanager
+def record_run(command: str) -> Iterator[tracing.RunTrace]:
+    """
+    Трассирует запуск и сохраняет трассу в таблицу runs, даже если запуск упал
+
+    :param command: имя запускаемой команды (main, partymaker, ...)
+    """
+    trace = tracing.start(command)
+    status, error = "ok", None
+    try:
+        yield trace
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            status, error = "failed", str(e.code)
+        raise
+    except KeyboardInterrupt:
+        status = "interrupted"
+        raise
+    except Exception as e:
+        status, error = "failed", repr(e)
+        raise
+    finally:
+        tracing.finish(status, error)
+        try:
+            data.save_run(trace)
+        except Exception as e:
+            logging.info("Не удалось сохранить трассу запуска. Ошибка: %s", e)
+
+
+def runs_table(runs: List[Run]) -> pd.DataFrame:
+    """
+    Строит таблицу запусков: общие показатели и длительность каждого этапа в секундах
+
+    :param runs: запуски
+    :return: таблица, строка - запуск
+    """
+    rows = []
+    for run in runs:
+        row = {
+            "id": run.id,
+            "command": run.command,
+            "started_at": run.started_at,
+            "status": run.status,
+            "total": run.duration,
+            "sleep": run.sleep_seconds,
+            "api_calls": run.api_calls_total,
+        }
+        for name, stage in (run.stages or {}).items():
+            row[name] = stage["seconds"]
+        rows.append(row)
+
+    return pd.DataFrame(rows).set_index("id") if rows else pd.DataFrame()
+
+
+def find_regressions(table: pd.DataFrame, threshold: float = 1.5) -> pd.Series:
+    """
+    Сравнивает последний запуск каждой команды с медианой ее предыдущих запусков.
+    Запуски разных команд между собой не сравниваются: у них разные этапы и длительность
+
+    :param table: таблица из runs_table
+    :param threshold: во сколько раз этап должен замедлиться, чтобы считаться регрессией
+    :return: отношение длительности к медиане для замедлившихся показателей, индекс - (команда, показатель)
+    """
+    found = {}
+    for command, runs in table.groupby("command", sort=False):
+        numeric = runs.drop(columns=["command", "started_at", "status"]).astype(float)
+        if len(numeric) < 2:
+            continue
+
+        baseline = numeric.iloc[:-1].median()
+        ratio = numeric.iloc[-1] / baseline
+        found[command] = ratio[ratio >= threshold]
+
+    if not found:
+        return pd.Series(dtype=float)
+    return pd.concat(found).sort_values(ascending=False)
+
+
+def report(command: str = None, last: int = 10, threshold: float = 1.5) -> None:
+    """
+    Печатает последние запуски по этапам и замедлившиеся показатели
+
+    :param command: команда, по умолчанию все
+    :param last: сколько последних запусков показать
+    :param threshold: порог регрессии
+    :return: None
+    """
+    table = runs_table(data.get_runs(command, last))
+    if table.empty:
+        print("Запусков не найдено")
+    else:
+        with pd.option_context("display.width", 200, "display.max_columns", None):
+            print(table.round(1).to_string())
+
+        regressions = find_regressions(table, threshold)
+        if not regressions.empty:
+            print("\nЗамедлились относительно медианы предыдущих запусков:")
+            for (run_command, name), ratio in regressions.items():
+                print(f"  {run_command} {name}: x{ratio:.1f}")
+
+
+if __name__ == "__main__":
+    import cli
+
+    args = cli.parse_args(["runs", *sys.argv[1:]])
+    report(args.command, args.last, args.threshold)
@@ -0,0 +1,201 @@
+import sys
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from telethon.sync import TelegramClient
+
+import config
+import data
+import events
+import metrics
+import planning
+from data import DueEvent
+from digest import AdminDigest
+from logger import logging
+from outbox import OutboxDispatcher
+from partycleaner import BIRTHDAY_NOTICE_TEXT, DELETION_NOTICE_TEXT, PartyCleaner
+from partymaker import PartyMaker
+from repository import Repository
+from runs import record_run
+from utils import FindBirthday, signin
+
+
+def seconds_until_next_event() -> Optional[float]:
+    """
+    Через сколько секунд наступит ближайшее событие
+
+    :return: секунды (0, если событие уже наступило) или None, если событий нет
+    """
+    due_at = data.next_event_due()
+    if due_at is None:
+        return None
+    return max(0.0, (due_at - datetime.now()).total_seconds())
+
+
+class EventRunner:
+    """
+    Выполняет наступившие события (см. events). Работа за запуск пропорциональна количеству
+    наступивших событий, а не количеству чатов и пользователей
+    """
+
+    def __init__(self, client: TelegramClient, digest: AdminDigest = None, repo: Repository = None):
+        self.client = client
+        self.digest: AdminDigest = digest if digest is not None else AdminDigest()
+        self._repo: Optional[Repository] = repo
+        self.notified: bool = False
+
+        # Обработчик может вернуть новый срок события, тогда событие переносится
+        self.handlers: Dict[str, Callable[[DueEvent], Optional[datetime]]] = {
+            events.CREATE_CHAT: self.create_chat,
+            events.BIRTHDAY_NOTICE: self.birthday_notice,
+            events.DELETION_WARNING: self.deletion_warning,
+            events.DELETE_CHAT: self.delete_chat,
+        }
+
+    def event_repo(self, users=(), chats=()) -> Repository:
+        # Событие касается одного чата, поэтому снимок собирается только из его записей,
+        # а не из всех пользователей, чатов и счетов. Переданный в конструктор снимок используется как есть
+        if self._repo is not None:
+            return self._repo
+        return Repository.seeded(users=users, chats=chats)
+
+    def create_chat(self, event: DueEvent) -> Optional[datetime]:
+        user = data.get_user(event.tg_id)
+        if user is None or not user.is_active:
+            logging.info("Пользователь %s не активен, чат не создаем", event.tg_id)
+            return None
+
+        bdate = events.window_birthday(user.birth_month, user.birth_day, event.due_at.date())
+        if not FindBirthday.check_birthday(user.birth_month, user.birth_day):
+            logging.info("Окно чата для %s уже закрыто", user)
+        elif data.get_active_chats_for_user(user.tg_id):
+            logging.info("Чат для %s уже создан", user)
+        elif planning.creations_left() == 0:
+            logging.info("Сегодня чат уже создавался, создание чата для %s перенесено на завтра", user)
+            return events.at_event_hour(datetime.now().date() + timedelta(days=1))
+        else:
+            # Активные пользователи - список приглашенных, без них чат не собрать
+            repo = self.event_repo(users=data.get_active_users())
+            PartyMaker(self.client, config.MAIN_CHAT_ID, user, self.digest, repo=repo).make_party()
+
+        # Следующее создание - к дню рождения в следующем году
+        events.schedule_users([user], day=bdate + timedelta(days=config.DAYS_AFTER))
+        return None
+
+    def notify(self, event: DueEvent, kind: str, text: str, **sent) -> None:
+        chat = data.get_chat(event.chat_id)
+        if chat is None or not chat.is_active:
+            logging.info("Чат %s уже не активен, уведомление %s не нужно", event.chat_id, kind)
+            return
+
+        if data.enqueue_chat_notification(chat.chat_id, kind, text, **sent):
+            logging.info("Уведомление %s поставлено в очередь для чата %s", kind, chat.chat_id)
+        self.notified = True
+
+    def birthday_notice(self, event: DueEvent) -> Optional[datetime]:
+        self.notify(event, "birthday", BIRTHDAY_NOTICE_TEXT, birthday_sent=True)
+        return None
+
+    def deletion_warning(self, event: DueEvent) -> Optional[datetime]:
+        self.notify(event, "deletion", DELETION_NOTICE_TEXT, deletion_sent=True)
+        return None
+
+    def delete_chat(self, event: DueEvent) -> Optional[datetime]:
+        chat = data.get_chat(event.chat_id)
+        if chat is None or not chat.is_active:
+            logging.info("Чат %s уже удален", event.chat_id)
+            return None
+
+        bdayer = data.get_user(chat.bdayer_id)
+        repo = self.event_repo(users=[bdayer] if bdayer is not None else [], chats=[chat])
+        chat = repo.get_chat(chat.chat_id)
+        cleaned = PartyCleaner(self.client, self.digest, repo).clean_chats([chat])
+        if chat.chat_id not in cleaned:
+            raise RuntimeError(f"Чат {chat.chat_id} не удален: не удалось сохранить архив")
+        return None
+
+    def run_event(self, event: DueEvent) -> bool:
+        """
+        Выполняет событие. Упавшее событие повторяется с растущей задержкой, как задачи очереди
+
+        :param event: событие
+        :return: True, если событие выполнено
+        """
+        logging.info("Выполняем событие %s #%s (срок %s)", event.kind, event.id, event.due_at)
+        try:
+            with metrics.stage(f"event:{event.kind}"):
+                postpone_to = self.handlers[event.kind](event)
+
+        # PartyMaker завершает процесс через sys.exit, если не удалось создать чат
+        except (Exception, SystemExit) as e:
+            retry_at = data.fail_event(
+                event.id, repr(e), config.TASK_BACKOFF_SECONDS, config.TASK_MAX_ATTEMPTS
+            )
+            if retry_at is None:
+                logging.exception("Событие %s #%s окончательно провалилось: %s", event.kind, event.id, e)
+                self.digest.failure(f"Событие {event.kind} не выполнено: {e}")
+            else:
+                logging.info("Событие %s #%s упало, повтор в %s. Ошибка: %s", event.kind, event.id, retry_at, e)
+            return False
+
+        if postpone_to is not None:
+            data.postpone_event(event.id, postpone_to)
+        else:
+            data.complete_event(event.id)
+        return True
+
+    @metrics.stage("run_events")
+    def run_due(self) -> int:
+        """
+        Выполняет все наступившие события
+
+        :return: количество обработанных событий
+        """
+        done = 0
+        while True:
+            due = data.claim_due_events(config.EVENT_BATCH_SIZE, config.TASK_LEASE_SECONDS)
+            if not due:
+                break
+            for event in due:
+                self.run_event(event)
+                done += 1
+
+        if self.notified:
+            OutboxDispatcher(self.client).drain()
+
+        logging.info("Выполнено событий: %s", done)
+        return done
+
+
+def schedule_all() -> None:
+    """
+    Планирует события для пользователей и активных чатов (первичное планирование)
+    """
+    events.schedule_new_users()
+    events.schedule_active_chats()
+
+
+def run_events() -> None:
+    """
+    Выполняет наступившие события
+    """
+    dog_client = signin(config.BOT_API_ID, config.BOT_API_HASH)
+
+    with dog_client, record_run("events"):
+        runner = EventRunner(dog_client)
+        try:
+            runner.run_due()
+        finally:
+            runner.digest.send(dog_client)
+            metrics.write_textfile("events")
+
+
+if __name__ == "__main__":
+    import cli
+
+    args = cli.parse_args(["events", *sys.argv[1:]])
+    if args.action == "schedule":
+        schedule_all()
+    else:
+        run_events()
+    sys.exit(0)
@@ -0,0 +1,213 @@
+import sys
+import time
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import delete, or_, select
+from sqlalchemy.dialects.mysql import insert
+from telethon import utils as tg_utils
+from telethon.crypto import AuthKey
+from telethon.sessions import MemorySession, SQLiteSession
+from telethon.tl.types import PeerChannel, PeerChat, PeerUser
+
+import data
+from logger import logging
+from models import TelegramEntity, TelegramSession
+
+
+class DBSession(MemorySession):
+    """
+    Сессия Telethon, которая хранится в БД вместо локального файла bot.session.
+    Ключ авторизации и кэш сущностей общие для всех процессов и хостов,
+    поэтому несколько воркеров могут работать одновременно без повторной авторизации.
+
+    Все записи делаются через INSERT ... ON DUPLICATE KEY UPDATE, поэтому
+    одновременные записи из разных процессов не конфликтуют.
+    Состояние обновлений и кэш загруженных файлов хранятся только в памяти.
+    """
+
+    def __init__(self, name: str):
+        super().__init__()
+        self.name = name
+        self.save_entities = True
+
+        # Сущности, уже записанные в БД этим процессом: id -> строка
+        self._known_entities: Dict[int, Tuple] = {}
+
+        s = data.make_session()
+        with s() as session:
+            row = session.get(TelegramSession, name)
+            if row is not None:
+                self._dc_id = row.dc_id
+                self._server_address = row.server_address
+                self._port = row.port
+                self._takeout_id = row.takeout_id
+                if row.auth_key:
+                    self._auth_key = AuthKey(data=row.auth_key)
+
+    def set_dc(self, dc_id, server_address, port):
+        super().set_dc(dc_id, server_address, port)
+        self._update_session_table()
+
+    @MemorySession.auth_key.setter
+    def auth_key(self, value):
+        self._auth_key = value
+        self._update_session_table()
+
+    @MemorySession.takeout_id.setter
+    def takeout_id(self, value):
+        self._takeout_id = value
+        self._update_session_table()
+
+    def _update_session_table(self) -> None:
+        """
+        Записывает данные авторизации в таблицу tg_sessions
+
+        :return: None
+        """
+        values = dict(
+            dc_id=self._dc_id,
+            server_address=self._server_address,
+            port=self._port,
+            auth_key=self._auth_key.key if self._auth_key else None,
+            takeout_id=self._takeout_id,
+        )
+        stmt = insert(TelegramSession).values(name=self.name, **values)
+
+        s = data.make_session()
+        with s() as session:
+            session.execute(stmt.on_duplicate_key_update(**values))
+            session.commit()
+
+    def save(self):
+        # Все изменения записываются в БД сразу, отдельное сохранение не нужно
+        pass
+
+    def delete(self):
+        s = data.make_session()
+        with s() as session:
+            session.execute(
+                delete(TelegramSession).where(TelegramSession.name == self.name)
+            )
+            session.commit()
+        return True
+
+    def process_entities(self, tlo):
+        """
+        Записывает в БД новые или изменившиеся сущности из ответа телеграма.
+        Уже известные процессу сущности повторно не пишутся
+        """
+        if not self.save_entities:
+            return
+
+        self.save_entity_rows(self._entities_to_rows(tlo))
+
+    def save_entity_rows(self, rows) -> None:
+        """
+        Записывает в БД строки сущностей (id, hash, username, phone, name)
+
+        :param rows: строки сущностей
+        :return: None
+        """
+        rows = [row for row in rows if self._known_entities.get(row[0]) != row]
+        if not rows:
+            return
+
+        now = int(time.time())
+        stmt = insert(TelegramEntity).values(
+            [
+                dict(
+                    session_name=self.name,
+                    id=id,
+                    hash=hash,
+                    username=username,
+                    phone=str(phone) if phone is not None else None,
+                    name=name,
+                    date=now,
+                )
+                for id, hash, username, phone, name in rows
+            ]
+        )
+        stmt = stmt.on_duplicate_key_update(
+            hash=stmt.inserted.hash,
+            username=stmt.inserted.username,
+            phone=stmt.inserted.phone,
+            name=stmt.inserted.name,
+            date=stmt.inserted.date,
+        )
+
+        s = data.make_session()
+        with s() as session:
+            session.execute(stmt)
+            session.commit()
+
+        for row in rows:
+            self._known_entities[row[0]] = row
+
+    def _get_entity_row(self, *conditions) -> Optional[Tuple[int, int]]:
+        s = data.make_session()
+        with s() as session:
+            row = session.execute(
+                select(TelegramEntity.id, TelegramEntity.hash)
+                .where(TelegramEntity.session_name == self.name, *conditions)
+                .order_by(TelegramEntity.date.desc())
+                .limit(1)
+            ).first()
+            return tuple(row) if row else None
+
+    def get_entity_rows_by_phone(self, phone):
+        return self._get_entity_row(TelegramEntity.phone == str(phone))
+
+    def get_entity_rows_by_username(self, username):
+        return self._get_entity_row(TelegramEntity.username == username)
+
+    def get_entity_rows_by_name(self, name):
+        return self._get_entity_row(TelegramEntity.name == name)
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        if exact:
+            return self._get_entity_row(TelegramEntity.id == id)
+
+        return self._get_entity_row(
+            or_(
+                TelegramEntity.id == tg_utils.get_peer_id(PeerUser(id)),
+                TelegramEntity.id == tg_utils.get_peer_id(PeerChat(id)),
+                TelegramEntity.id == tg_utils.get_peer_id(PeerChannel(id)),
+            )
+        )
+
+
+def import_sqlite_session(path: str, name: str) -> DBSession:
+    """
+    Переносит существующий файл сессии (например bot.session) в БД,
+    чтобы не проходить авторизацию заново
+
+    :param path: путь к файлу сессии
+    :param name: имя сессии в БД
+    :return: сессия в БД
+    """
+    file_session = SQLiteSession(path)
+    db_session = DBSession(name)
+
+    db_session.set_dc(
+        file_session.dc_id, file_session.server_address, file_session.port
+    )
+    db_session.auth_key = file_session.auth_key
+
+    c = file_session._cursor()
+    try:
+        entities = c.execute("select id, hash, username, phone, name from entities")
+        rows = [tuple(row) for row in entities.fetchall()]
+    finally:
+        c.close()
+        file_session.close()
+
+    for offset in range(0, len(rows), 1000):
+        db_session.save_entity_rows(rows[offset : offset + 1000])
+
+    logging.info("Сессия %s перенесена в БД под именем %s. Сущностей: %s", path, name, len(rows))
+    return db_session
+
+
+if __name__ == "__main__":
+    # python session_store.py bot.session bot
+    import_sqlite_session(sys.argv[1], sys.argv[2])
@@ -0,0 +1,152 @@
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import metrics
+from logger import logging
+
+
+class Stage(NamedTuple):
+    """
+    Этап операции.
+    Этапы с local=True не обращаются к API телеграма (БД, подготовка данных) и выполняются в отдельном потоке
+    одновременно с остальными. Этапы с вызовами API выполняются по одному в вызывающем потоке:
+    клиент телеграма привязан к своему циклу событий, а паузы между вызовами API должны соблюдаться как раньше
+    """
+
+    name: str
+    run: Callable[[], None]
+    after: Tuple[str, ...] = ()
+    # Возвращает True, если работа этапа уже сделана (например, в прошлой попытке), и этап можно пропустить
+    done: Optional[Callable[[], bool]] = None
+    local: bool = False
+
+
+class StageGraph:
+    """
+    Выполняет этапы в порядке зависимостей. Этап запускается, когда выполнены (или пропущены)
+    все этапы из after. Если этап упал, зависящие от него этапы не запускаются, а ошибка пробрасывается
+    после завершения уже запущенных этапов
+    """
+
+    def __init__(self, name: str, stages: Iterable[Stage], max_workers: int = 2):
+        self.name = name
+        self.stages: Dict[str, Stage] = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Этап {stage.name} объявлен дважды")
+            self.stages[stage.name] = stage
+
+        for stage in self.stages.values():
+            unknown = [name for name in stage.after if name not in self.stages]
+            if unknown:
+                raise ValueError(f"Этап {stage.name} зависит от неизвестных этапов: {unknown}")
+
+        self.order: List[str] = self._topological_order()
+        self.max_workers = max_workers
+
+        self.timings: Dict[str, float] = {}
+        self.skipped: Set[str] = set()
+
+    def _topological_order(self) -> List[str]:
+        order, visiting, visited = [], set(), set()
+
+        def visit(name: str) -> None:
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Циклическая зависимость этапов: {name}")
+            visiting.add(name)
+            for dependency in self.stages[name].after:
+                visit(dependency)
+            visiting.discard(name)
+            visited.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def run_stage(self, stage: Stage) -> None:
+        """
+        Выполняет этап, если он еще не сделан, и замеряет его длительность
+
+        :param stage: этап
+        :return: None
+        """
+        if stage.done is not None and stage.done():
+            logging.info("Этап %s уже выполнен, пропускаем", stage.name)
+            self.skipped.add(stage.name)
+            return
+
+        started = time.perf_counter()
+        try:
+            with metrics.stage(f"{self.name}:{stage.name}"):
+                stage.run()
+        finally:
+            self.timings[stage.name] = time.perf_counter() - started
+
+    def run(self) -> None:
+        """
+        Выполняет все этапы
+
+        :return: None
+        """
+        finished: Set[str] = set()
+        running: Dict[Future, str] = {}
+        error: Optional[BaseException] = None
+
+        def ready(name: str) -> bool:
+            return (
+                name not in finished
+                and name not in running.values()
+                and all(dependency in finished for dependency in self.stages[name].after)
+            )
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while error is None and len(finished) < len(self.stages):
+                # Локальные этапы уходят в пул сразу, как только готовы
+                for name in self.order:
+                    stage = self.stages[name]
+                    if stage.local and ready(name):
+                        # Копия контекста: в потоке нужны трассировка и настройки арендатора (config.override)
+                        context = contextvars.copy_context()
+                        running[pool.submit(context.run, self.run_stage, stage)] = name
+
+                api_ready = [name for name in self.order if not self.stages[name].local and ready(name)]
+                api_stage = self.stages[api_ready[0]] if api_ready else None
+                if api_stage is not None:
+                    try:
+                        self.run_stage(api_stage)
+                        finished.add(api_stage.name)
+                    except BaseException as e:
+                        error = e
+                elif running:
+                    wait(running, return_when=FIRST_COMPLETED)
+                else:
+                    break
+
+                for future in [future for future in running if future.done()]:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                    else:
+                        finished.add(name)
+
+            # Дожидаемся запущенных локальных этапов, даже если что-то упало
+            for future, name in running.items():
+                if future.exception() is not None:
+                    error = error or future.exception()
+
+        if error is not None:
+            raise error
+
+        logging.info(
+            "Этапы %s выполнены: %s",
+            self.name,
+            ", ".join(
+                f"{name} (пропущен)" if name in self.skipped else f"{name} {self.timings[name]:.1f} c"
+                for name in self.order
+            ),
+        )
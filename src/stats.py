@@ -0,0 +1,79 @@
+import asyncio
+from typing import Dict, Iterable, Optional, Tuple
+
+from telethon.sync import TelegramClient
+from telethon.tl.functions.channels import GetFullChannelRequest
+from telethon.tl.types import PeerChannel
+
+import config
+import data
+import metrics
+from logger import logging
+from runs import record_run
+from utils import signin
+
+
+class ParticipationCollector:
+    """
+    Собирает количество участников активных чатов за один проход:
+    запросы выполняются одновременно, но не больше config.STATS_CONCURRENCY за раз
+    """
+
+    def __init__(self, client: TelegramClient):
+        self.client = client
+        self.concurrency: int = config.STATS_CONCURRENCY
+
+    def collect(self, chat_ids: Iterable[int]) -> Dict[int, int]:
+        """
+        Запрашивает количество участников чатов
+
+        :param chat_ids: id чатов
+        :return: количество участников по id чата (чаты, которые не удалось запросить, пропускаются)
+        """
+        return self.client.loop.run_until_complete(self.fetch_all(chat_ids))
+
+    async def fetch_all(self, chat_ids: Iterable[int]) -> Dict[int, int]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(chat_id: int) -> Optional[Tuple[int, int]]:
+            async with semaphore:
+                try:
+                    full = await self.client(GetFullChannelRequest(PeerChannel(chat_id)))
+                except Exception as e:
+                    logging.info("Не удалось получить участников чата %s. Ошибка: %s", chat_id, e)
+                    return None
+                return chat_id, full.full_chat.participants_count
+
+        results = await asyncio.gather(*(fetch(chat_id) for chat_id in chat_ids))
+        return dict(result for result in results if result is not None)
+
+    @metrics.stage("collect_stats")
+    def run(self) -> Dict[int, int]:
+        """
+        Обновляет Chat.participated у всех активных чатов и пишет точку за сегодня в chat_stats
+
+        :return: количество участников по id чата
+        """
+        chat_ids = [chat.chat_id for chat in data.get_active_chats()]
+        counts = self.collect(chat_ids)
+        data.save_participation(counts)
+
+        logging.info("Собрана статистика по %s из %s чатов", len(counts), len(chat_ids))
+        return counts
+
+
+def collect() -> None:
+    """
+    Собирает количество участников активных чатов
+    """
+    dog_client = signin(config.BOT_API_ID, config.BOT_API_HASH)
+
+    with dog_client, record_run("stats"):
+        try:
+            ParticipationCollector(dog_client).run()
+        finally:
+            metrics.write_textfile("stats")
+
+
+if __name__ == "__main__":
+    collect()
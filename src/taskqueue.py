@@ -0,0 +1,384 @@
+import os
+import signal
+import socket
+import sys
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List
+
+from telethon.sync import TelegramClient
+
+import config
+import data
+import metrics
+import planning
+from data import QueuedTask
+from digest import AdminDigest
+from logger import logging
+from partycleaner import PartyCleaner
+from partymaker import PartyMaker
+from runs import record_run
+from utils import signin
+
+# Операции с чатами разбиты на небольшие задачи. Каждая задача идемпотентна или проверяет,
+# не сделана ли работа раньше, поэтому упавшую на середине операцию можно безопасно повторить
+Handler = Callable[[TelegramClient, dict, AdminDigest], None]
+HANDLERS: Dict[str, Handler] = {}
+
+# PartyMaker делает тяжелые обязательные вызовы API при создании. Воркеру хватает одного раза за процесс
+_warmed_up = False
+
+
+def handler(kind: str) -> Callable[[Handler], Handler]:
+    """
+    Декоратор: регистрирует обработчик задач указанного типа
+
+    :param kind: тип задачи
+    """
+
+    def decorator(func: Handler) -> Handler:
+        HANDLERS[kind] = func
+        return func
+
+    return decorator
+
+
+def parse_concurrency(value: str) -> Dict[str, int]:
+    """
+    Разбирает лимиты одновременных задач вида "create_channel=1,send_dm=2"
+
+    :param value: строка из config.TASK_CONCURRENCY
+    :return: лимит для каждого типа задач
+    """
+    limits = {}
+    for item in value.split(","):
+        if item.strip():
+            kind, limit = item.split("=")
+            limits[kind.strip()] = int(limit)
+    return limits
+
+
+def enqueue(kind: str, payload: dict, dedup_key: str = None, delay: int = 0) -> bool:
+    """
+    Ставит задачу в очередь
+
+    :param kind: тип задачи
+    :param payload: параметры задачи
+    :param dedup_key: ключ уникальности задачи
+    :param delay: через сколько секунд задачу можно выполнять
+    :return: True, если задача поставлена
+    """
+    return data.enqueue_task(
+        kind,
+        payload,
+        dedup_key=dedup_key,
+        run_after=datetime.now() + timedelta(seconds=delay),
+        max_attempts=config.TASK_MAX_ATTEMPTS,
+    )
+
+
+def chat_party(chat_id: int) -> str:
+    """
+    Часть ключа уникальности задач чата. Канал из пула (см. channel_pool) сохраняет chat_id,
+    поэтому в ключ входит и запись текущего чата в канале (chats.id), как в ключах уведомлений outbox
+
+    :param chat_id: id чата
+    :return: "<chat_id>:<id записи чата>"
+    """
+    return f"{chat_id}:{data.get_chat(chat_id).id}"
+
+
+def enqueue_party(bdayer_id: int, send_invites: bool = False) -> bool:
+    """
+    Ставит в очередь создание чата для именинника. Остальные шаги ставятся по цепочке.
+    Ключ уникальности включает дату, поэтому повторное планирование в тот же день ничего не добавит
+
+    :param bdayer_id: tg_id именинника
+    :param send_invites: отправлять ли ссылку в ЛС тем, кого не удалось добавить
+    :return: True, если задача поставлена
+    """
+    return enqueue(
+        "create_channel",
+        {"bdayer_id": bdayer_id, "send_invites": send_invites},
+        dedup_key=f"create_channel:{bdayer_id}:{datetime.now().date()}",
+    )
+
+
+def enqueue_cleanup(chat_ids: Iterable[int]) -> int:
+    """
+    Ставит в очередь удаление чатов
+
+    :param chat_ids: id чатов
+    :return: количество поставленных задач
+    """
+    return sum(
+        enqueue(
+            "delete_channel", {"chat_id": chat_id}, dedup_key=f"delete_channel:{chat_party(chat_id)}"
+        )
+        for chat_id in chat_ids
+    )
+
+
+def make_party_maker(client: TelegramClient, payload: dict, digest: AdminDigest) -> PartyMaker:
+    global _warmed_up
+    pm = PartyMaker(
+        client,
+        config.MAIN_CHAT_ID,
+        data.get_user(payload["bdayer_id"]),
+        digest,
+        warm_up=not _warmed_up,
+    )
+    _warmed_up = True
+
+    if "chat_id" in payload:
+        pm.attach_channel(payload["chat_id"])
+    return pm
+
+
+@handler("create_channel")
+def create_channel(client: TelegramClient, payload: dict, digest: AdminDigest) -> None:
+    bdayer_id = payload["bdayer_id"]
+
+    # Если прошлая попытка успела создать чат, продолжаем с ним, а не создаем второй
+    existing = data.get_active_chats_for_user(bdayer_id)
+    recycled = False
+    if existing:
+        chat_id = existing[0].chat_id
+        logging.info("Чат для именинника %s уже создан: %s", bdayer_id, chat_id)
+    else:
+        pm = make_party_maker(client, payload, digest)
+        chat_id = pm.create_channel_for_bdayer().id
+        recycled = pm.recycled
+
+    step = {"chat_id": chat_id, "bdayer_id": bdayer_id}
+    party = chat_party(chat_id)
+    # У канала из пула аватарка уже есть
+    if not recycled:
+        enqueue("edit_photo", step, dedup_key=f"edit_photo:{party}")
+    enqueue("setup_admins", step, dedup_key=f"setup_admins:{party}")
+    enqueue(
+        "invite_batch",
+        {**step, "batch": 0, "send_invites": payload.get("send_invites", False)},
+        dedup_key=f"invite_batch:{party}:0",
+        delay=10,
+    )
+
+
+@handler("edit_photo")
+def edit_photo(client: TelegramClient, payload: dict, digest: AdminDigest) -> None:
+    make_party_maker(client, payload, digest).edit_channel_photo()
+
+
+@handler("setup_admins")
+def setup_admins(client: TelegramClient, payload: dict, digest: AdminDigest) -> None:
+    pm = make_party_maker(client, payload, digest)
+    pm.invite_admins()
+    pm.grant_channel_admin_rights()
+
+
+@handler("invite_batch")
+def invite_batch(client: TelegramClient, payload: dict, digest: AdminDigest) -> None:
+    pm = make_party_maker(client, payload, digest)
+    chat_id, batch = payload["chat_id"], payload.get("batch", 0)
+    party = chat_party(chat_id)
+
+    # Следующая пачка берется из очереди приглашений чата по приоритету. Результаты приглашений
+    # записываются в очередь, поэтому при повторе уже приглашенные не попадут в пачку снова
+    processed = pm.invite_users_to_channel(limit=config.TASK_INVITE_BATCH_SIZE)
+
+    if payload.get("send_invites"):
+        added = {user.tg_id for user in pm.successfully_added}
+        for user in processed:
+            if user.tg_id not in added:
+                enqueue(
+                    "send_dm",
+                    {"chat_id": chat_id, "bdayer_id": payload["bdayer_id"], "tg_id": user.tg_id},
+                    dedup_key=f"send_dm:{party}:{user.tg_id}",
+                )
+
+    step = {"chat_id": chat_id, "bdayer_id": payload["bdayer_id"]}
+    if not data.get_pending_invites(chat_id):
+        enqueue("send_intro", step, dedup_key=f"send_intro:{party}")
+        return
+
+    # Если пачка пустая, закончился дневной лимит: продолжаем завтра, а чат уже можно открывать
+    delay = 0
+    if not processed:
+        enqueue("send_intro", step, dedup_key=f"send_intro:{party}")
+        tomorrow = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+        delay = int((tomorrow - datetime.now()).total_seconds())
+
+    enqueue(
+        "invite_batch",
+        {**step, "batch": batch + 1, "send_invites": payload.get("send_invites")},
+        dedup_key=f"invite_batch:{party}:{batch + 1}",
+        delay=delay,
+    )
+
+
+@handler("send_dm")
+def send_dm(client: TelegramClient, payload: dict, digest: AdminDigest) -> None:
+    pm = make_party_maker(client, payload, digest)
+    pm.send_unable_message(data.get_user(payload["tg_id"]))
+    if pm.successfully_invited:
+        data.add_chat_invited(payload["chat_id"])
+
+
+@handler("send_intro")
+def send_intro(client: TelegramClient, payload: dict, digest: AdminDigest) -> None:
+    pm = make_party_maker(client, payload, digest)
+    pm.send_introduction_to_channel()
+
+    chat = data.get_chat(payload["chat_id"])
+    digest.chat_created(
+        chat.chat_title,
+        f"{chat.invite_link} (добавлено: {chat.users_added}, "
+        f"приглашено ссылкой: {chat.users_invited})",
+    )
+
+
+@handler("delete_channel")
+def delete_channel(client: TelegramClient, payload: dict, digest: AdminDigest) -> None:
+    chat = data.get_chat(payload["chat_id"])
+    if not chat.is_active:
+        logging.info("Чат %s уже деактивирован", chat.chat_id)
+        return
+
+    PartyCleaner(client, digest).retire_channel(chat.chat_id)
+    digest.chat_deleted(chat.chat_title or str(chat.chat_id))
+
+
+class Worker:
+    """
+    Выполняет задачи из очереди. Воркеров можно запускать несколько, на разных хостах:
+    задача захватывается в аренду, а задачи упавшего воркера после окончания аренды берет другой
+    """
+
+    def __init__(self, client: TelegramClient, kinds: Iterable[str] = None):
+        self.client = client
+        self.kinds: List[str] = list(kinds or HANDLERS)
+        self.worker_id: str = f"{socket.gethostname()}:{os.getpid()}"
+        self.concurrency: Dict[str, int] = parse_concurrency(config.TASK_CONCURRENCY)
+        self.digest = AdminDigest()
+        self.stop_event = threading.Event()
+
+    def stop(self, signum=None, frame=None) -> None:
+        """
+        Просит воркер остановиться. Текущая задача доработает до конца
+
+        :return: None
+        """
+        logging.info("Получен сигнал %s, останавливаемся после текущей задачи", signum)
+        self.stop_event.set()
+
+    def run_task(self, task: QueuedTask) -> bool:
+        """
+        Выполняет задачу. При ошибке задача возвращается в очередь с задержкой
+
+        :param task: захваченная задача
+        :return: True, если задача выполнена
+        """
+        logging.info("Выполняем задачу %s #%s (попытка %s): %s", task.kind, task.id, task.attempts, task.payload)
+        try:
+            with metrics.stage(f"task:{task.kind}"):
+                HANDLERS[task.kind](self.client, task.payload, self.digest)
+
+        # PartyMaker завершает процесс через sys.exit, если не удалось создать чат
+        except (Exception, SystemExit) as e:
+            retry_at = data.fail_task(task.id, repr(e), config.TASK_BACKOFF_SECONDS)
+            if retry_at is None:
+                logging.exception("Задача %s #%s окончательно провалилась: %s", task.kind, task.id, e)
+                self.digest.failure(f"Задача {task.kind} {task.payload} не выполнена: {e}")
+            else:
+                logging.info("Задача %s #%s упала, повтор в %s. Ошибка: %s", task.kind, task.id, retry_at, e)
+            return False
+
+        data.complete_task(task.id)
+        return True
+
+    def run_once(self) -> int:
+        """
+        Выполняет все задачи, срок которых наступил
+
+        :return: количество выполненных задач (включая упавшие)
+        """
+        done = 0
+        claimed = True
+        while claimed and not self.stop_event.is_set():
+            claimed = False
+            for kind in self.kinds:
+                task = data.claim_task(
+                    kind, self.worker_id, self.concurrency.get(kind, 1), config.TASK_LEASE_SECONDS
+                )
+                if task is not None:
+                    claimed = True
+                    self.run_task(task)
+                    done += 1
+
+        if done:
+            self.digest.send(self.client)
+        return done
+
+    def run_forever(self) -> None:
+        """
+        Выполняет задачи, пока не попросят остановиться. При пустой очереди ждет config.TASK_POLL_INTERVAL
+
+        :return: None
+        """
+        logging.info("Воркер %s запущен. Типы задач: %s", self.worker_id, self.kinds)
+        while not self.stop_event.is_set():
+            if self.run_once() == 0:
+                self.stop_event.wait(config.TASK_POLL_INTERVAL)
+
+        logging.info("Воркер %s остановлен", self.worker_id)
+
+
+def plan(send_invites: bool = False) -> None:
+    """
+    Ставит в очередь создание и удаление чатов на сегодня
+
+    :param send_invites: отправлять ли ссылку на чат в ЛС
+    :return: None
+    """
+    for bdayer_id in planning.plan_creations():
+        enqueue_party(bdayer_id, send_invites)
+    enqueue_cleanup(planning.plan_cleanup())
+
+
+def work(kinds: Iterable[str] = None, once: bool = False) -> None:
+    """
+    Запускает воркер
+
+    :param kinds: типы задач, по умолчанию все
+    :param once: выполнить готовые задачи и выйти, иначе работать до SIGTERM/SIGINT
+    :return: None
+    """
+    unknown = sorted(set(kinds or ()) - set(HANDLERS))
+    if unknown:
+        raise ValueError(f"Неизвестные типы задач: {unknown}. Доступны: {sorted(HANDLERS)}")
+
+    dog_client = signin(config.BOT_API_ID, config.BOT_API_HASH)
+
+    with dog_client:
+        worker = Worker(dog_client, kinds)
+        if once:
+            with record_run("worker"):
+                worker.run_once()
+            metrics.write_textfile("worker")
+        else:
+            if config.METRICS_PORT:
+                metrics.serve(config.METRICS_PORT)
+            signal.signal(signal.SIGTERM, worker.stop)
+            signal.signal(signal.SIGINT, worker.stop)
+            worker.run_forever()
+
+
+if __name__ == "__main__":
+    import cli
+
+    args = cli.parse_args(["queue", *sys.argv[1:]])
+    if args.action == "plan":
+        plan(args.send_invites)
+    else:
+        work(args.kind, args.once)
+    sys.exit(0)
@@ -0,0 +1,146 @@
+import asyncio
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from telethon.sync import TelegramClient
+
+import config
+import data
+import metrics
+from daemon import clean_duty, events_duty, invite_duty, make_duty, reconcile_duty, stats_duty
+from digest import AdminDigest
+from logger import logging
+from models import Tenant
+from runs import record_run
+from utils import signin
+
+Job = Callable[[TelegramClient, AdminDigest], None]
+
+JOBS: Dict[str, Job] = {
+    "make": make_duty,
+    "clean": clean_duty,
+    "reconcile": reconcile_duty,
+    "stats": stats_duty,
+    "events": events_duty,
+    "invite": invite_duty,
+}
+
+
+def tenant_settings(tenant: Tenant) -> Dict[str, Any]:
+    """
+    Настройки арендатора поверх общих. Незаполненные поля берутся из .env
+
+    :param tenant: арендатор
+    :return: значения для config.override
+    """
+    values = {
+        "TENANT_ID": tenant.id,
+        "MAIN_CHAT_ID": tenant.main_chat_id,
+        "ADMIN_IDS": tenant.admin_ids,
+        "CARD_NUMBER": tenant.card_number,
+        "SESSION_NAME": tenant.session_name,
+        "DAYS_BEFORE": tenant.days_before,
+        "DAYS_AFTER": tenant.days_after,
+    }
+    return {name: value for name, value in values.items() if value is not None}
+
+
+def run_tenant(tenant: Tenant, command: str, job: Job) -> bool:
+    """
+    Выполняет задачу для одного арендатора с его настройками и его телеграм-аккаунтом.
+    Ошибка одного арендатора не мешает остальным
+
+    :param tenant: арендатор
+    :param command: имя задачи
+    :param job: задача
+    :return: True, если задача выполнена без ошибок
+    """
+    with config.override(**tenant_settings(tenant)):
+        digest = AdminDigest()
+        with signin(config.BOT_API_ID, config.BOT_API_HASH) as client:
+            try:
+                with record_run(f"{command}:{tenant.name}"):
+                    job(client, digest)
+                return True
+
+            # PartyMaker завершает процесс через sys.exit, если не удалось создать чат
+            except (Exception, SystemExit) as e:
+                logging.exception("Задача %s арендатора %s завершилась с ошибкой: %s", command, tenant.name, e)
+                digest.failure(f"Задача {command} завершилась с ошибкой: {e}")
+                return False
+
+            finally:
+                digest.send(client)
+
+
+def run_account(tenants: List[Tenant], command: str, job: Job) -> Dict[str, bool]:
+    """
+    Выполняет задачу по очереди для арендаторов, которые работают через один телеграм-аккаунт
+
+    :return: результат по имени арендатора
+    """
+    # У каждого потока свой цикл событий: клиент телеграма привязывается к нему при создании
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return {tenant.name: run_tenant(tenant, command, job) for tenant in tenants}
+    finally:
+        loop.close()
+
+
+def run_all(command: str, tenants: List[Tenant] = None) -> Dict[str, bool]:
+    """
+    Выполняет задачу для всех активных арендаторов. Арендаторы с разными телеграм-аккаунтами
+    работают одновременно, каждый со своими паузами и лимитами телеграма.
+    Арендаторы одного аккаунта выполняются последовательно, чтобы не делить между собой его лимиты
+
+    :param command: имя задачи из JOBS
+    :param tenants: арендаторы, по умолчанию все активные
+    :return: результат по имени арендатора
+    """
+    if tenants is None:
+        tenants = data.get_tenants()
+
+    accounts = defaultdict(list)
+    for tenant in tenants:
+        accounts[tenant.session_name or config.SESSION_NAME].append(tenant)
+
+    logging.info("Запускаем %s для %s арендаторов (%s аккаунтов)", command, len(tenants), len(accounts))
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(accounts))) as pool:
+        futures = [
+            pool.submit(run_account, account_tenants, command, JOBS[command])
+            for account_tenants in accounts.values()
+        ]
+        for future in futures:
+            results.update(future.result())
+
+    logging.info("Результаты %s по арендаторам: %s", command, results)
+    return results
+
+
+def run_job(command: str) -> bool:
+    """
+    Запускает задачу для всех арендаторов и записывает метрики
+
+    :param command: задача из JOBS
+    :return: True, если задача выполнена для всех арендаторов
+    """
+    if command not in JOBS:
+        raise ValueError(f"Неизвестная задача {command}. Доступны: {sorted(JOBS)}")
+
+    try:
+        results = run_all(command)
+    finally:
+        metrics.write_textfile(f"tenants_{command}")
+    return all(results.values())
+
+
+if __name__ == "__main__":
+    import cli
+
+    args = cli.parse_args(["tenants", *sys.argv[1:]])
+    sys.exit(0 if run_job(args.job) else 1)
@@ -49,3 +49,968 @@ def test_get_birthday_users():
 
     assert bdayer_1 not in fb.birthday_users
     assert bdayer_2 in fb.birthday_users
+
+
+class FakeParticipant:
+    def __init__(self, tg_id, first_name=None):
+        self.id = tg_id
+        self.username = None
+        self.first_name = first_name
+        self.last_name = None
+
+
+class FakeClient:
+    def __init__(self, participants):
+        self.participants = participants
+
+    def get_me(self):
+        return FakeParticipant(1)
+
+    def iter_participants(self, chat_id, aggressive=False):
+        return iter(self.participants)
+
+
+def test_chat_tools_diffs(monkeypatch):
+    from src import utils
+
+    monkeypatch.setattr(utils.data, "get_all_user_ids", lambda: {55555, 666666, 7777777})
+    monkeypatch.setattr(utils.data, "get_active_users", lambda: test_users)
+
+    participants = [FakeParticipant(1), FakeParticipant(55555), FakeParticipant(42, "Новый")]
+    ct = utils.ChatTools(FakeClient(participants), chat_id=100)
+
+    assert ct.users_in_chat_ids == {55555, 42}
+    assert [u.tg_id for u in ct.find_db_users_not_in_chat()] == [666666, 7777777]
+    assert [u.id for u in ct.find_chat_users_not_in_db()] == [42]
+
+
+def test_admin_digest_chunks():
+    from src.digest import AdminDigest
+
+    digest = AdminDigest()
+    for i in range(300):
+        digest.user_departed(f"Пользователь{i}", "Фамилия" * 3)
+    digest.failure("x" * 5000)
+
+    chunks = digest.chunks(limit=4096)
+    assert all(len(chunk) <= 4096 for chunk in chunks)
+    assert "".join(chunks).replace("\n", "") == digest.render().replace("\n", "")
+    assert len(chunks) < 10
+
+
+def test_find_regressions():
+    from src.models import Run
+    from src.runs import find_regressions, runs_table
+
+    runs = [
+        Run(id=i, command=command, started_at=None, status="ok", duration=duration, sleep_seconds=10,
+            api_calls_total=100, stages={"invite_users": {"seconds": invite, "count": 1}})
+        for i, (command, duration, invite) in enumerate(
+            [("main", 900, 600), ("events", 30, 5), ("main", 950, 620), ("events", 40, 6), ("main", 2400, 2000)],
+            start=1,
+        )
+    ]
+    regressions = find_regressions(runs_table(runs))
+
+    # Быстрые запуски events не делают обычный запуск main регрессией и наоборот
+    assert list(regressions.index) == [("main", "invite_users"), ("main", "total")]
+
+
+def test_outbox_dispatcher_marks_messages(monkeypatch):
+    import asyncio
+    import threading
+
+    from src import outbox
+    from src.data import PendingMessage
+
+    batches = [[PendingMessage(1, 100, "a", 0), PendingMessage(2, 200, "b", 0)]]
+    sent, failed, threads = [], [], set()
+
+    def mark_sent(i):
+        threads.add(threading.get_ident())
+        sent.append(i)
+
+    def mark_failed(i, e, m, b, min_delay=0):
+        threads.add(threading.get_ident())
+        failed.append(i)
+
+    monkeypatch.setattr(outbox.data, "claim_outbox", lambda limit, lease: batches.pop() if batches else [])
+    monkeypatch.setattr(outbox.data, "mark_outbox_sent", mark_sent)
+    monkeypatch.setattr(outbox.data, "mark_outbox_failed", mark_failed)
+
+    class Client:
+        loop = asyncio.new_event_loop()
+
+        async def send_message(self, chat_id, text):
+            if chat_id == 200:
+                raise ValueError("blocked")
+
+    dispatcher = outbox.OutboxDispatcher(Client())
+    dispatcher.min_interval = 0
+
+    assert dispatcher.drain() == 1
+    assert sent == [1] and failed == [2]
+    # Запись в БД идет не в потоке цикла событий
+    assert threading.get_ident() not in threads
+
+
+def test_worker_completes_and_retries_tasks(monkeypatch):
+    from src import taskqueue
+    from src.data import QueuedTask
+
+    queue = {"ok": [QueuedTask(1, "ok", {}, 1)], "boom": [QueuedTask(2, "boom", {}, 1)]}
+    done, failed = [], []
+    monkeypatch.setitem(taskqueue.HANDLERS, "ok", lambda client, payload, digest: None)
+    monkeypatch.setitem(taskqueue.HANDLERS, "boom", lambda client, payload, digest: 1 / 0)
+    monkeypatch.setattr(
+        taskqueue.data, "claim_task",
+        lambda kind, worker, limit, lease: queue[kind].pop() if queue[kind] else None,
+    )
+    monkeypatch.setattr(taskqueue.data, "complete_task", done.append)
+    monkeypatch.setattr(taskqueue.data, "fail_task", lambda i, e, b: failed.append(i))
+
+    worker = taskqueue.Worker(client=None, kinds=["ok", "boom"])
+    monkeypatch.setattr(worker.digest, "send", lambda client: None)
+
+    assert worker.run_once() == 2
+    assert done == [1] and failed == [2]
+
+
+def test_occupancy_timeline_wraps_year_and_leap_day():
+    from datetime import date
+
+    import numpy as np
+
+    from src.forecast import find_shortfalls, occupancy_timeline
+
+    # ДР 31 декабря и 2 января, прогноз с середины декабря: окна переходят через новый год
+    timeline = occupancy_timeline(np.array([12, 1]), np.array([31, 2]), date(2026, 12, 15), 30, 7, 2)
+    assert timeline[str(date(2026, 12, 24))] == 1
+    assert timeline.max() == 2
+    assert find_shortfalls(timeline, 1)[0][:2] == (date(2026, 12, 26), date(2027, 1, 2))
+
+    # 29 февраля в невисокосный год празднуется 28-го
+    timeline = occupancy_timeline(np.array([2]), np.array([29]), date(2027, 2, 1), 40, 0, 0)
+    assert timeline[timeline > 0].index[0].date() == date(2027, 2, 28)
+
+
+def test_participation_collector_skips_failed_chats():
+    import asyncio
+
+    from src.stats import ParticipationCollector
+
+    class Full:
+        def __init__(self, count):
+            self.full_chat = type("ChannelFull", (), {"participants_count": count})
+
+    class Client:
+        loop = asyncio.new_event_loop()
+
+        async def __call__(self, request):
+            if request.channel.channel_id == 2:
+                raise ValueError("private")
+            return Full(request.channel.channel_id * 10)
+
+    assert ParticipationCollector(Client()).collect([1, 2, 3]) == {1: 10, 3: 30}
+
+
+def test_invite_skips_unreachable_users(monkeypatch):
+    from telethon.errors.rpcerrorlist import UserPrivacyRestrictedError
+
+    from src import partymaker
+
+    saved, messaged, invited = {}, [], []
+    monkeypatch.setattr(partymaker.data, "get_unreachable_user_ids", lambda: {666666})
+    monkeypatch.setattr(partymaker.data, "save_invitability", lambda outcomes, ttl: saved.update(outcomes))
+    monkeypatch.setattr(partymaker.pacing, "pause_between", lambda minmax: None)
+
+    def client(request):
+        invited.append(request.users[0])
+        if request.users[0] == 7777777:
+            raise UserPrivacyRestrictedError(request)
+
+    pm = object.__new__(partymaker.PartyMaker)
+    pm.client, pm.channel = client, type("Channel", (), {"id": 1})
+    pm.repo = type("Repo", (), {"chat_update": lambda self, *args, **kwargs: None})()
+    pm.successfully_added, pm.successfully_invited = [], []
+    pm.added_before = pm.invited_before = 0
+    pm.sleep_minmax = (0, 0)
+    pm.send_unable_message = lambda user: messaged.append(user.tg_id)
+
+    pm.invite_users_to_channel(send_invites=True, invite_list=test_users)
+
+    assert invited == [55555, 7777777]
+    assert saved == {55555: None, 7777777: "UserPrivacyRestrictedError"}
+    assert messaged == [7777777, 666666]
+
+
+def test_config_override_is_scoped():
+    from concurrent.futures import ThreadPoolExecutor
+
+    from src import config
+
+    with config.override(MAIN_CHAT_ID=42, TENANT_ID=2):
+        assert config.MAIN_CHAT_ID == 42
+        # Настройки арендатора не видны в других потоках
+        with ThreadPoolExecutor(1) as pool:
+            assert pool.submit(lambda: config.TENANT_ID).result() == 1
+
+    assert config.TENANT_ID == 1
+
+
+def test_chat_archiver_streams_and_dedups_media(monkeypatch, tmp_path):
+    import asyncio
+    import gzip
+    import json
+    import os
+    from datetime import datetime
+    from types import SimpleNamespace
+
+    from src import archive
+
+    photo = SimpleNamespace(id=7)
+    file = SimpleNamespace(size=3, ext=".jpg")
+
+    def message(message_id, media=None):
+        return SimpleNamespace(
+            id=message_id, date=datetime(2026, 1, 1), sender_id=1, message=f"text {message_id}",
+            reply_to_msg_id=None, action=None, media=media, file=file if media else None,
+            photo=photo if media else None, document=None,
+        )
+
+    class Client:
+        loop = asyncio.new_event_loop()
+        downloads = 0
+
+        async def iter_messages(self, peer, reverse):
+            for m in (message(1), message(2, media=photo), message(3, media=photo)):
+                yield m
+
+        async def download_media(self, message, file):
+            Client.downloads += 1
+            return b"img"
+
+    records = {}
+    monkeypatch.setattr(archive.data, "get_archived_chat_ids", lambda chat_ids: set())
+    monkeypatch.setattr(archive.data, "start_archive", lambda chat_id, path: chat_id)
+    monkeypatch.setattr(archive.data, "finish_archive", lambda i, status, *result, **kw: records.update({i: (status, result)}))
+
+    archiver = archive.ChatArchiver(Client())
+    archiver.directory, archiver.media = str(tmp_path), "dedup"
+
+    assert archiver.archive_all([5]) == {5}
+    assert records[5][0] == "done" and records[5][1][:2] == (3, 2)
+    assert Client.downloads == 1
+
+    path = next(p for p in tmp_path.iterdir() if p.name.endswith(".jsonl.gz"))
+    lines = [json.loads(line) for line in gzip.open(path, "rt", encoding="utf-8")]
+    assert [line["id"] for line in lines] == [1, 2, 3]
+    assert lines[1]["media_file"] == lines[2]["media_file"]
+    assert os.listdir(tmp_path / "media") == [os.path.basename(lines[1]["media_file"])]
+
+
+def test_birthday_window_doys_wraps_year_and_leap_day():
+    from datetime import date
+
+    from src.data import birthday_window_doys
+
+    # 30 декабря: окно с 29.12 по 06.01, дни года по високосному календарю
+    assert birthday_window_doys(date(2026, 12, 30), 7, 2) == [1, 2, 3, 4, 5, 6, 364, 365, 366]
+    # В невисокосный год ДР 29 февраля попадает в окно вместе с 28-м
+    assert 60 in birthday_window_doys(date(2027, 2, 21), 7, 2)
+    assert 60 not in birthday_window_doys(date(2027, 2, 20), 7, 2)
+
+
+def test_repository_keeps_snapshot_consistent(monkeypatch):
+    from src import repository
+    from src.models import BankAccount, Chat
+
+    chat = Chat(id=10, chat_id=1, bdayer_id=55555, is_active=True)
+    account = BankAccount(link="acc", used_in=10)
+    users = [User(tg_id=user.tg_id, is_active=True) for user in test_users]
+    monkeypatch.setattr(repository.data, "get_all_users", lambda: users)
+    monkeypatch.setattr(repository.data, "get_active_chats", lambda: [chat])
+    monkeypatch.setattr(repository.data, "get_bank_accounts", lambda: [account])
+    monkeypatch.setattr(repository.data, "deactivate_chat", lambda chat_id: None)
+    monkeypatch.setattr(repository.data, "deactivate_users", lambda tg_ids: len(tg_ids))
+
+    repo = repository.Repository()
+    assert repo.chat_bdayer(1).tg_id == 55555
+    assert repo.get_account_link(1) == "acc"
+
+    repo.deactivate_chat(1)
+    repo.deactivate_users([666666])
+
+    assert repo.active_chats() == [] and repo.active_chats_for_user(55555) == []
+    assert account.used_in is None
+    assert [user.tg_id for user in repo.active_users()] == [55555, 7777777]
+
+    # Окно дней рождения фильтруется в БД, но деактивация из снимка учитывается
+    window = [User(tg_id=666666, is_active=True), User(tg_id=55555, is_active=True)]
+    monkeypatch.setattr(repository.data, "get_birthday_window_users", lambda before, after, today: window)
+    assert [user.tg_id for user in repo.birthday_window_users()] == [55555]
+
+
+def test_retire_channel_recycles_or_falls_back_to_delete(monkeypatch):
+    from src import partycleaner
+
+    released, deleted, deactivated = [], [], []
+    monkeypatch.setattr(partycleaner.data, "release_channel", released.append)
+
+    pc = object.__new__(partycleaner.PartyCleaner)
+    pc.repo = type("Repo", (), {"deactivate_chat": lambda self, chat_id: deactivated.append(chat_id)})()
+    pc.delete_channel = deleted.append
+    pc.recycle_channel = lambda channel_id: channel_id == 1
+
+    with partycleaner.config.override(CHANNEL_RECYCLING=True):
+        pc.retire_channel(1)
+        pc.retire_channel(2)
+
+    assert released == [1]
+    assert deleted == [2]
+    assert deactivated == [1, 2]
+
+
+def test_next_invitees_follow_priority_within_budget(monkeypatch):
+    from src import partymaker
+
+    users = [
+        User(tg_id=1, is_active=True, tags=["sales"]),
+        User(tg_id=2, is_active=True, tags=["dev"]),
+        User(tg_id=3, is_active=True),
+        User(tg_id=4, is_active=True),
+    ]
+    queue, saved = {}, {}
+    monkeypatch.setattr(partymaker.data, "get_past_participation", lambda: {4: 2})
+    monkeypatch.setattr(partymaker.data, "queue_chat_invites", lambda chat_id, priorities: queue.update(priorities))
+    monkeypatch.setattr(
+        partymaker.data,
+        "get_pending_invites",
+        lambda chat_id: sorted([*queue, 5], key=lambda tg_id: (-queue.get(tg_id, 0), tg_id)),
+    )
+    monkeypatch.setattr(partymaker.data, "save_invite_results", lambda chat_id, results: saved.update(results))
+    monkeypatch.setattr(partymaker.data, "count_invites_attempted_since", lambda since: 1)
+
+    pm = object.__new__(partymaker.PartyMaker)
+    pm.channel = type("Channel", (), {"id": 1})
+    pm.bdayer = User(tg_id=9, tags=["dev"])
+    pm.make_invite_list = lambda: users
+
+    with partymaker.config.override(INVITE_DAILY_BUDGET=3, INVITE_PRIORITY_TAGS="sales"):
+        invitees = pm.next_invitees(unreachable_ids={3})
+
+    # Коллега именинника первым, недоступный пользователь не расходует лимит
+    assert [user.tg_id for user in invitees] == [2, 1, 3]
+    assert saved == {5: ("skipped", "inactive")}
+
+
+def test_stage_graph_overlaps_local_stages_and_skips_done():
+    import threading
+
+    import pytest
+
+    from src.stages import Stage, StageGraph
+
+    calls, local_started = [], threading.Event()
+
+    def local():
+        local_started.set()
+        calls.append(("local", threading.current_thread() is threading.main_thread()))
+
+    def api():
+        # Локальный этап идет параллельно с этапом API
+        assert local_started.wait(5)
+        calls.append(("api", threading.current_thread() is threading.main_thread()))
+
+    graph = StageGraph(
+        "test",
+        [
+            Stage("create", lambda: calls.append(("create", True))),
+            Stage("skipped", lambda: calls.append(("skipped", True)), after=("create",), done=lambda: True),
+            Stage("api", api, after=("skipped",)),
+            Stage("local", local, after=("create",), local=True),
+            Stage("last", lambda: calls.append(("last", True)), after=("api", "local")),
+        ],
+    )
+    graph.run()
+
+    assert calls == [("create", True), ("local", False), ("api", True), ("last", True)]
+    assert graph.skipped == {"skipped"}
+
+    failing = StageGraph(
+        "test",
+        [Stage("boom", lambda: 1 / 0), Stage("after", lambda: calls.append("after"), after=("boom",))],
+    )
+    with pytest.raises(ZeroDivisionError):
+        failing.run()
+    assert "after" not in calls
+
+
+@freeze_time("2026-12-30 12:00:00")
+def test_events_follow_birthday_window_across_year_end():
+    from datetime import date, datetime
+
+    from src import config, events
+
+    with config.override(DAYS_BEFORE=7, DAYS_AFTER=2, EVENT_HOUR=10):
+        # Окно чата (24.12 - 01.01) уже открыто: создание наступает сразу
+        user = User(tg_id=1, birth_day=31, birth_month=12)
+        (create,) = events.user_events(user, date(2026, 12, 30))
+        assert create["dedup_key"] == "create_chat:1:2026-12-31"
+        assert create["due_at"] <= datetime.now()
+
+        # Окно уже закрыто: следующее создание - через год
+        (create,) = events.user_events(User(tg_id=2, birth_day=27, birth_month=12), date(2026, 12, 30))
+        assert create["due_at"] == datetime(2027, 12, 20, 10)
+
+        due = {event["kind"]: event["due_at"] for event in events.chat_events(5, user, date(2026, 12, 24))}
+        assert due == {
+            "birthday_notice": datetime(2026, 12, 31, 10),
+            "deletion_warning": datetime(2027, 1, 1, 10),
+            "delete_chat": datetime(2027, 1, 2, 10),
+        }
+
+
+def test_rate_budget_is_shared_through_file(monkeypatch, tmp_path):
+    import pytest
+
+    from src import ratelimit
+
+    limits = ratelimit.parse_limits("invite=1/10, default=3/1")
+    assert limits == {"invite": (0.1, 1.0), "default": (3.0, 3.0)}
+
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, "time", lambda: now[0])
+
+    # Два "процесса" с одним файлом делят одно ведро
+    first, second = ratelimit.FileBudget(tmp_path / "rate.json"), ratelimit.FileBudget(tmp_path / "rate.json")
+    assert first.take("dog:invite", *limits["invite"]) == 0
+    assert second.take("dog:invite", *limits["invite"]) == pytest.approx(10)
+    assert first.take("dog:invite", *limits["invite"]) == pytest.approx(20)
+    assert first.take("other:invite", *limits["invite"]) == 0
+
+    # Через 30 секунд долг погашен, а ведро не наполняется больше своего размера
+    now[0] += 30
+    assert second.take("dog:invite", *limits["invite"]) == 0
+    assert ratelimit.take_token(0, 0, 100, 0.1, 1) == (0, 0)
+
+
+def test_cli_starts_without_heavy_imports():
+    import json
+    import subprocess
+    import sys
+    from pathlib import Path
+
+    import pytest
+
+    from src import cli, taskqueue, tenants
+
+    # Справка и разбор аргументов не должны загружать telethon, SQLAlchemy и pandas
+    code = (
+        "import json, sys\n"
+        "import cli\n"
+        "cli.parse_args(['forecast', '--days', '30', '--before', '5,7'])\n"
+        "heavy = [m for m in ('telethon', 'sqlalchemy', 'pandas', 'numpy', 'dotenv') if m in sys.modules]\n"
+        "import data\n"
+        "print(json.dumps({'heavy': heavy, 'telethon': 'telethon' in sys.modules}))\n"
+    )
+    src = Path(cli.__file__).parent
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=src, capture_output=True, text=True, check=True
+    )
+    report = json.loads(result.stdout.splitlines()[-1])
+
+    assert report["heavy"] == []
+    # init-db и отчеты работают с БД без telethon
+    assert report["telethon"] is False
+
+    # Списки задач не дублируются в cli: неизвестные значения отклоняют сами модули
+    with pytest.raises(ValueError):
+        taskqueue.work(["no_such_kind"])
+    with pytest.raises(ValueError):
+        tenants.run_job("no_such_job")
+
+
+def test_task_keys_follow_recycled_channel_chat(monkeypatch):
+    from src import taskqueue
+    from src.models import Chat
+
+    parties = [3, 8]
+    keys = []
+    monkeypatch.setattr(taskqueue.data, "get_chat", lambda chat_id: Chat(id=parties[0], chat_id=chat_id))
+    monkeypatch.setattr(
+        taskqueue.data, "enqueue_task", lambda kind, payload, dedup_key, **kw: keys.append(dedup_key) or True
+    )
+
+    # Новый чат в канале из пула - новая запись в chats, и его задачи не совпадают с задачами прошлого
+    taskqueue.enqueue_cleanup([7])
+    parties.pop(0)
+    taskqueue.enqueue_cleanup([7])
+    assert keys == ["delete_channel:7:3", "delete_channel:7:8"]
+
+
+def test_recycled_channel_keeps_previous_chat(monkeypatch):
+    from sqlalchemy import create_engine, select
+    from sqlalchemy.orm import Session
+
+    from src import data
+    from src.models import BankAccount, Base, Chat, ChatArchive
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine, tables=[Chat.__table__, BankAccount.__table__, ChatArchive.__table__])
+    monkeypatch.setattr(data.config, "get_engine", lambda: engine)
+
+    with Session(engine) as session:
+        session.add_all([BankAccount(link="acc1", owner_id=1), BankAccount(link="acc2", owner_id=1)])
+        session.commit()
+
+    data.chat_create(7, "l1", 55555, "Ваня")
+    assert data.get_account_link(7) == "acc1"
+    data.chat_update(7, added=5)
+    data.finish_archive(data.start_archive(7, "a"), "done")
+    data.deactivate_chat(7)
+
+    # Канал из пула получает новую запись, прошлый чат со статистикой и счетом остается в истории
+    data.chat_create(7, "l2", 666666, "Леша")
+    assert data.get_chat(7).bdayer_id == 666666
+    assert data.get_account_link(7) == "acc1"
+    with Session(engine) as session:
+        chats = session.execute(select(Chat).order_by(Chat.id)).scalars().all()
+        assert [(c.chat_id, c.bdayer_id, c.users_added, c.is_active) for c in chats] == [
+            (7, 55555, 5, False),
+            (7, 666666, 0, True),
+        ]
+        assert session.get(BankAccount, "acc1").used_in == chats[1].id
+
+    # Архив прошлого чата в канале не считается архивом текущего
+    assert data.get_archived_chat_ids([7]) == set()
+    data.finish_archive(data.start_archive(7, "b"), "done")
+    assert data.get_archived_chat_ids([7]) == {7}
+
+
+def test_instrument_client_keeps_telethon_flood_handling():
+    import asyncio
+
+    import pytest
+    from telethon import errors
+
+    from src import metrics
+
+    import logging
+
+    class Client:
+        flood_sleep_threshold = 60
+        _log = {"telethon.client.users": logging.getLogger("telethon.client.users")}
+
+        def __init__(self):
+            self.thresholds = []
+
+        async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+            self.thresholds.append(flood_sleep_threshold)
+            # Короткое ожидание Telethon пережидает сам и только пишет об этом в лог
+            self._log["telethon.client.users"].info(
+                metrics.FLOOD_SLEEP_MESSAGE, "", 5, None, type(request).__name__
+            )
+            raise errors.FloodWaitError(request=None, capture=300)
+
+    class PingRequest:
+        pass
+
+    def count(waited):
+        return metrics.TELEGRAM_FLOOD_WAITS.labels("PingRequest", waited)._value.get()
+
+    client = metrics.instrument_client(Client())
+    metrics.instrument_client(Client())
+    before_waited, before_raised = count("true"), count("false")
+
+    # Ожидание сверх порога Telethon не повторяется в цикле, а учитывается и пробрасывается
+    with pytest.raises(errors.FloodWaitError):
+        asyncio.run(client._call(None, PingRequest()))
+    assert client.thresholds == [None] and client.flood_sleep_threshold == 60
+    assert count("true") == before_waited + 1 and count("false") == before_raised + 1
+
+
+def test_failed_outbox_message_waits_for_backoff(monkeypatch):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    from src import data
+    from src.models import Base, OutboxMessage
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine, tables=[OutboxMessage.__table__])
+    monkeypatch.setattr(data.config, "get_engine", lambda: engine)
+
+    with Session(engine) as session:
+        session.add(OutboxMessage(chat_id=1, kind="birthday", text="a", dedup_key="k"))
+        session.commit()
+
+    with freeze_time("2026-03-01 12:00:00"):
+        (message,) = data.claim_outbox(10, 300)
+        retry_at = data.mark_outbox_failed(message.id, "FloodWaitError", 5, 60, min_delay=90)
+        # Повтор не раньше FloodWait, а не сразу в том же проходе
+        assert str(retry_at) == "2026-03-01 12:01:30"
+        assert data.claim_outbox(10, 300) == []
+
+    with freeze_time("2026-03-01 12:01:30"):
+        (message,) = data.claim_outbox(10, 300)
+        assert message.attempts == 1
+        assert str(data.mark_outbox_failed(message.id, "boom", 5, 60)) == "2026-03-01 12:03:30"
+
+
+def test_rate_limit_takes_tokens_off_the_event_loop(monkeypatch):
+    import asyncio
+    import threading
+
+    from src import ratelimit
+
+    class Budget:
+        def __init__(self):
+            self.threads = []
+
+        def take(self, bucket, rate, capacity):
+            self.threads.append(threading.get_ident())
+            return 0.01
+
+    class Client:
+        async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+            return "ok"
+
+    class InviteToChannelRequest:
+        pass
+
+    budget = Budget()
+    monkeypatch.setattr(ratelimit, "make_budget", lambda: budget)
+    with ratelimit.config.override(RATE_LIMITS="invite=1/10", SESSION_NAME="dog"):
+        client = ratelimit.limit_client(Client())
+
+        async def call():
+            return await client._call(None, InviteToChannelRequest()), threading.get_ident()
+
+        result, loop_thread = asyncio.run(call())
+
+    assert result == "ok"
+    assert budget.threads and loop_thread not in budget.threads
+
+
+def test_db_session_round_trip(monkeypatch):
+    from sqlalchemy import create_engine
+    from sqlalchemy.dialects import sqlite
+    from telethon.crypto import AuthKey
+    from telethon.tl.types import User as TgUser
+
+    from src import session_store
+    from src.models import Base, TelegramEntity, TelegramSession
+
+    class Insert(sqlite.Insert):
+        # INSERT ... ON DUPLICATE KEY UPDATE MySQL через ON CONFLICT SQLite
+        inherit_cache = False
+
+        @property
+        def inserted(self):
+            return self.excluded
+
+        def on_duplicate_key_update(self, **values):
+            keys = [column.name for column in self.table.primary_key]
+            return self.on_conflict_do_update(index_elements=keys, set_=values)
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine, tables=[TelegramSession.__table__, TelegramEntity.__table__])
+    monkeypatch.setattr(session_store.data.config, "get_engine", lambda: engine)
+    monkeypatch.setattr(session_store, "insert", Insert)
+
+    saved = session_store.DBSession("bot")
+    saved.set_dc(2, "149.154.167.51", 443)
+    saved.auth_key = AuthKey(data=bytes(range(256)))
+    saved.process_entities([TgUser(id=42, access_hash=777, username="dog", phone="79990000000")])
+    # Изменившаяся сущность перезаписывается, а не дублируется
+    saved.process_entities([TgUser(id=42, access_hash=888, username="dog", phone="79990000000")])
+
+    # Новый процесс загружает авторизацию и кэш сущностей из БД
+    loaded = session_store.DBSession("bot")
+    assert (loaded.dc_id, loaded.server_address, loaded.port) == (2, "149.154.167.51", 443)
+    assert loaded.auth_key.key == bytes(range(256))
+    assert loaded.get_entity_rows_by_id(42) == (42, 888)
+    assert loaded.get_entity_rows_by_username("dog") == (42, 888)
+    assert loaded.get_entity_rows_by_phone("79990000000") == (42, 888)
+
+    assert loaded.delete()
+    assert session_store.DBSession("bot").auth_key is None
+
+
+def test_settings_from_env_parses_empty_missing_and_typed_values(monkeypatch):
+    import pytest
+
+    from src import config
+
+    monkeypatch.setenv("DB_HOST", "db")
+    monkeypatch.setenv("DB_PORT", "")
+    monkeypatch.setenv("DAYS_BEFORE", "10")
+    monkeypatch.setenv("PACING_SCALE", "0.5")
+    monkeypatch.setenv("EVENTS_ENABLED", "True")
+    monkeypatch.setenv("ADMIN_IDS", "1,2")
+    for name in ("DB_USER", "DB_PASS", "DB_NAME", "BOT_API_ID", "DAYS_AFTER", "CARD_NUMBER"):
+        monkeypatch.delenv(name, raising=False)
+
+    settings = config.Settings.from_env()
+    assert settings.DB_HOST == "db" and settings.ADMIN_IDS == [1, 2]
+    assert (settings.DAYS_BEFORE, settings.PACING_SCALE, settings.EVENTS_ENABLED) == (10, 0.5, True)
+    # Незаданные переменные берут значения по умолчанию
+    assert (settings.DAYS_AFTER, settings.CARD_NUMBER) == (2, "")
+
+    # Пустая числовая переменная считается незаданной, и падает только обращение к ней
+    assert settings.DB_PORT is None
+    assert {"DB_PORT", "DB_USER", "BOT_API_ID"} <= set(settings.missing)
+    assert settings.require("DB_HOST") == "db"
+    with pytest.raises(Exception, match="DB_PORT"):
+        settings.require("DB_PORT")
+    with pytest.raises(Exception, match="DB_USER"):
+        settings.dsn
+
+
+def test_config_override_is_isolated_between_threads():
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    from src import config
+
+    barrier = threading.Barrier(2)
+
+    def tenant(chat_id):
+        with config.override(MAIN_CHAT_ID=chat_id):
+            # Оба арендатора одновременно внутри override
+            barrier.wait(timeout=5)
+            seen = config.MAIN_CHAT_ID
+            barrier.wait(timeout=5)
+        return seen
+
+    with ThreadPoolExecutor(2) as pool:
+        assert list(pool.map(tenant, [100, 200])) == [100, 200]
+
+
+def test_daemon_duty_next_run(monkeypatch):
+    import contextlib
+
+    from src import daemon
+
+    def broken():
+        raise RuntimeError("db is down")
+
+    # Срок ближайшего события сокращает ожидание, но не продлевает его сверх интервала
+    assert daemon.Duty("make", None, 10).delay() == 600
+    assert daemon.Duty("events", None, 10, lambda: 30).delay() == 30
+    assert daemon.Duty("events", None, 10, lambda: 3600).delay() == 600
+    assert daemon.Duty("events", None, 10, lambda: None).delay() == 600
+    assert daemon.Duty("events", None, 10, broken).delay() == 600
+
+    class Client:
+        def is_connected(self):
+            return True
+
+    def failing_duty(client, digest):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(daemon, "record_run", lambda command: contextlib.nullcontext())
+    monkeypatch.setattr(daemon.AdminDigest, "send", lambda self, client: None)
+    monkeypatch.setattr(daemon.time, "monotonic", lambda: 1000.0)
+
+    # Упавшая задача не останавливает демон и запускается снова через свой интервал
+    duty = daemon.Duty("clean", failing_duty, 5, lambda: 60)
+    daemon.BirthdayDaemon(Client(), [duty]).run_duty(duty)
+    assert duty.next_run == 1060
+
+
+def test_log_file_rotates_into_gzip_with_json_lines(tmp_path):
+    import gzip
+    import json
+    import logging
+
+    from src import logger
+
+    path = str(tmp_path / "bot.log")
+    with logger.config.override(LOG_FILE=path, LOG_ROTATION="size", LOG_MAX_BYTES=200, LOG_BACKUP_COUNT=2):
+        handler = logger.make_file_handler()
+    handler.setFormatter(logger.JsonFormatter())
+
+    for i in range(10):
+        handler.handle(logging.makeLogRecord({"msg": "Чат %s создан", "args": (i,), "levelname": "INFO"}))
+    handler.close()
+
+    # Старые файлы сжимаются, и хранится не больше LOG_BACKUP_COUNT
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["bot.log", "bot.log.1.gz", "bot.log.2.gz"]
+    with gzip.open(path + ".1.gz", "rt", encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    with open(path, encoding="utf-8") as f:
+        entries += [json.loads(line) for line in f]
+    assert entries[-1]["message"] == "Чат 9 создан" and entries[-1]["level"] == "INFO"
+
+
+def test_profiled_keeps_a_profiler_per_thread(monkeypatch):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    from src import profiling
+
+    dumps = []
+    monkeypatch.setattr(profiling, "dump", lambda profiler, name: dumps.append(name))
+    barrier = threading.Barrier(2)
+
+    @profiling.profiled("inner")
+    def inner():
+        return profiling.active_profiler()
+
+    @profiling.profiled("tenant")
+    def tenant():
+        profiler = profiling.active_profiler()
+        # Оба потока одновременно внутри профилируемой функции.
+        # Вложенный вызов попадает в профиль своего потока, а не чужого
+        barrier.wait(timeout=5)
+        nested = inner()
+        barrier.wait(timeout=5)
+        with profiling.paused():
+            barrier.wait(timeout=5)
+        return profiler is nested
+
+    def run():
+        with profiling.config.override(PROFILE=True, PROFILE_EXCLUDE_SLEEP=True):
+            return tenant()
+
+    with ThreadPoolExecutor(2) as pool:
+        assert list(pool.map(lambda _: run(), range(2))) == [True, True]
+
+    assert profiling.active_profiler() is None
+    # Параллельный профиль пропускается только там, где cProfile не позволяет два профилировщика
+    assert dumps and set(dumps) == {"tenant"}
+
+
+def test_outbox_is_claimed_by_the_chat_tenant(monkeypatch):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    from src import data
+    from src.models import Base, Chat, OutboxMessage
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine, tables=[Chat.__table__, OutboxMessage.__table__])
+    monkeypatch.setattr(data.config, "get_engine", lambda: engine)
+
+    with Session(engine) as session:
+        session.add_all(
+            [
+                Chat(chat_id=1, tenant_id=1, invite_link="l1", bdayer_id=1),
+                Chat(chat_id=2, tenant_id=2, invite_link="l2", bdayer_id=2),
+            ]
+        )
+        session.commit()
+
+    # Уведомление принадлежит арендатору чата, даже если поставлено в задаче другого арендатора
+    with data.config.override(TENANT_ID=1):
+        assert data.enqueue_chat_notification(1, "birthday", "a")
+        assert data.enqueue_chat_notification(2, "birthday", "b")
+
+    # Каждый арендатор отправляет со своего аккаунта только сообщения своих чатов
+    with data.config.override(TENANT_ID=2):
+        assert [message.chat_id for message in data.claim_outbox(10, 300)] == [2]
+    with data.config.override(TENANT_ID=1):
+        assert [message.chat_id for message in data.claim_outbox(10, 300)] == [1]
+
+
+def test_create_party_retry_resumes_existing_chat(monkeypatch):
+    import contextlib
+
+    from src import planning
+    from src.models import Chat
+
+    calls = []
+
+    class PartyMaker:
+        def __init__(self, client, main_chat_id, bdayer, digest):
+            pass
+
+        def attach_channel(self, chat_id):
+            calls.append(("attach", chat_id))
+
+        def make_party(self):
+            calls.append(("make",))
+
+    chats = [Chat(chat_id=7, bdayer_id=55555)]
+    monkeypatch.setattr(planning, "PartyMaker", PartyMaker)
+    monkeypatch.setattr(planning, "signin", lambda api_id, api_hash: contextlib.nullcontext())
+    monkeypatch.setattr(planning, "record_run", lambda command: contextlib.nullcontext())
+    monkeypatch.setattr(planning.data, "get_user", lambda tg_id: test_users[0])
+    monkeypatch.setattr(planning.data, "get_active_chats_for_user", lambda tg_id: chats)
+
+    with planning.config.override(BOT_API_ID=1, BOT_API_HASH="h", MAIN_CHAT_ID=1):
+        # Повтор задачи Airflow продолжает созданный чат, а не создает второй
+        planning.create_party(55555)
+        chats.clear()
+        planning.create_party(55555)
+
+    assert calls == [("attach", 7), ("make",), ("make",)]
+
+
+def test_send_dm_counts_invites_atomically(monkeypatch, tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from sqlalchemy import create_engine
+
+    from src import data, taskqueue
+    from src.models import Base, Chat
+
+    # Файловая БД: у каждого воркера свое соединение, как с MySQL
+    engine = create_engine(f"sqlite:///{tmp_path / 'bot.db'}")
+    Base.metadata.create_all(engine, tables=[Chat.__table__])
+    monkeypatch.setattr(data.config, "get_engine", lambda: engine)
+    data.chat_create(7, "l1", 55555, "Ваня")
+
+    class PartyMaker:
+        # Оба воркера прочитали счетчик до того, как другой его увеличил
+        invited_before = 0
+
+        def __init__(self):
+            self.successfully_invited = []
+
+        def send_unable_message(self, user):
+            self.successfully_invited.append(user)
+
+    monkeypatch.setattr(taskqueue, "make_party_maker", lambda client, payload, digest: PartyMaker())
+    monkeypatch.setattr(taskqueue.data, "get_user", lambda tg_id: User(tg_id=tg_id))
+
+    with ThreadPoolExecutor(2) as pool:
+        list(pool.map(lambda tg_id: taskqueue.send_dm(None, {"chat_id": 7, "tg_id": tg_id}, None), [1, 2]))
+
+    assert data.get_chat(7).users_invited == 2
+
+
+def test_event_runner_seeds_repository_with_event_chat(monkeypatch):
+    from datetime import datetime
+
+    from src import scheduler
+    from src.data import DueEvent
+    from src.models import Chat
+
+    chat = Chat(id=10, chat_id=7, bdayer_id=55555, is_active=True)
+
+    def load_all():
+        raise AssertionError("полный снимок БД не нужен")
+
+    monkeypatch.setattr(scheduler.data, "get_all_users", load_all)
+    monkeypatch.setattr(scheduler.data, "get_chat", lambda chat_id: chat)
+    monkeypatch.setattr(scheduler.data, "get_user", lambda tg_id: User(tg_id=tg_id, is_active=True))
+
+    cleaned = []
+
+    class PartyCleaner:
+        def __init__(self, client, digest, repo):
+            self.repo = repo
+
+        def clean_chats(self, chats):
+            cleaned.append((chats, self.repo.chat_bdayer(7).tg_id, self.repo.active_chats()))
+            return {chat.chat_id for chat in chats}
+
+    monkeypatch.setattr(scheduler, "PartyCleaner", PartyCleaner)
+
+    runner = scheduler.EventRunner(client=None)
+    runner.delete_chat(DueEvent(1, "delete_chat", 55555, 7, datetime.now(), 1))
+
+    assert cleaned == [([chat], 55555, [chat])]
@@ -0,0 +1,79 @@
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Optional
+
+
+class RunTrace:
+    """
+    Трасса одного запуска: длительности этапов, количество вызовов API и время пауз
+    """
+
+    def __init__(self, command: str):
+        self.command = command
+        self.started_at: datetime = datetime.now()
+        self.finished_at: Optional[datetime] = None
+        self.status: str = "running"
+        self.error: Optional[str] = None
+
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.api_calls: Counter = Counter()
+        self.sleep_seconds: float = 0.0
+
+    @property
+    def duration(self) -> float:
+        finished_at = self.finished_at or datetime.now()
+        return (finished_at - self.started_at).total_seconds()
+
+    def add_stage(self, name: str, seconds: float, failed: bool = False) -> None:
+        stage = self.stages.setdefault(name, {"seconds": 0.0, "count": 0, "errors": 0})
+        stage["seconds"] += seconds
+        stage["count"] += 1
+        stage["errors"] += int(failed)
+
+    def __repr__(self):
+        return "RunTrace(command=%s, status='%s', duration='%.1f')" % (
+            self.command,
+            self.status,
+            self.duration,
+        )
+
+
+# Трасса текущего запуска. None, если запуск не трассируется.
+# ContextVar, чтобы запуски арендаторов в разных потоках писали каждый в свою трассу
+_current: ContextVar[Optional[RunTrace]] = ContextVar("trace", default=None)
+
+
+def start(command: str) -> RunTrace:
+    trace = RunTrace(command)
+    _current.set(trace)
+    return trace
+
+
+def finish(status: str, error: str = None) -> Optional[RunTrace]:
+    trace = _current.get()
+    _current.set(None)
+
+    if trace is not None:
+        trace.finished_at = datetime.now()
+        trace.status = status
+        trace.error = error
+    return trace
+
+
+def record_stage(name: str, seconds: float, failed: bool = False) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.add_stage(name, seconds, failed)
+
+
+def record_api_call(request: str) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.api_calls[request] += 1
+
+
+def record_sleep(seconds: float) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.sleep_seconds += seconds
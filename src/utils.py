@@ -1,17 +1,42 @@
+import calendar
 from datetime import datetime
-from typing import List, Type
+from typing import TYPE_CHECKING, List, NamedTuple, Optional, Set, Type, Union
 
 import pandas as pd
 from telethon.sync import TelegramClient
 
 import config
 import data
+import metrics
+import profiling
+import ratelimit
+from digest import AdminDigest
 from logger import logging
 from models import User
 
+if TYPE_CHECKING:
+    from repository import Repository
+    from session_store import DBSession
+
+
+def make_telegram_session() -> Union[str, "DBSession"]:
+    """
+    Возвращает сессию телеграма согласно config.SESSION_BACKEND
+
+    :return: имя файла сессии или сессия, хранящаяся в БД
+    """
+    if config.SESSION_BACKEND == "db":
+        from session_store import DBSession
+
+        return DBSession(config.SESSION_NAME)
+
+    return config.SESSION_NAME
+
 
 def signin(bot_api_id: int, bot_api_hash: str) -> TelegramClient:
-    client = TelegramClient("bot", bot_api_id, bot_api_hash)
+    client = TelegramClient(make_telegram_session(), bot_api_id, bot_api_hash)
+    metrics.instrument_client(client)
+    ratelimit.limit_client(client)
     client.connect()
     if not client.is_user_authorized():
         client.send_code_request(config.BOT_PHONE)
@@ -25,8 +50,9 @@ class FindBirthday:
     Отвечает за поиск потенциальных именинников в списке пользователей
     """
 
-    def __init__(self, user_list: List[User]):
+    def __init__(self, user_list: List[User], repo: "Repository" = None):
         self.user_list = user_list
+        self.repo = repo
         self.birthday_users = []
 
         self.get_birthday_users()
@@ -43,10 +69,13 @@ class FindBirthday:
             try:
                 if user.is_active:
                     assert self.check_birthday(user.birth_month, user.birth_day)
-                    assert self.check_chat_not_created(user.tg_id)
+                    if self.repo is not None:
+                        assert not self.repo.active_chats_for_user(user.tg_id)
+                    else:
+                        assert self.check_chat_not_created(user.tg_id)
                     self.birthday_users.append(user)
                 else:
-                    logging.info("Not Active User: {user}")
+                    logging.info("Not Active User: %s", user)
             except AssertionError:
                 continue
         return self.birthday_users
@@ -55,28 +84,32 @@ class FindBirthday:
     def check_birthday(
         birth_month: int,
         birth_day: int,
-        before=config.DAYS_BEFORE,
-        after=config.DAYS_AFTER,
+        before: int = None,
+        after: int = None,
     ) -> bool:
         """
         Получает на вход день рождения и проверяет, должен ли существовать чат
 
         :param birth_day: Календарный день рождения пользователя.
         :param birth_month: Календарный месяц рождения пользователя.
-        :param before: За сколько дней до дня рождения должен создаваться чат.
-        :param after: Сколько дней после ДР должен существовать чат.
+        :param before: За сколько дней до дня рождения должен создаваться чат. По умолчанию config.DAYS_BEFORE.
+        :param after: Сколько дней после ДР должен существовать чат. По умолчанию config.DAYS_AFTER.
         Внимание: при повышении значения может появиться нехватка счетов для сбора.
         :return: True - если чат пора создавать, False - если нет.
         """
+        if before is None:
+            before = config.DAYS_BEFORE
+        if after is None:
+            after = config.DAYS_AFTER
 
         today = pd.Timestamp(datetime.now())
 
-        bdate = pd.Timestamp(today.year, birth_month, birth_day)
+        bdate = FindBirthday.birthday_in_year(today.year, birth_month, birth_day)
         chat_creation_date = bdate - pd.DateOffset(before)
 
         # Обработка дней рождения создаваемых в конце декабря на следующий год
         if chat_creation_date.year != today.year:
-            bdate = pd.Timestamp(today.year + 1, birth_month, birth_day)
+            bdate = FindBirthday.birthday_in_year(today.year + 1, birth_month, birth_day)
 
         bday_interval = pd.Interval(
             bdate - pd.DateOffset(before), bdate + pd.DateOffset(after), closed="right"
@@ -94,9 +127,23 @@ class FindBirthday:
         """
 
         today = pd.Timestamp(datetime.now().date())
-        bdate = pd.Timestamp(today.year, birth_month, birth_day)
+        bdate = FindBirthday.birthday_in_year(today.year, birth_month, birth_day)
         return True if bdate == today else False
 
+    @staticmethod
+    def birthday_in_year(year: int, birth_month: int, birth_day: int) -> pd.Timestamp:
+        """
+        Дата дня рождения в указанном году. В невисокосный год 29 февраля празднуется 28-го
+
+        :param year: год
+        :param birth_month: Календарный месяц рождения пользователя.
+        :param birth_day: Календарный день рождения пользователя.
+        :return: дата дня рождения
+        """
+        if birth_month == 2 and birth_day == 29 and not calendar.isleap(year):
+            birth_day = 28
+        return pd.Timestamp(year, birth_month, birth_day)
+
     @staticmethod
     def check_chat_not_created(user_id: int):
         """
@@ -109,99 +156,142 @@ class FindBirthday:
         return True if len(chats) == 0 else False
 
 
+class ChatMember(NamedTuple):
+    """
+    Компактное представление участника чата, которого нет в БД
+    """
+
+    id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+
+
 class ChatTools:
+    """
+    Сверяет состав основного чата с таблицей users.
+    Участники чата читаются потоком через iter_participants и хранятся в виде множества id,
+    поэтому память не растет вместе с объектами Telethon даже для очень больших чатов.
+    """
 
-    def __init__(self, client: TelegramClient, chat_id: int):
+    def __init__(self, client: TelegramClient, chat_id: int, repo: "Repository" = None):
         self.client = client
+        self.chat_id = chat_id
+        self.repo = repo
         self.bot = self.client.get_me()
 
-        self.all_users_in_db = data.get_all_users()
-        self.all_users_in_db_ids = [x.tg_id for x in self.all_users_in_db]
+        if repo is not None:
+            self.all_users_in_db_ids: Set[int] = repo.all_user_ids()
+            self.active_users_in_db = repo.active_users()
+        else:
+            self.all_users_in_db_ids: Set[int] = data.get_all_user_ids()
+            self.active_users_in_db = data.get_active_users()
+        self.active_users_in_db_ids: Set[int] = {
+            x.tg_id for x in self.active_users_in_db
+        }
+
+        self.users_in_chat_ids: Set[int] = set()
+        self.users_not_in_db: List[ChatMember] = []
+        self.load_chat_members()
+
+    @profiling.profiled("chat_members")
+    def load_chat_members(self) -> None:
+        """
+        Потоково читает участников чата и запоминает только их id.
+        Полные данные сохраняются лишь для тех, кого нет в БД.
 
-        self.active_users_in_db = data.get_active_users()
-        self.active_users_in_db_ids = [x.tg_id for x in self.active_users_in_db]
+        :return: None
+        """
+        for participant in self.client.iter_participants(
+            self.chat_id, aggressive=True
+        ):
+            if participant.id == self.bot.id:
+                continue
 
-        participants = client.get_participants(chat_id, aggressive=True)
-        self.users_in_chat = [u for u in participants if u.id != self.bot.id]
-        self.users_in_chat_ids = [x.id for x in self.users_in_chat]
+            self.users_in_chat_ids.add(participant.id)
+            if participant.id not in self.all_users_in_db_ids:
+                self.users_not_in_db.append(
+                    ChatMember(
+                        participant.id,
+                        participant.username,
+                        participant.first_name,
+                        participant.last_name,
+                    )
+                )
 
+    @profiling.profiled("db_users_not_in_chat")
     def find_db_users_not_in_chat(self) -> List[Type[User]]:
         """
         Находит пользователей, которые есть в БД, но отсутствуют в чате.
 
-        :return: Список tg_id пользователей
+        :return: Список пользователей
         """
-        not_in_chat_ids = list(
-            set(self.active_users_in_db_ids).difference(self.users_in_chat_ids)
-        )
-        users = [u for u in self.active_users_in_db if u.tg_id in not_in_chat_ids]
+        users = [
+            u for u in self.active_users_in_db if u.tg_id not in self.users_in_chat_ids
+        ]
         logging.info(
-            f"Найдены активные пользователи не состоящие в чате: {users}",
+            "Найдены активные пользователи не состоящие в чате: %s", users,
         )
         return users
 
-    def find_chat_users_not_in_db(self) -> list:
+    @profiling.profiled("chat_users_not_in_db")
+    def find_chat_users_not_in_db(self) -> List[ChatMember]:
         """
         Находит пользователей, которые есть в чате, но отсутствуют в БД.
 
-        :return: Список tg_id пользователей
+        :return: Список участников чата
         """
-        not_in_db_ids = list(
-            set(self.users_in_chat_ids).difference(self.all_users_in_db_ids)
-        )
-        users = [u for u in self.users_in_chat if u.id in not_in_db_ids]
+        users = list(self.users_not_in_db)
 
-        users_info = [(i.id, i.username, i.first_name, i.last_name) for i in users]
+        users_info = [tuple(u) for u in users]
         logging.info(
-            f"Найдены пользователи чата, не добавленные в БД: {users_info}",
+            "Найдены пользователи чата, не добавленные в БД: %s", users_info,
         )
         return users
 
-    def remove_users_from_db(self):
+    def remove_users_from_db(self, digest: AdminDigest = None):
         """
-        Удаляет из БД пользователей, которые покинули чат ЦПУ
+        Удаляет из БД пользователей, которые покинули чат ЦПУ.
+        Деактивация выполняется одним UPDATE для всех ушедших пользователей.
 
+        :param digest: сводка для администраторов. Если не передана - отправляется сразу
         :return: None
         """
 
-        users_to_remove = self.find_db_users_not_in_chat()
-        for user in users_to_remove:
+        own_digest = digest is None
+        if own_digest:
+            digest = AdminDigest()
 
+        users_to_remove = self.find_db_users_not_in_chat()
+        if users_to_remove:
             try:
-                data.deactivate_user(user.tg_id)
-
-                # Оповещаем администраторов об удаленном пользователе
-                for tg_id in config.ADMIN_IDS:
-                    self.client.send_message(
-                        tg_id,
-                        f"""Удален пользователь 
-                                                    {user.short_name} {user.last_name}
-                                                    , так как он покинул чат ЦПУ""",
-                    )
+                deactivate = self.repo.deactivate_users if self.repo is not None else data.deactivate_users
+                deactivate([user.tg_id for user in users_to_remove])
+                for user in users_to_remove:
+                    digest.user_departed(user.short_name, user.last_name)
 
             except Exception as e:
-                # Оповещаем администраторов об ошибке
-                for tg_id in config.ADMIN_IDS:
-                    self.client.send_message(
-                        tg_id,
-                        f"""Не удалось удалить пользователя 
-                                             {user.short_name} {user.last_name}\n
-                                             Ошибка: {e}""",
+                for user in users_to_remove:
+                    digest.failure(
+                        f"Не удалось удалить пользователя {user.short_name} {user.last_name}: {e}"
                     )
 
-    def notify_about_new_users(self):
+        if own_digest:
+            digest.send(self.client)
+
+    def notify_about_new_users(self, digest: AdminDigest = None):
         """
         Уведомить администраторов о новых пользователях, чтобы они добавили их ФИО и ДР в БД
 
+        :param digest: сводка для администраторов. Если не передана - отправляется сразу
         :return: None
         """
-        new_users = self.find_chat_users_not_in_db()
+        own_digest = digest is None
+        if own_digest:
+            digest = AdminDigest()
 
-        for user in new_users:
-            for tg_id in config.ADMIN_IDS:
-                self.client.send_message(
-                    tg_id,
-                    f"""Новый пользователь в чате: 
-                                                {user.short_name} {user.last_name}\n\n
-                                                Пожалуйста, добавьте его ФИО и ДР""",
-                )
+        for user in self.find_chat_users_not_in_db():
+            digest.new_user(user.id, user.username, user.first_name, user.last_name)
+
+        if own_digest:
+            digest.send(self.client)